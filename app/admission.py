@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import os
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+
+from .utils import open_sqlite
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inflight (
+    trace_id TEXT PRIMARY KEY,
+    lane TEXT NOT NULL,
+    audio_seconds REAL NOT NULL,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+LANE_STANDARD = "standard"
+LANE_LONG = "long"
+_COUNTER_NAMES = ("admitted", "admitted_long", "shed", "shed_long")
+
+
+class OverCapacityError(RuntimeError):
+    """Сервис уже обрабатывает максимум аудио; повторить через retry_after секунд."""
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class Admission:
+    """Место запроса в учёте; release() освобождает его."""
+
+    ledger: "AdmissionLedger"
+    trace_id: str
+    lane: str
+    audio_seconds: float
+
+    def release(self) -> None:
+        self.ledger.release(self.trace_id)
+
+
+class AdmissionLedger:
+    """
+    Учёт минут аудио, которые обрабатываются всеми воркерами прямо сейчас.
+
+    Запрос с известной по предварительному probe длительностью занимает
+    место до конца обработки. Ролики длиннее long_job_seconds идут в
+    отдельную полосу с long_job_slots местами и в общую ёмкость не
+    входят, чтобы длинные задачи не вытесняли обычные. Если места нет,
+    admit() поднимает OverCapacityError с рекомендуемым Retry-After.
+    Записи умерших воркеров (по pid) и старше entry_ttl_seconds
+    удаляются при каждой проверке. Ёмкость 0 отключает ограничение.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        capacity_audio_seconds: float,
+        long_job_seconds: float,
+        long_job_slots: int,
+        retry_after_seconds: float = 30.0,
+        entry_ttl_seconds: float = 6 * 3600.0,
+    ) -> None:
+        self.path = path
+        self.capacity_audio_seconds = capacity_audio_seconds
+        self.long_job_seconds = long_job_seconds
+        self.long_job_slots = long_job_slots
+        self.retry_after_seconds = retry_after_seconds
+        self.entry_ttl_seconds = entry_ttl_seconds
+        with closing(open_sqlite(self.path)) as connection:
+            connection.executescript(_SCHEMA)
+
+    def lane_for(self, audio_seconds: float) -> str:
+        if self.long_job_seconds > 0 and audio_seconds > self.long_job_seconds:
+            return LANE_LONG
+        return LANE_STANDARD
+
+    def admit(self, trace_id: str, audio_seconds: float) -> Admission:
+        lane = self.lane_for(audio_seconds)
+        now = time.time()
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self._purge(connection, now)
+            jobs, inflight = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(audio_seconds), 0) FROM inflight WHERE lane = ?", (lane,)
+            ).fetchone()
+
+            if lane == LANE_LONG:
+                rejected = self.long_job_slots > 0 and jobs >= self.long_job_slots
+                reason = f"all {self.long_job_slots} long-job slots are busy"
+            else:
+                # Одиночный запрос больше ёмкости всё равно пропускаем, иначе он не пройдёт никогда
+                rejected = self.capacity_audio_seconds > 0 and jobs > 0 and (
+                    inflight + audio_seconds > self.capacity_audio_seconds
+                )
+                reason = (
+                    f"{inflight / 60:.0f} of {self.capacity_audio_seconds / 60:.0f} audio minutes are in flight"
+                )
+            if rejected:
+                _increment(connection, "shed_long" if lane == LANE_LONG else "shed")
+                connection.execute("COMMIT")
+                retry_after = self.retry_after_seconds * (4 if lane == LANE_LONG else 1)
+                raise OverCapacityError(f"Service is at capacity: {reason}", retry_after=retry_after)
+
+            connection.execute(
+                "INSERT OR REPLACE INTO inflight (trace_id, lane, audio_seconds, pid, started_at) VALUES (?, ?, ?, ?, ?)",
+                (trace_id, lane, audio_seconds, os.getpid(), now),
+            )
+            _increment(connection, "admitted_long" if lane == LANE_LONG else "admitted")
+            connection.execute("COMMIT")
+        return Admission(self, trace_id, lane, audio_seconds)
+
+    def release(self, trace_id: str) -> None:
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute("DELETE FROM inflight WHERE trace_id = ?", (trace_id,))
+
+    def stats(self) -> Dict[str, float]:
+        with closing(open_sqlite(self.path)) as connection:
+            counters = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+            lanes = {
+                lane: (jobs, audio_seconds)
+                for lane, jobs, audio_seconds in connection.execute(
+                    "SELECT lane, COUNT(*), SUM(audio_seconds) FROM inflight GROUP BY lane"
+                ).fetchall()
+            }
+        result: Dict[str, float] = {name: int(counters.get(name, 0)) for name in _COUNTER_NAMES}
+        jobs, audio_seconds = lanes.get(LANE_STANDARD, (0, 0.0))
+        result["inflight_jobs"] = jobs
+        result["inflight_audio_minutes"] = round(audio_seconds / 60, 1)
+        result["capacity_audio_minutes"] = round(self.capacity_audio_seconds / 60, 1)
+        jobs, audio_seconds = lanes.get(LANE_LONG, (0, 0.0))
+        result["long_jobs"] = jobs
+        result["long_audio_minutes"] = round(audio_seconds / 60, 1)
+        result["long_job_slots"] = self.long_job_slots
+        return result
+
+    def _purge(self, connection, now: float) -> None:
+        connection.execute("DELETE FROM inflight WHERE started_at < ?", (now - self.entry_ttl_seconds,))
+        for (pid,) in connection.execute("SELECT DISTINCT pid FROM inflight").fetchall():
+            if not _pid_alive(pid):
+                # Воркер убит (например, по таймауту gunicorn) и не успел освободить место
+                connection.execute("DELETE FROM inflight WHERE pid = ?", (pid,))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _increment(connection, name: str, amount: float = 1) -> None:
+    connection.execute(
+        "INSERT INTO counters (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        (name, amount),
+    )
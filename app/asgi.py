@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import json
+import math
+import threading
+import traceback
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from .async_pipeline import analyze_async, async_stats
+from .metrics import render_metrics
+from .models import AnalyzeRequest
+from .pipeline import PipelineError, collect_stats, warm_up
+from .utils import generate_trace_id
+
+# ASGI-вариант сервиса: один процесс обслуживает десятки одновременных
+# анализов, ожидая yt-dlp, ffmpeg и Whisper без потока на запрос.
+# Запуск: uvicorn app.asgi:app (см. start_async.sh). Поддерживаются
+# POST /analyze с тем же телом и ответом, что во Flask-приложении, и
+# GET /stats и /metrics; очередь /jobs, пакеты и стриминг остаются в app.main.
+
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_MAX_BODY_BYTES = 1024 * 1024
+
+
+async def app(scope: Dict[str, Any], receive: Receive, send: Send) -> None:
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"].rstrip("/") or "/"
+    if path == "/analyze" and method == "POST":
+        status, payload, headers = await _analyze(receive)
+    elif path == "/stats" and method == "GET":
+        status, payload, headers = 200, _stats(), []
+    elif path == "/metrics" and method == "GET":
+        body, content_type = render_metrics()
+        await _send_body(send, 200, body, content_type.encode("ascii"), [])
+        return
+    else:
+        status, payload, headers = 404, {"error": "Not Found", "trace_id": generate_trace_id()}, []
+    await _send_json(send, status, payload, headers)
+
+
+async def _analyze(receive: Receive) -> Tuple[int, dict, List[Tuple[bytes, bytes]]]:
+    trace_id = generate_trace_id()
+    headers = [(b"x-trace-id", trace_id.encode("ascii"))]
+
+    try:
+        body = await _read_body(receive)
+        request_data = AnalyzeRequest.model_validate(json.loads(body or b"null"))
+    except (ValueError, ValidationError) as exc:
+        return 400, {"error": f"Некорректный запрос: {exc}", "trace_id": trace_id}, headers
+
+    try:
+        return 200, await analyze_async(request_data, trace_id), headers
+    except PipelineError as exc:
+        if exc.retry_after is not None:
+            headers.append((b"retry-after", str(math.ceil(exc.retry_after)).encode("ascii")))
+        return exc.status, {"error": exc.message, "trace_id": trace_id}, headers
+    except Exception as exc:
+        print(f"[{trace_id}] ❌ Unexpected error: {exc}")
+        traceback.print_exc()
+        return 500, {"error": f"Неожиданная ошибка: {exc}", "trace_id": trace_id}, headers
+
+
+def _stats() -> dict:
+    payload = collect_stats()
+    payload["async"] = async_stats()
+    return payload
+
+
+async def _read_body(receive: Receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ValueError("client disconnected")
+        body.extend(message.get("body", b""))
+        if len(body) > _MAX_BODY_BYTES:
+            raise ValueError("request body is too large")
+        if not message.get("more_body", False):
+            return bytes(body)
+
+
+async def _send_json(send: Send, status: int, payload: dict, headers: List[Tuple[bytes, bytes]]) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await _send_body(send, status, body, b"application/json", headers)
+
+
+async def _send_body(
+    send: Send, status: int, body: bytes, content_type: bytes, headers: List[Tuple[bytes, bytes]]
+) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode("ascii")),
+                *headers,
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Прогрев в потоке: приём запросов не ждёт загрузки openai и yt-dlp
+            threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+            print("[INFO] ASGI app started")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .audio_extractor import AudioExtractionError, extract_audio_async
+from .captions import CaptionsError, fetch_captions
+from .downloader import DownloadError, download_video
+from .metadata_processor import normalize_metadata
+from .metrics import DOWNLOADED_BYTES, platform_label, track_stage
+from .models import AnalyzeRequest
+from .pipeline import (
+    AUDIO_FORMAT,
+    AUDIO_ONLY_DOWNLOAD,
+    CHUNK_EQUAL_LENGTH,
+    TRANSCRIPT_SOURCE_WHISPER,
+    VAD_ENABLED,
+    VAD_MIN_SILENCE_SECONDS,
+    VAD_NOISE_DB,
+    VAD_PADDING_SECONDS,
+    WHISPER_MAX_CONCURRENCY,
+    WHISPER_MODEL,
+    AnalysisState,
+    PipelineError,
+    _admit,
+    _quota_exhausted,
+    _restore_audio,
+    _retain_audio,
+    begin_analysis,
+    checkpoint_store,
+    choose_backend,
+    complete_analysis,
+    rate_governor,
+)
+from .tracing import bind_context, trace
+from .transcriber import QuotaWaitError, TranscriptionError, transcribe_audio_async
+from .vad import VadError, trim_silence
+
+# Сколько анализов одновременно выполняет один процесс в ASGI-режиме
+ASYNC_MAX_JOBS = int(os.getenv("ASYNC_MAX_JOBS", "32"))
+# yt-dlp синхронный: скачивания идут в отдельном ограниченном пуле потоков
+ASYNC_DOWNLOAD_WORKERS = int(os.getenv("ASYNC_DOWNLOAD_WORKERS", "8"))
+# Одновременных процессов ffmpeg (извлечение аудио и VAD)
+ASYNC_FFMPEG_PROCESSES = int(os.getenv("ASYNC_FFMPEG_PROCESSES", str(os.cpu_count() or 2)))
+
+# Короткие блокирующие шаги: SQLite, субтитры, ожидание single-flight
+_blocking_executor = ThreadPoolExecutor(max_workers=max(4, ASYNC_MAX_JOBS), thread_name_prefix="async-blocking")
+_download_executor = ThreadPoolExecutor(max_workers=max(1, ASYNC_DOWNLOAD_WORKERS), thread_name_prefix="async-download")
+
+_job_slots: Optional[asyncio.Semaphore] = None
+_ffmpeg_slots: Optional[asyncio.Semaphore] = None
+_active_jobs = 0
+
+
+async def analyze_async(request_data: AnalyzeRequest, trace_id: str) -> dict:
+    """
+    Асинхронный вариант run_analysis для ASGI-приложения.
+
+    Этапы и ответ те же, что у /analyze в Flask: кэш, single-flight,
+    сохранённое аудио и контрольные точки общие с синхронными воркерами.
+    Потоковый режим (STREAMING_MODE) здесь не используется - видео
+    всегда скачивается файлом.
+    """
+    global _active_jobs
+    async with _slots()[0]:
+        _active_jobs += 1
+        try:
+            with trace(trace_id, "analyze_async", url=str(request_data.url)):
+                state = await _run_blocking(begin_analysis, request_data, trace_id)
+                try:
+                    if state.payload is not None:
+                        return state.payload
+                    await _prepare_media(state)
+                    transcription = state.transcription
+                    if transcription is None:
+                        transcription = await _transcribe(state)
+                    return await _run_blocking(complete_analysis, state, transcription)
+                finally:
+                    await _run_blocking(state.close)
+        finally:
+            _active_jobs -= 1
+
+
+async def _prepare_media(state: AnalysisState) -> None:
+    """Этапы 0-3: субтитры, скачивание, извлечение аудио, VAD и метаданные."""
+    trace_id, work_dir, cleanup_targets = state.trace_id, state.work_dir, state.cleanup_targets
+    transcription = None
+    transcript_source = TRANSCRIPT_SOURCE_WHISPER
+    raw_metadata = None
+
+    if state.prefer_captions:
+        try:
+            print(f"[{trace_id}] Этап 0: Поиск субтитров ({', '.join(state.caption_languages)})...")
+            captions = await _run_blocking(fetch_captions, state.url, state.caption_languages, state.probe_info)
+        except CaptionsError as exc:
+            print(f"[{trace_id}] ⚠️  Не удалось получить субтитры: {exc}")
+            captions = None
+        if captions is not None:
+            transcription = captions.transcription
+            transcript_source = captions.source
+            raw_metadata = captions.metadata
+            print(f"[{trace_id}] ✅ Найдены субтитры ({captions.source}, {transcription.language}): {len(transcription.segments)} сегментов")
+        else:
+            print(f"[{trace_id}] Субтитров на допустимом языке нет, используем Whisper")
+            await _run_blocking(_admit, state)
+
+    audio_path = None
+    offset_map = None
+    restored = False
+    if transcription is None:
+        retained = await _run_blocking(_restore_audio, state.source_key, work_dir, trace_id)
+        if retained is not None:
+            audio_path, raw_metadata, offset_map = retained.audio_path, retained.metadata, retained.offset_map
+            restored = True
+            print(f"[{trace_id}] ✅ Используем аудио предыдущей неудачной попытки: {audio_path}")
+
+    if transcription is None and audio_path is None:
+        # Этап 1: Скачивание видео
+        try:
+            print(f"[{trace_id}] Этап 1: Скачивание видео через yt-dlp...")
+            download = functools.partial(
+                track_stage("download", state.platform)(download_video),
+                state.url,
+                work_dir,
+                trace_id,
+                platform=state.platform,
+                audio_only=AUDIO_ONLY_DOWNLOAD,
+                probe_info=state.probe_info,
+            )
+            video_path, raw_metadata = await asyncio.get_running_loop().run_in_executor(
+                _download_executor, bind_context(download)
+            )
+            cleanup_targets.append(video_path)
+            DOWNLOADED_BYTES.labels(platform=platform_label(state.platform)).inc(raw_metadata.downloaded_bytes)
+            print(f"[{trace_id}] ✅ Видео скачано: {video_path} ({raw_metadata.downloaded_bytes / 1024 / 1024:.2f} MB)")
+        except DownloadError as exc:
+            raise PipelineError(f"Ошибка скачивания видео (yt-dlp): {exc}", status=500) from exc
+        except Exception as exc:
+            raise PipelineError(f"Неожиданная ошибка при скачивании видео: {exc}", status=500) from exc
+
+        # Этап 2: Извлечение аудио
+        try:
+            print(f"[{trace_id}] Этап 2: Извлечение аудио через ffmpeg...")
+            async with _slots()[1]:
+                with track_stage("extract", state.platform):
+                    audio_path = await extract_audio_async(
+                        video_path,
+                        work_dir,
+                        trace_id,
+                        acodec=raw_metadata.acodec,
+                        vcodec=raw_metadata.vcodec,
+                        audio_format=AUDIO_FORMAT,
+                        source_bitrate_kbps=raw_metadata.audio_bitrate_kbps,
+                    )
+            cleanup_targets.append(audio_path)
+            print(f"[{trace_id}] ✅ Аудио извлечено: {audio_path} ({audio_path.stat().st_size / 1024 / 1024:.2f} MB)")
+        except AudioExtractionError as exc:
+            raise PipelineError(f"Ошибка извлечения аудио (ffmpeg): {exc}", status=500) from exc
+        except Exception as exc:
+            raise PipelineError(f"Неожиданная ошибка при извлечении аудио: {exc}", status=500) from exc
+
+    if transcription is None and VAD_ENABLED and not restored:
+        # Этап 2a: Удаление тишины; при ошибке продолжаем с полным аудио
+        try:
+            print(f"[{trace_id}] Этап 2a: Удаление неречевых участков (VAD)...")
+            async with _slots()[1]:
+                trim_result = await _run_blocking(
+                    lambda: track_stage("vad", state.platform)(trim_silence)(
+                        audio_path,
+                        work_dir,
+                        audio_format=AUDIO_FORMAT,
+                        noise_db=VAD_NOISE_DB,
+                        min_silence_seconds=VAD_MIN_SILENCE_SECONDS,
+                        padding_seconds=VAD_PADDING_SECONDS,
+                    )
+                )
+            if trim_result.audio_path != audio_path:
+                audio_path = trim_result.audio_path
+                cleanup_targets.append(audio_path)
+                offset_map = trim_result.offset_map
+            print(f"[{trace_id}] ✅ Удалено {trim_result.removed_ratio:.1%} аудио")
+        except VadError as exc:
+            print(f"[{trace_id}] ⚠️  VAD не сработал ({exc}), транскрибируем всё аудио")
+
+    # Этап 3: Обработка метаданных
+    try:
+        print(f"[{trace_id}] Этап 3: Обработка метаданных...")
+        state.normalized_metadata = normalize_metadata(state.platform, raw_metadata)
+    except Exception as exc:
+        raise PipelineError(f"Ошибка обработки метаданных: {exc}", status=500) from exc
+
+    state.transcription = transcription
+    state.transcript_source = transcript_source
+    state.raw_metadata = raw_metadata
+    state.audio_path = audio_path
+    state.offset_map = offset_map
+
+
+async def _transcribe(state: AnalysisState):
+    """Этап 4: Whisper через AsyncOpenAI или локальный движок; при ошибке аудио сохраняется для повтора."""
+    trace_id = state.trace_id
+    try:
+        backend = choose_backend(state)
+        print(f"[{trace_id}] Этап 4: Транскрибация ({backend.name})...")
+        with track_stage("transcribe", state.platform):
+            transcription = await transcribe_audio_async(
+                state.audio_path,
+                WHISPER_MODEL,
+                equal_chunks=CHUNK_EQUAL_LENGTH,
+                max_concurrency=WHISPER_MAX_CONCURRENCY,
+                rate_governor=rate_governor,
+                checkpoint=checkpoint_store,
+                source_key=state.source_key,
+                platform=platform_label(state.platform),
+                backend=backend,
+            )
+        if state.offset_map is not None:
+            transcription = state.offset_map.apply(transcription)
+        print(f"[{trace_id}] ✅ Транскрибация завершена: {len(transcription.segments)} сегментов, язык: {transcription.language}")
+        return transcription
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        print(f"[{trace_id}] ❌ Transcription failed: {exc}")
+        traceback.print_exc()
+        await _run_blocking(
+            _retain_audio, state.source_key, state.audio_path, state.raw_metadata, state.offset_map, trace_id
+        )
+        if isinstance(exc, QuotaWaitError):
+            raise _quota_exhausted(exc) from exc
+        if isinstance(exc, TranscriptionError):
+            raise PipelineError(f"Ошибка транскрибации: {exc}", status=500) from exc
+        raise PipelineError(f"Неожиданная ошибка при транскрибации: {exc}", status=500) from exc
+
+
+def async_stats() -> dict:
+    return {
+        "active_jobs": _active_jobs,
+        "max_jobs": ASYNC_MAX_JOBS,
+        "download_workers": ASYNC_DOWNLOAD_WORKERS,
+        "ffmpeg_processes": ASYNC_FFMPEG_PROCESSES,
+    }
+
+
+async def _run_blocking(func: Callable[..., Any], *args: Any) -> Any:
+    # run_in_executor, в отличие от asyncio.to_thread, не переносит contextvars
+    return await asyncio.get_running_loop().run_in_executor(_blocking_executor, bind_context(func), *args)
+
+
+def _slots():
+    # Семафоры создаются в цикле событий сервера, а не при импорте модуля
+    global _job_slots, _ffmpeg_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(max(1, ASYNC_MAX_JOBS))
+        _ffmpeg_slots = asyncio.Semaphore(max(1, ASYNC_FFMPEG_PROCESSES))
+    return _job_slots, _ffmpeg_slots
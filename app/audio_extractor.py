@@ -1,46 +1,371 @@
 from __future__ import annotations
 
+import asyncio
+import re
 import subprocess
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict, IO, List, Optional, Tuple
 
 
 class AudioExtractionError(RuntimeError):
     """Ошибка при извлечении аудио."""
 
 
-def extract_audio(video_path: Path, temp_dir: Path, trace_id: str) -> Path:
+# Контейнеры, которые Whisper API принимает без перекодирования
+WHISPER_ACCEPTED_EXTENSIONS = {"flac", "m4a", "mp3", "mp4", "mpeg", "mpga", "oga", "ogg", "wav", "webm"}
+
+_SILENCE_START = re.compile(r"silence_start:\s*(-?[\d.]+)")
+_SILENCE_END = re.compile(r"silence_end:\s*(-?[\d.]+)")
+
+# Размер блока при передаче потока из yt-dlp в ffmpeg
+_PIPE_BLOCK_SIZE = 256 * 1024
+
+# Во сколько раз исходный поток может превышать битрейт целевого формата,
+# чтобы его ещё было выгоднее копировать, чем перекодировать
+_PASSTHROUGH_BITRATE_FACTOR = 2.0
+
+# Кодек аудиопотока -> контейнер, в который его можно переложить без декодирования
+_PASSTHROUGH_CONTAINERS = {
+    "mp4a": "m4a",
+    "aac": "m4a",
+    "opus": "ogg",
+    "vorbis": "ogg",
+    "mp3": "mp3",
+    "flac": "flac",
+}
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    """Формат аудиофайла, который отправляется в Whisper API."""
+
+    name: str
+    extension: str
+    codec_args: Tuple[str, ...]
+    # Ожидаемый битрейт для 16kHz моно речи; точный размер чанков считается по факту
+    bitrate_kbps: float
+
+
+AUDIO_FORMATS: Dict[str, AudioFormat] = {
+    # Несжатый PCM: ~1.9 МБ в минуту, лимит 24 МБ наступает на ~12 минутах
+    "wav": AudioFormat("wav", "wav", ("-c:a", "pcm_s16le"), 256.0),
+    # Сжатие без потерь, для речи примерно вдвое меньше WAV
+    "flac": AudioFormat("flac", "flac", ("-c:a", "flac"), 130.0),
+    # Речевой Opus: 24 kbps - около 2 часов в одном запросе
+    "opus": AudioFormat("opus", "ogg", ("-c:a", "libopus", "-b:a", "24k", "-application", "voip"), 24.0),
+    "mp3": AudioFormat("mp3", "mp3", ("-c:a", "libmp3lame", "-b:a", "32k"), 32.0),
+}
+
+DEFAULT_AUDIO_FORMAT = AUDIO_FORMATS["wav"]
+
+
+def get_audio_format(name: str, bitrate_kbps: Optional[float] = None) -> AudioFormat:
+    """
+    Возвращает формат по имени (wav, flac, opus, mp3).
+
+    bitrate_kbps переопределяет битрейт для сжатых форматов с потерями.
     """
-    Конвертирует видеофайл в WAV (моно, 16kHz) с помощью ffmpeg.
+    audio_format = AUDIO_FORMATS.get(name.lower())
+    if audio_format is None:
+        raise ValueError(f"Unsupported audio codec: {name}. Expected one of: {', '.join(AUDIO_FORMATS)}")
+
+    if bitrate_kbps and "-b:a" in audio_format.codec_args:
+        args = list(audio_format.codec_args)
+        args[args.index("-b:a") + 1] = f"{int(bitrate_kbps)}k"
+        audio_format = AudioFormat(audio_format.name, audio_format.extension, tuple(args), float(bitrate_kbps))
+    return audio_format
 
-    Возвращает путь к созданному аудиофайлу.
+
+def probe_duration(path: Path) -> float:
+    """Возвращает длительность медиафайла в секундах (через ffprobe)."""
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-show_entries",
+        "format=duration",
+        "-of",
+        "default=noprint_wrappers=1:nokey=1",
+        str(path),
+    ]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+        return float(result.stdout.strip())
+    except (subprocess.CalledProcessError, ValueError) as exc:
+        raise AudioExtractionError(f"Failed to probe duration of {path}: {exc}") from exc
+
+
+def detect_silences(audio_path: Path, noise_db: float, min_silence_seconds: float) -> List[Tuple[float, float]]:
+    """
+    Находит участки тишины фильтром ffmpeg silencedetect.
+
+    Это энергетический детектор: всё тише noise_db дольше min_silence_seconds
+    считается неречью. Возвращает список (начало, конец) в секундах; у
+    последнего участка конец может быть float("inf").
+    """
+    command = [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        "-i",
+        str(audio_path),
+        "-af",
+        f"silencedetect=noise={noise_db}dB:d={min_silence_seconds}",
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as exc:
+        raise AudioExtractionError(f"silencedetect failed: {exc.stderr}") from exc
+
+    silences: List[Tuple[float, float]] = []
+    current_start = None
+    for line in result.stderr.splitlines():
+        start_match = _SILENCE_START.search(line)
+        if start_match:
+            current_start = max(0.0, float(start_match.group(1)))
+            continue
+        end_match = _SILENCE_END.search(line)
+        if end_match and current_start is not None:
+            silences.append((current_start, float(end_match.group(1))))
+            current_start = None
+
+    if current_start is not None:
+        silences.append((current_start, float("inf")))
+    return silences
+
+
+def extract_audio(
+    video_path: Path,
+    temp_dir: Path,
+    trace_id: str,
+    acodec: Optional[str] = None,
+    vcodec: Optional[str] = None,
+    audio_format: AudioFormat = DEFAULT_AUDIO_FORMAT,
+    source_bitrate_kbps: Optional[float] = None,
+) -> Path:
+    """
+    Готовит аудиофайл для Whisper API.
+
+    Если yt-dlp уже скачал чистый аудиопоток в подходящем контейнере, файл
+    возвращается как есть. Если кодек звука известен и пригоден, дорожка
+    перекладывается без декодирования (-c:a copy). Иначе файл конвертируется
+    в audio_format (моно, 16kHz) с помощью ffmpeg.
+
+    Возвращает путь к аудиофайлу.
     """
     if not video_path.exists():
         raise AudioExtractionError(f"Video file not found: {video_path}")
 
     temp_dir.mkdir(parents=True, exist_ok=True)
-    audio_path = temp_dir / f"{trace_id}.wav"
 
-    command = [
+    container = _passthrough_container(acodec, audio_format, source_bitrate_kbps)
+    if container and vcodec == "none" and video_path.suffix.lstrip(".").lower() in WHISPER_ACCEPTED_EXTENSIONS:
+        return video_path
+
+    if container:
+        audio_path = _output_path(temp_dir, trace_id, container, video_path)
+        try:
+            subprocess.run(_copy_command(str(video_path), audio_path), check=True)
+        except subprocess.CalledProcessError:
+            # Некоторые потоки не перекладываются в другой контейнер - декодируем полностью
+            audio_path.unlink(missing_ok=True)
+        else:
+            if audio_path.exists() and audio_path.stat().st_size > 0:
+                return audio_path
+
+    audio_path = _output_path(temp_dir, trace_id, audio_format.extension, video_path)
+
+    try:
+        subprocess.run(_decode_command(str(video_path), audio_path, audio_format), check=True)
+    except subprocess.CalledProcessError as exc:
+        raise AudioExtractionError(f"Failed to extract audio: {exc}") from exc
+
+    if not audio_path.exists():
+        raise AudioExtractionError("Audio extraction finished without creating a file.")
+
+    return audio_path
+
+
+async def extract_audio_async(
+    video_path: Path,
+    temp_dir: Path,
+    trace_id: str,
+    acodec: Optional[str] = None,
+    vcodec: Optional[str] = None,
+    audio_format: AudioFormat = DEFAULT_AUDIO_FORMAT,
+    source_bitrate_kbps: Optional[float] = None,
+) -> Path:
+    """
+    Асинхронный вариант extract_audio: ffmpeg запускается через asyncio и
+    не занимает поток, пока идёт конвертация.
+    """
+    if not video_path.exists():
+        raise AudioExtractionError(f"Video file not found: {video_path}")
+
+    temp_dir.mkdir(parents=True, exist_ok=True)
+
+    container = _passthrough_container(acodec, audio_format, source_bitrate_kbps)
+    if container and vcodec == "none" and video_path.suffix.lstrip(".").lower() in WHISPER_ACCEPTED_EXTENSIONS:
+        return video_path
+
+    if container:
+        audio_path = _output_path(temp_dir, trace_id, container, video_path)
+        return_code, _ = await _run_ffmpeg_async(_copy_command(str(video_path), audio_path))
+        if return_code == 0 and audio_path.exists() and audio_path.stat().st_size > 0:
+            return audio_path
+        # Некоторые потоки не перекладываются в другой контейнер - декодируем полностью
+        audio_path.unlink(missing_ok=True)
+
+    audio_path = _output_path(temp_dir, trace_id, audio_format.extension, video_path)
+    return_code, stderr = await _run_ffmpeg_async(_decode_command(str(video_path), audio_path, audio_format))
+    if return_code != 0:
+        raise AudioExtractionError(f"Failed to extract audio: ffmpeg exited with code {return_code}: {stderr}")
+
+    if not audio_path.exists():
+        raise AudioExtractionError("Audio extraction finished without creating a file.")
+
+    return audio_path
+
+
+async def _run_ffmpeg_async(command: List[str]) -> Tuple[int, str]:
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+    except OSError as exc:
+        raise AudioExtractionError(f"Failed to start ffmpeg: {exc}") from exc
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # Запрос отменён - не оставляем ffmpeg работать впустую
+        process.kill()
+        await process.wait()
+        raise
+    return process.returncode, stderr.decode("utf-8", errors="replace").strip()
+
+
+def extract_audio_from_pipe(
+    source: IO[bytes],
+    temp_dir: Path,
+    trace_id: str,
+    acodec: Optional[str] = None,
+    audio_format: AudioFormat = DEFAULT_AUDIO_FORMAT,
+    source_bitrate_kbps: Optional[float] = None,
+) -> Tuple[Path, int]:
+    """
+    Извлекает аудио из потока байтов, подавая его в stdin ffmpeg.
+
+    Конвертация идёт параллельно с чтением source, промежуточный файл видео
+    не создаётся. Возвращает путь к аудиофайлу и число прочитанных байт.
+    """
+    temp_dir.mkdir(parents=True, exist_ok=True)
+
+    container = _passthrough_container(acodec, audio_format, source_bitrate_kbps)
+    if container:
+        audio_path = temp_dir / f"{trace_id}.audio.{container}"
+        command = _copy_command("pipe:0", audio_path)
+    else:
+        audio_path = temp_dir / f"{trace_id}.{audio_format.extension}"
+        command = _decode_command("pipe:0", audio_path, audio_format)
+
+    bytes_read = 0
+    with tempfile.TemporaryFile() as stderr_file:
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=stderr_file)
+        except OSError as exc:
+            raise AudioExtractionError(f"Failed to start ffmpeg: {exc}") from exc
+
+        try:
+            while True:
+                block = source.read(_PIPE_BLOCK_SIZE)
+                if not block:
+                    break
+                bytes_read += len(block)
+                process.stdin.write(block)
+        except BrokenPipeError:
+            # ffmpeg завершился раньше времени - причину покажет код возврата
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        return_code = process.wait()
+        if return_code != 0:
+            stderr_file.seek(0)
+            details = stderr_file.read().decode("utf-8", errors="replace").strip()
+            raise AudioExtractionError(f"ffmpeg exited with code {return_code}: {details}")
+
+    if not audio_path.exists() or audio_path.stat().st_size == 0:
+        raise AudioExtractionError("Audio extraction finished without creating a file.")
+
+    return audio_path, bytes_read
+
+
+def _copy_command(source: str, audio_path: Path) -> List[str]:
+    return [
         "ffmpeg",
         "-y",
         "-i",
-        str(video_path),
+        source,
+        "-vn",
+        "-map",
+        "0:a:0",
+        "-c:a",
+        "copy",
+        "-loglevel",
+        "error",
+        str(audio_path),
+    ]
+
+
+def _decode_command(source: str, audio_path: Path, audio_format: AudioFormat) -> List[str]:
+    return [
+        "ffmpeg",
+        "-y",
+        "-i",
+        source,
+        "-vn",
         "-ac",
         "1",
         "-ar",
         "16000",
+        *audio_format.codec_args,
         "-loglevel",
         "error",
         str(audio_path),
     ]
 
-    try:
-        subprocess.run(command, check=True)
-    except subprocess.CalledProcessError as exc:
-        raise AudioExtractionError(f"Failed to extract audio: {exc}") from exc
-
-    if not audio_path.exists():
-        raise AudioExtractionError("Audio extraction finished without creating a file.")
 
+def _output_path(temp_dir: Path, trace_id: str, extension: str, source_path: Path) -> Path:
+    audio_path = temp_dir / f"{trace_id}.{extension}"
+    if audio_path == source_path:
+        # Нельзя перезаписывать исходный файл, который ffmpeg сейчас читает
+        audio_path = temp_dir / f"{trace_id}.audio.{extension}"
     return audio_path
 
+
+def _passthrough_container(
+    acodec: Optional[str],
+    audio_format: AudioFormat,
+    source_bitrate_kbps: Optional[float],
+) -> Optional[str]:
+    """Возвращает контейнер для копирования дорожки или None, если нужен декодинг."""
+    if not acodec or acodec == "none":
+        return None
+    if (
+        source_bitrate_kbps
+        and audio_format.name != "wav"
+        and source_bitrate_kbps > audio_format.bitrate_kbps * _PASSTHROUGH_BITRATE_FACTOR
+    ):
+        # Исходный поток заметно тяжелее целевого формата: перекодирование
+        # окупается меньшим числом запросов к Whisper
+        return None
+    # yt-dlp отдаёт кодеки вида "mp4a.40.2"
+    return _PASSTHROUGH_CONTAINERS.get(acodec.split(".")[0].lower())
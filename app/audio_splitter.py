@@ -1,19 +1,55 @@
 from __future__ import annotations
 
+import math
 import subprocess
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import BinaryIO, List, Optional, Tuple
+
+from .audio_extractor import AudioExtractionError, detect_silences, probe_duration
 
 
 class AudioSplitError(RuntimeError):
     """Ошибка при разделении аудиофайла."""
 
 
+# Запас к лимиту: битрейт сжатых форматов непостоянен, части получаются неравными
+SIZE_SAFETY_FACTOR = 0.92
+
+# Параметры поиска пауз для границ частей
+SILENCE_NOISE_DB = -35.0
+SILENCE_MIN_SECONDS = 0.3
+# Насколько далеко от расчётной точки можно сдвинуть границу к паузе
+_BOUNDARY_SEARCH_SECONDS = 30.0
+
+
+@dataclass
+class AudioChunk:
+    """Часть аудио для отдельного запроса к Whisper."""
+
+    index: int
+    path: Path
+    # Начало части в исходном аудио, секунды
+    start: float
+    duration: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+    @property
+    def size_bytes(self) -> int:
+        return self.path.stat().st_size
+
+    def open(self) -> BinaryIO:
+        return self.path.open("rb")
+
+
 def split_audio_by_size(
     audio_path: Path,
     output_dir: Path,
     max_size_mb: float = 24.0,
-    chunk_duration_seconds: int = 600,
+    chunk_duration_seconds: Optional[int] = None,
 ) -> List[Path]:
     """
     Разделяет аудиофайл на части, если он превышает максимальный размер.
@@ -22,11 +58,36 @@ def split_audio_by_size(
         audio_path: Путь к исходному аудиофайлу
         output_dir: Директория для сохранения частей
         max_size_mb: Максимальный размер части в МБ (по умолчанию 24 МБ для запаса)
-        chunk_duration_seconds: Длительность каждой части в секундах (по умолчанию 10 минут)
+        chunk_duration_seconds: Длительность каждой части в секундах. По умолчанию
+            вычисляется из фактического битрейта файла так, чтобы часть была чуть меньше лимита
 
     Returns:
         Список путей к частям аудио. Если файл меньше лимита, возвращает [audio_path]
     """
+    chunks = split_audio_into_chunks(
+        audio_path, output_dir, max_size_mb, max_chunk_seconds=chunk_duration_seconds
+    )
+    return [chunk.path for chunk in chunks]
+
+
+def split_audio_into_chunks(
+    audio_path: Path,
+    output_dir: Path,
+    max_size_mb: float = 24.0,
+    equal_length: bool = False,
+    align_to_silence: bool = True,
+    max_chunk_seconds: Optional[float] = None,
+) -> List[AudioChunk]:
+    """
+    Разделяет аудио на части чуть меньше max_size_mb с известными смещениями.
+
+    Длина части считается из фактического битрейта файла. Каждая граница
+    сдвигается к ближайшей паузе, чтобы не резать слово. При equal_length
+    части получаются примерно одинаковыми - параллельные запросы к Whisper
+    тогда завершаются почти одновременно.
+
+    Если файл меньше лимита, возвращает одну часть с самим audio_path.
+    """
     if not audio_path.exists():
         raise AudioSplitError(f"Audio file not found: {audio_path}")
 
@@ -34,14 +95,28 @@ def split_audio_by_size(
 
     # Если файл меньше лимита, возвращаем его как есть
     if file_size_mb <= max_size_mb:
-        return [audio_path]
+        return [AudioChunk(index=0, path=audio_path, start=0.0)]
 
     print(f"[INFO] Audio file size ({file_size_mb:.2f} MB) exceeds limit ({max_size_mb} MB). Splitting...")
 
+    try:
+        duration = probe_duration(audio_path)
+        silences = (
+            detect_silences(audio_path, SILENCE_NOISE_DB, SILENCE_MIN_SECONDS) if align_to_silence else []
+        )
+    except AudioExtractionError as exc:
+        raise AudioSplitError(str(exc)) from exc
+
+    if max_chunk_seconds is None:
+        max_chunk_seconds = chunk_duration_for_size(audio_path, max_size_mb, duration)
+    boundaries = plan_chunk_boundaries(duration, max_chunk_seconds, silences, equal_length)
+    print(f"[INFO] Chunk plan: max {max_chunk_seconds:.0f} s per chunk, cuts at {[round(b, 2) for b in boundaries]}")
+
     output_dir.mkdir(parents=True, exist_ok=True)
-    output_pattern = str(output_dir / f"{audio_path.stem}_chunk_%03d.wav")
+    # Сохраняем контейнер исходника: при "-c copy" он должен совпадать с кодеком
+    output_pattern = str(output_dir / f"{audio_path.stem}_chunk_%03d{audio_path.suffix}")
 
-    # Разделяем файл на части по времени с помощью ffmpeg
+    # Режем файл в расчётных точках одним проходом ffmpeg
     command = [
         "ffmpeg",
         "-y",  # Перезаписывать существующие файлы
@@ -49,8 +124,8 @@ def split_audio_by_size(
         str(audio_path),
         "-f",
         "segment",  # Использовать сегментацию
-        "-segment_time",
-        str(chunk_duration_seconds),  # Длительность каждого сегмента
+        "-segment_times",
+        ",".join(f"{boundary:.3f}" for boundary in boundaries),
         "-c",
         "copy",  # Копировать без перекодирования (быстрее)
         "-reset_timestamps",
@@ -66,14 +141,81 @@ def split_audio_by_size(
         raise AudioSplitError(f"Failed to split audio: {exc.stderr}") from exc
 
     # Собираем список созданных файлов
-    chunks = sorted(output_dir.glob(f"{audio_path.stem}_chunk_*.wav"))
+    paths = sorted(output_dir.glob(f"{audio_path.stem}_chunk_*{audio_path.suffix}"))
 
-    if not chunks:
+    if not paths:
         raise AudioSplitError("No chunks were created during splitting")
 
+    if len(paths) != len(boundaries) + 1:
+        raise AudioSplitError(
+            f"ffmpeg produced {len(paths)} chunks instead of {len(boundaries) + 1} planned"
+        )
+
+    # При "-c copy" ffmpeg режет по границам пакетов, а не точно в segment_times:
+    # смещения берём из фактической длины частей, иначе таймкоды поплывут
+    chunks: List[AudioChunk] = []
+    start = 0.0
+    for index, path in enumerate(paths):
+        try:
+            chunk_duration = probe_duration(path)
+        except AudioExtractionError as exc:
+            raise AudioSplitError(str(exc)) from exc
+        chunks.append(AudioChunk(index=index, path=path, start=start, duration=chunk_duration))
+        start += chunk_duration
+
     print(f"[INFO] Audio split into {len(chunks)} chunks")
-    for i, chunk in enumerate(chunks):
-        chunk_size_mb = chunk.stat().st_size / (1024 * 1024)
-        print(f"[INFO]   Chunk {i+1}: {chunk_size_mb:.2f} MB")
+    for chunk in chunks:
+        print(f"[INFO]   Chunk {chunk.index + 1}: {chunk.size_bytes / (1024 * 1024):.2f} MB, {chunk.duration:.1f} s")
 
     return chunks
+
+
+def chunk_duration_for_size(audio_path: Path, max_size_mb: float, duration: Optional[float] = None) -> int:
+    """Длительность части (в секундах), при которой она укладывается в max_size_mb."""
+    if duration is None:
+        try:
+            duration = probe_duration(audio_path)
+        except AudioExtractionError as exc:
+            raise AudioSplitError(str(exc)) from exc
+    if duration <= 0:
+        raise AudioSplitError(f"Audio file has zero duration: {audio_path}")
+
+    bytes_per_second = audio_path.stat().st_size / duration
+    max_bytes = max_size_mb * 1024 * 1024 * SIZE_SAFETY_FACTOR
+    return max(1, math.floor(max_bytes / bytes_per_second))
+
+
+def plan_chunk_boundaries(
+    duration: float,
+    max_chunk_seconds: float,
+    silences: List[Tuple[float, float]],
+    equal_length: bool = False,
+) -> List[float]:
+    """
+    Рассчитывает точки разреза (секунды) так, чтобы ни одна часть не превысила max_chunk_seconds.
+
+    Каждая точка переносится в середину ближайшей паузы в пределах
+    _BOUNDARY_SEARCH_SECONDS от расчётной, но никогда дальше max_chunk_seconds
+    от предыдущего разреза.
+    """
+    pause_points = sorted((start + min(end, duration)) / 2 for start, end in silences)
+    boundaries: List[float] = []
+    cursor = 0.0
+
+    while duration - cursor > max_chunk_seconds:
+        remaining = duration - cursor
+        limit = cursor + max_chunk_seconds
+        if equal_length:
+            target = cursor + remaining / math.ceil(remaining / max_chunk_seconds)
+        else:
+            target = limit
+
+        window_start = max(cursor + 1.0, target - _BOUNDARY_SEARCH_SECONDS)
+        window_end = min(limit, target + _BOUNDARY_SEARCH_SECONDS)
+        candidates = [point for point in pause_points if window_start <= point <= window_end]
+        boundary = min(candidates, key=lambda point: abs(point - target)) if candidates else target
+
+        boundaries.append(boundary)
+        cursor = boundary
+
+    return boundaries
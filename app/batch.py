@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from .models import AnalyzeRequest, BatchAnalyzeRequest, BatchItemResult
+from .pipeline import AnalysisState, PipelineError, finish_analysis, prepare_analysis
+from .tracing import bind_context, span, trace
+from .utils import generate_trace_id
+
+
+def run_batch(
+    batch: BatchAnalyzeRequest,
+    trace_id: str,
+    prepare_workers: int = 2,
+    transcribe_workers: int = 2,
+    deadline: Optional[float] = None,
+) -> List[BatchItemResult]:
+    """
+    Обрабатывает список ссылок конвейером из двух пулов.
+
+    Пул подготовки скачивает видео и извлекает аудио, пул транскрибации
+    отправляет готовое аудио в Whisper. Пока транскрибируется ссылка N,
+    скачивается N+1, поэтому общее время определяется самым медленным
+    этапом, а не суммой этапов. Подготовленных, но ещё не
+    транскрибированных ссылок не больше 2 * transcribe_workers - иначе
+    быстрая загрузка заполнила бы диск аудиофайлами.
+
+    Результаты возвращаются в порядке ссылок; ошибка одной ссылки не
+    прерывает остальные. deadline - общий для пакета предел ожидания
+    квоты Whisper (см. request_deadline).
+    """
+    items: List[Optional[BatchItemResult]] = [None] * len(batch.urls)
+    slots = threading.Semaphore(max(1, 2 * transcribe_workers))
+
+    def prepare(index: int) -> AnalysisState:
+        request_data = AnalyzeRequest(
+            url=batch.urls[index],
+            prefer_captions=batch.prefer_captions,
+            caption_languages=batch.caption_languages,
+        )
+        slots.acquire()
+        try:
+            item_trace_id = generate_trace_id()
+            with span("batch_prepare", index=index, item_trace_id=item_trace_id):
+                return prepare_analysis(request_data, item_trace_id, deadline=deadline)
+        except BaseException:
+            slots.release()
+            raise
+
+    def finish(state: AnalysisState) -> dict:
+        try:
+            with span("batch_finish", item_trace_id=state.trace_id):
+                return finish_analysis(state)
+        finally:
+            state.close()
+            slots.release()
+
+    print(f"[{trace_id}] 📦 Пакет из {len(batch.urls)} ссылок: подготовка x{prepare_workers}, транскрибация x{transcribe_workers}")
+    # Этапы всех ссылок пакета попадают в трассу пакета
+    with trace(trace_id, "batch", items=len(batch.urls)), \
+            ThreadPoolExecutor(max_workers=prepare_workers, thread_name_prefix="batch-prepare") as prepare_pool, \
+            ThreadPoolExecutor(max_workers=transcribe_workers, thread_name_prefix="batch-whisper") as transcribe_pool:
+        prepared: Dict[Future, int] = {
+            prepare_pool.submit(bind_context(prepare), index): index for index in range(len(batch.urls))
+        }
+        finishing: Dict[Future, int] = {}
+
+        for future in as_completed(prepared):
+            index = prepared[future]
+            try:
+                state = future.result()
+            except Exception as exc:
+                items[index] = _error_item(batch.urls[index], exc, trace_id)
+                continue
+            finishing[transcribe_pool.submit(bind_context(finish), state)] = index
+
+        for future in as_completed(finishing):
+            index = finishing[future]
+            try:
+                items[index] = BatchItemResult(url=str(batch.urls[index]), status=200, result=future.result())
+            except Exception as exc:
+                items[index] = _error_item(batch.urls[index], exc, trace_id)
+
+    return items
+
+
+def _error_item(url, exc: Exception, trace_id: str) -> BatchItemResult:
+    if isinstance(exc, PipelineError):
+        return BatchItemResult(url=str(url), status=exc.status, error=exc.message)
+    print(f"[{trace_id}] ❌ Unexpected error for {url}: {exc}")
+    traceback.print_exc()
+    return BatchItemResult(url=str(url), status=500, error=f"Неожиданная ошибка: {exc}")
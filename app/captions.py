@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import html
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from .downloader import VideoMetadata, metadata_from_info
+from .transcriber import TranscriptionResult, TranscriptionSegment
+from .ydl_pool import session as ydl_session
+
+TRANSCRIPT_SOURCE_MANUAL = "captions_manual"
+TRANSCRIPT_SOURCE_AUTO = "captions_auto"
+
+# Порядок предпочтения форматов субтитров: srv3 не содержит дублей строк
+_PREFERRED_EXTENSIONS = ("srv3", "vtt")
+
+_VTT_TIMING = re.compile(r"^\s*((?:\d+:)?\d{1,2}:\d{2}\.\d{3})\s+-->\s+((?:\d+:)?\d{1,2}:\d{2}\.\d{3})")
+_TAG = re.compile(r"<[^>]+>")
+
+
+CAPTIONS_YDL_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "noplaylist": True,
+    "skip_download": True,
+    "socket_timeout": 30,
+}
+
+
+class CaptionsError(RuntimeError):
+    """Ошибка при получении или разборе субтитров."""
+
+
+@dataclass
+class CaptionsResult:
+    transcription: TranscriptionResult
+    metadata: VideoMetadata
+    # TRANSCRIPT_SOURCE_MANUAL или TRANSCRIPT_SOURCE_AUTO
+    source: str
+
+
+def fetch_captions(url: str, languages: Sequence[str], probe_info: Optional[dict] = None) -> Optional[CaptionsResult]:
+    """
+    Получает готовые субтитры платформы через yt-dlp без скачивания видео.
+
+    Ручные субтитры предпочтительнее автоматических. Возвращает None, если
+    субтитров на допустимом языке нет - тогда нужна транскрибация Whisper.
+    Если передан probe_info, экстрактор повторно не вызывается.
+    """
+    try:
+        with ydl_session(CAPTIONS_YDL_OPTS) as ydl:
+            info = probe_info if probe_info is not None else ydl.extract_info(url, download=False)
+            metadata = metadata_from_info(info, url)
+
+            track = _choose_track(info, languages)
+            if track is None:
+                return None
+            language, caption_format, source = track
+
+            with ydl.urlopen(caption_format["url"]) as response:
+                raw = response.read().decode("utf-8", errors="replace")
+    except CaptionsError:
+        raise
+    except Exception as exc:  # pragma: no cover - yt-dlp errors are numerous
+        raise CaptionsError(f"Failed to fetch captions: {exc}") from exc
+
+    if caption_format.get("ext") == "srv3":
+        segments = parse_srv3(raw)
+    else:
+        segments = parse_vtt(raw)
+
+    if not segments:
+        return None
+
+    text = " ".join(segment.text for segment in segments)
+    transcription = TranscriptionResult(text=text.strip(), language=language, segments=segments)
+    return CaptionsResult(transcription=transcription, metadata=metadata, source=source)
+
+
+def _choose_track(info: dict, languages: Sequence[str]) -> Optional[Tuple[str, dict, str]]:
+    """Выбирает (язык, формат, источник) первой подходящей дорожки."""
+    original_language = (info.get("language") or "").lower().split("-")[0] or None
+    for language in languages:
+        key = _match_language(info.get("subtitles") or {}, language)
+        if key is not None:
+            caption_format = _pick_format(info["subtitles"][key])
+            if caption_format is not None:
+                return language, caption_format, TRANSCRIPT_SOURCE_MANUAL
+    for language in languages:
+        key = _match_original_language(info.get("automatic_captions") or {}, language, original_language)
+        if key is not None:
+            caption_format = _pick_format(info["automatic_captions"][key])
+            if caption_format is not None:
+                return language, caption_format, TRANSCRIPT_SOURCE_AUTO
+    return None
+
+
+def _match_language(tracks: dict, language: str) -> Optional[str]:
+    language = language.lower()
+    keys = [key for key in tracks if key != "live_chat"]
+    for key in keys:
+        if key.lower() == language:
+            return key
+    for key in keys:
+        if key.lower().split("-")[0] == language and not key.lower().endswith("-orig"):
+            return key
+    return None
+
+
+def _match_original_language(tracks: dict, language: str, original_language: Optional[str]) -> Optional[str]:
+    """
+    Автосубтитры только на исходном языке ролика.
+
+    Остальные языки в automatic_captions - машинный перевод: такой текст
+    хуже Whisper, поэтому без дорожки -orig (или дорожки на языке ролика
+    из info["language"]) субтитры не используются.
+    """
+    language = language.lower()
+    keys = [key for key in tracks if key != "live_chat"]
+    for key in keys:
+        if key.lower() == f"{language}-orig":
+            return key
+    if original_language is not None and language.split("-")[0] == original_language:
+        for key in keys:
+            if key.lower() == language:
+                return key
+    return None
+
+
+def _pick_format(formats: List[dict]) -> Optional[dict]:
+    by_ext = {item.get("ext"): item for item in formats if item.get("url")}
+    for ext in _PREFERRED_EXTENSIONS:
+        if ext in by_ext:
+            return by_ext[ext]
+    return None
+
+
+def parse_vtt(raw: str) -> List[TranscriptionSegment]:
+    """
+    Разбирает WebVTT в сегменты.
+
+    Автосубтитры YouTube повторяют предыдущую строку в каждом следующем
+    блоке, поэтому строки, уже показанные в прошлом блоке, отбрасываются.
+    """
+    segments: List[TranscriptionSegment] = []
+    previous_lines: List[str] = []
+    lines = raw.splitlines()
+    index = 0
+
+    while index < len(lines):
+        match = _VTT_TIMING.match(lines[index])
+        index += 1
+        if not match:
+            continue
+
+        cue_lines: List[str] = []
+        while index < len(lines) and lines[index] != "":
+            cleaned = html.unescape(_TAG.sub("", lines[index])).strip()
+            if cleaned:
+                cue_lines.append(cleaned)
+            index += 1
+
+        new_lines = [line for line in cue_lines if line not in previous_lines]
+        if cue_lines:
+            previous_lines = cue_lines
+        if not new_lines:
+            continue
+
+        segments.append(
+            TranscriptionSegment(
+                start=_parse_vtt_time(match.group(1)),
+                end=_parse_vtt_time(match.group(2)),
+                text=" ".join(new_lines),
+            )
+        )
+
+    return segments
+
+
+def parse_srv3(raw: str) -> List[TranscriptionSegment]:
+    """Разбирает формат YouTube srv3 (<p t="мс" d="мс">) в сегменты."""
+    try:
+        root = ET.fromstring(raw)
+    except ET.ParseError as exc:
+        raise CaptionsError(f"Invalid srv3 captions: {exc}") from exc
+
+    segments: List[TranscriptionSegment] = []
+    for paragraph in root.iter("p"):
+        text = " ".join("".join(paragraph.itertext()).split())
+        if not text:
+            continue
+        start = int(paragraph.get("t", "0")) / 1000.0
+        duration = int(paragraph.get("d", "0")) / 1000.0
+        segments.append(TranscriptionSegment(start=start, end=start + duration, text=text))
+    return segments
+
+
+def _parse_vtt_time(value: str) -> float:
+    parts = value.split(":")
+    seconds = float(parts[-1])
+    minutes = int(parts[-2]) if len(parts) >= 2 else 0
+    hours = int(parts[-3]) if len(parts) >= 3 else 0
+    return hours * 3600 + minutes * 60 + seconds
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+from .audio_splitter import AudioChunk
+from .downloader import VideoMetadata
+from .transcriber import TranscriptionResult, TranscriptionSegment
+from .utils import open_sqlite
+from .vad import OffsetMap, SpeechSpan
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    source_key TEXT NOT NULL,
+    chunk_hash TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (source_key, chunk_hash)
+);
+CREATE INDEX IF NOT EXISTS chunks_created_at ON chunks (created_at);
+"""
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+_METADATA_FILE = "retained.json"
+
+
+def chunk_digest(chunk: AudioChunk, model: str) -> str:
+    """sha256 содержимого части вместе с моделью: другой моделью часть транскрибируется заново."""
+    digest = hashlib.sha256(model.encode("utf-8") + b"\0")
+    with chunk.open() as chunk_file:
+        while True:
+            block = chunk_file.read(_HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CheckpointStore:
+    """
+    Результаты Whisper по отдельным частям, общие для всех воркеров.
+
+    Ключ - (канонический ключ видео, хэш содержимого части). Повторный
+    запрос того же видео отправляет в Whisper только части, которых нет в
+    базе. Записи старше ttl_seconds удаляются.
+    """
+
+    def __init__(self, path: Path, ttl_seconds: float) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        with closing(open_sqlite(self.path)) as connection:
+            connection.executescript(_SCHEMA)
+
+    def get(self, source_key: str, chunk_hash: str) -> Optional[TranscriptionResult]:
+        with closing(open_sqlite(self.path)) as connection:
+            row = connection.execute(
+                "SELECT payload, created_at FROM chunks WHERE source_key = ? AND chunk_hash = ?",
+                (source_key, chunk_hash),
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+        data = json.loads(row[0])
+        return TranscriptionResult(
+            text=data["text"],
+            language=data["language"],
+            segments=[TranscriptionSegment(**segment) for segment in data["segments"]],
+        )
+
+    def put(self, source_key: str, chunk_hash: str, result: TranscriptionResult) -> None:
+        now = time.time()
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT OR REPLACE INTO chunks (source_key, chunk_hash, payload, created_at) VALUES (?, ?, ?, ?)",
+                (source_key, chunk_hash, json.dumps(asdict(result), ensure_ascii=False), now),
+            )
+            connection.execute("DELETE FROM chunks WHERE created_at < ?", (now - self.ttl_seconds,))
+            connection.execute("COMMIT")
+
+    def discard(self, source_key: str) -> None:
+        """Удаляет части видео, когда готовый ответ уже в кэше."""
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute("DELETE FROM chunks WHERE source_key = ?", (source_key,))
+
+
+@dataclass
+class RetainedAudio:
+    audio_path: Path
+    metadata: VideoMetadata
+    offset_map: Optional[OffsetMap]
+
+
+class AudioRetention:
+    """
+    Сохраняет подготовленное аудио неудавшегося запроса на grace_seconds.
+
+    Повтор того же видео забирает файл вместо повторного скачивания,
+    извлечения и VAD. Каталог на видео - root/<sha1 ключа>/ с аудио и
+    retained.json (метаданные и карта смещений VAD).
+    """
+
+    def __init__(self, root: Path, grace_seconds: float) -> None:
+        self.root = root
+        self.grace_seconds = grace_seconds
+
+    def retain(
+        self,
+        source_key: str,
+        audio_path: Path,
+        metadata: VideoMetadata,
+        offset_map: Optional[OffsetMap] = None,
+    ) -> Path:
+        self.purge_expired()
+        target_dir = self._dir(source_key)
+        shutil.rmtree(target_dir, ignore_errors=True)
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        target_path = target_dir / audio_path.name
+        shutil.move(str(audio_path), str(target_path))
+        record = {
+            "source_key": source_key,
+            "audio_file": target_path.name,
+            "retained_at": time.time(),
+            "metadata": asdict(metadata),
+            "offset_spans": [asdict(span) for span in offset_map.spans] if offset_map else None,
+        }
+        (target_dir / _METADATA_FILE).write_text(json.dumps(record, ensure_ascii=False), encoding="utf-8")
+        return target_path
+
+    def restore(self, source_key: str, work_dir: Path) -> Optional[RetainedAudio]:
+        """Переносит сохранённое аудио в work_dir; None, если его нет или срок истёк."""
+        self.purge_expired()
+        source_dir = self._dir(source_key)
+        try:
+            record = json.loads((source_dir / _METADATA_FILE).read_text(encoding="utf-8"))
+            # os.rename внутри root атомарен: аудио достанется только одному запросу.
+            # shutil.move в work_dir таким не является, если work_dir на другой ФС (tmpfs)
+            claimed_source = self.root / f".claimed-{uuid.uuid4().hex}"
+            os.rename(source_dir, claimed_source)
+        except (OSError, ValueError):
+            return None
+        claimed_dir = work_dir / "retained"
+        try:
+            # Свежий mtime: purge_expired другого воркера не удалит каталог во время копирования
+            os.utime(claimed_source)
+            shutil.move(str(claimed_source), str(claimed_dir))
+        except OSError:
+            shutil.rmtree(claimed_source, ignore_errors=True)
+            shutil.rmtree(claimed_dir, ignore_errors=True)
+            return None
+
+        spans = record.get("offset_spans")
+        return RetainedAudio(
+            audio_path=claimed_dir / record["audio_file"],
+            metadata=VideoMetadata(**record["metadata"]),
+            offset_map=OffsetMap([SpeechSpan(**span) for span in spans]) if spans else None,
+        )
+
+    def purge_expired(self) -> None:
+        if not self.root.exists():
+            return
+        deadline = time.time() - self.grace_seconds
+        for entry in self.root.iterdir():
+            try:
+                if entry.stat().st_mtime < deadline:
+                    shutil.rmtree(entry, ignore_errors=True)
+            except OSError:
+                continue
+
+    def _dir(self, source_key: str) -> Path:
+        return self.root / hashlib.sha1(source_key.encode("utf-8")).hexdigest()
@@ -1,10 +1,17 @@
 from __future__ import annotations
 
+import subprocess
+import sys
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import IO, TYPE_CHECKING, Any, List, Optional, Tuple
 
-from yt_dlp import YoutubeDL
+from .metrics import RETRIES
+from .models import Platform
+from .ydl_pool import session as ydl_session, warm as warm_pool
+
+if TYPE_CHECKING:
+    from yt_dlp import YoutubeDL
 
 
 @dataclass
@@ -14,42 +21,67 @@ class VideoMetadata:
     description: Optional[str]
     duration: Optional[float]
     webpage_url: Optional[str]
+    # Сведения о фактически скачанном потоке
+    acodec: Optional[str] = None
+    vcodec: Optional[str] = None
+    audio_bitrate_kbps: Optional[float] = None
+    downloaded_bytes: int = 0
 
 
 class DownloadError(RuntimeError):
     """Ошибка при загрузке видео."""
 
 
-def download_video(url: str, temp_dir: Path, trace_id: str) -> Tuple[Path, VideoMetadata]:
+# Расширения, которые yt-dlp может создать для одного запроса
+_MEDIA_EXTENSIONS = ["mp4", "webm", "mkv", "m4a", "mp3", "opus", "ogg"]
+
+# Для транскрибации нужен только звук, поэтому сначала просим у платформы
+# наименьший аудиопоток. Смешанный поток (видео+аудио) - запасной вариант,
+# причём только с дорожкой звука: немой ролик бесполезен.
+_MUXED_FALLBACK = "worst[acodec!=none]/best"
+_AUDIO_FORMATS = {
+    # У YouTube есть отдельные opus/m4a потоки 48-160 kbps, для речи хватает самого лёгкого
+    Platform.YOUTUBE: f"worstaudio[abr>=?40]/bestaudio/{_MUXED_FALLBACK}",
+    # TikTok почти всегда отдаёт только смешанные потоки, самый лёгкий из них и так мал
+    Platform.TIKTOK: f"bestaudio/{_MUXED_FALLBACK}",
+    Platform.INSTAGRAM: f"worstaudio/bestaudio/{_MUXED_FALLBACK}",
+}
+_DEFAULT_AUDIO_FORMAT = f"bestaudio/{_MUXED_FALLBACK}"
+
+# Экстракторы поддерживаемых платформ, которые прогреваются заранее
+_PRELOAD_EXTRACTORS = ("Youtube", "TikTok", "Instagram", "Generic")
+
+
+def select_format(platform: Optional[Platform], audio_only: bool = True) -> str:
+    """Возвращает строку формата yt-dlp для платформы."""
+    if not audio_only:
+        # Исходное поведение: любое видео, лишь бы скачалось
+        return "worst/best"
+    if platform is None:
+        return _DEFAULT_AUDIO_FORMAT
+    return _AUDIO_FORMATS.get(platform, _DEFAULT_AUDIO_FORMAT)
+
+
+def download_video(
+    url: str,
+    temp_dir: Path,
+    trace_id: str,
+    platform: Optional[Platform] = None,
+    audio_only: bool = True,
+    probe_info: Optional[dict] = None,
+) -> Tuple[Path, VideoMetadata]:
     """
     Скачивает видео через yt-dlp и возвращает путь к файлу и метаданные.
 
-    Файл сохраняется в temp_dir с именем, содержащим trace_id.
+    Файл сохраняется в temp_dir с именем, содержащим trace_id. При audio_only
+    сначала запрашивается аудиопоток, а смешанный файл - только если его нет.
+    probe_info (результат probe_video) избавляет первую попытку от повторного
+    вызова экстрактора.
     """
     temp_dir.mkdir(parents=True, exist_ok=True)
     output_template = str(temp_dir / f"{trace_id}.%(ext)s")
 
-    ydl_opts = {
-        # Используем worst/best - сначала пробуем худшее качество (обычно доступно),
-        # если не получается - лучшее. Главное - получить файл для извлечения аудио
-        "format": "worst/best",
-        "outtmpl": output_template,
-        "noplaylist": True,
-        "quiet": False,  # Временно включим вывод для отладки
-        "no_warnings": False,
-        "extract_flat": False,
-        "writesubtitles": False,
-        "writeautomaticsub": False,
-        "ignoreerrors": False,
-        "no_check_certificate": False,
-        # Настройки для надежного скачивания
-        "retries": 3,  # Количество попыток при ошибках
-        "fragment_retries": 3,  # Попытки для фрагментов (HLS)
-        "file_access_retries": 3,  # Попытки доступа к файлу
-        "retry_sleep": 2,  # Пауза между попытками (секунды)
-        "socket_timeout": 30,  # Таймаут сокета
-        "http_chunk_size": 10485760,  # Размер чанка для HTTP (10MB)
-    }
+    ydl_opts = _build_ydl_opts(select_format(platform, audio_only))
 
     max_retries = 2
     last_error = None
@@ -58,18 +90,23 @@ def download_video(url: str, temp_dir: Path, trace_id: str) -> Tuple[Path, Video
         try:
             # Очищаем предыдущие попытки (удаляем неполные файлы)
             if attempt > 0:
-                for ext in ["mp4", "webm", "mkv", "m4a", "mp3", "part"]:
+                for ext in [*_MEDIA_EXTENSIONS, "part"]:
                     partial_file = temp_dir / f"{trace_id}.{ext}"
                     if partial_file.exists():
                         try:
                             partial_file.unlink()
                         except Exception:
                             pass
+                RETRIES.labels(stage="download").inc()
                 import time
                 time.sleep(2)  # Пауза перед повторной попыткой
             
-            with YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+            with ydl_session(ydl_opts, outtmpl=output_template) as ydl:
+                if probe_info is not None and attempt == 0:
+                    info = ydl.process_ie_result(dict(probe_info), download=True)
+                else:
+                    # При повторе ссылки на поток могли истечь - извлекаем заново
+                    info = ydl.extract_info(url, download=True)
                 file_path = _resolve_output_path(info, ydl, temp_dir, trace_id)
                 
                 # Проверяем, что файл существует и не пустой
@@ -100,15 +137,125 @@ def download_video(url: str, temp_dir: Path, trace_id: str) -> Tuple[Path, Video
         # Если все попытки исчерпаны
         raise DownloadError(f"Failed to download video after {max_retries + 1} attempts. Last error: {last_error}")
 
-    metadata = VideoMetadata(
+    return file_path, metadata_from_info(info, url, downloaded_bytes=file_path.stat().st_size)
+
+
+def probe_video(url: str, platform: Optional[Platform] = None, audio_only: bool = True) -> dict:
+    """
+    Получает информацию о видео без скачивания.
+
+    yt-dlp при этом уже выбирает формат, поэтому в ответе есть acodec/vcodec
+    и прямая ссылка на поток.
+    """
+    ydl_opts = _build_ydl_opts(select_format(platform, audio_only))
+    try:
+        with ydl_session(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            return ydl.sanitize_info(info)
+    except Exception as exc:  # pragma: no cover - yt-dlp errors are numerous
+        raise DownloadError(f"Failed to fetch video info: {exc}") from exc
+
+
+def warm_ydl_pool(audio_only: bool = True) -> int:
+    """Заранее создаёт экземпляры YoutubeDL для probe и скачивания со всех платформ."""
+    configs: List[dict] = []
+    for platform in Platform:
+        params = _build_ydl_opts(select_format(platform, audio_only))
+        if params not in configs:
+            configs.append(params)
+    return warm_pool(configs, extractors=_PRELOAD_EXTRACTORS)
+
+
+def expected_filesize(info: dict) -> Optional[int]:
+    """Ожидаемый размер выбранного формата по данным probe (точный или оценка платформы)."""
+    formats = info.get("requested_formats") or [info]
+    total = 0
+    for item in formats:
+        size = item.get("filesize") or item.get("filesize_approx")
+        if not size and item.get("tbr") and info.get("duration"):
+            size = item["tbr"] * 1000 / 8 * info["duration"]
+        if not size:
+            return None
+        total += int(size)
+    return total
+
+
+def open_download_stream(info_path: Path, format_spec: str, stderr: IO[bytes]) -> subprocess.Popen:
+    """
+    Запускает yt-dlp отдельным процессом, который пишет поток в stdout.
+
+    Информация берётся из info_path (результат probe_video), поэтому экстрактор
+    повторно не вызывается.
+    """
+    command = [
+        sys.executable,
+        "-m",
+        "yt_dlp",
+        "--load-info-json",
+        str(info_path),
+        "--format",
+        format_spec,
+        "--output",
+        "-",
+        "--quiet",
+        "--no-progress",
+        "--no-part",
+        "--retries",
+        "3",
+        "--fragment-retries",
+        "3",
+        "--socket-timeout",
+        "30",
+    ]
+    try:
+        return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+    except OSError as exc:
+        raise DownloadError(f"Failed to start yt-dlp: {exc}") from exc
+
+
+def metadata_from_info(info: dict, url: str, downloaded_bytes: int = 0) -> VideoMetadata:
+    """Собирает VideoMetadata из ответа yt-dlp."""
+    return VideoMetadata(
         title=info.get("title"),
         uploader=info.get("uploader") or info.get("channel"),
         description=info.get("description"),
         duration=float(info["duration"]) if info.get("duration") is not None else None,
         webpage_url=info.get("webpage_url") or url,
+        acodec=_requested_field(info, "acodec"),
+        vcodec=_requested_field(info, "vcodec"),
+        audio_bitrate_kbps=_requested_field(info, "abr"),
+        downloaded_bytes=downloaded_bytes,
     )
 
-    return file_path, metadata
+
+def _build_ydl_opts(format_spec: str) -> dict:
+    ydl_opts = {
+        "format": format_spec,
+        "noplaylist": True,
+        "quiet": False,  # Временно включим вывод для отладки
+        "no_warnings": False,
+        "extract_flat": False,
+        "writesubtitles": False,
+        "writeautomaticsub": False,
+        "ignoreerrors": False,
+        "no_check_certificate": False,
+        # Настройки для надежного скачивания
+        "retries": 3,  # Количество попыток при ошибках
+        "fragment_retries": 3,  # Попытки для фрагментов (HLS)
+        "file_access_retries": 3,  # Попытки доступа к файлу
+        "retry_sleep": 2,  # Пауза между попытками (секунды)
+        "socket_timeout": 30,  # Таймаут сокета
+        "http_chunk_size": 10485760,  # Размер чанка для HTTP (10MB)
+    }
+    return ydl_opts
+
+
+def _requested_field(info: dict, field: str) -> Any:
+    """Берёт поле выбранного формата (при склейке потоков - первого из них)."""
+    for item in info.get("requested_downloads") or []:
+        if item.get(field):
+            return item[field]
+    return info.get(field)
 
 
 def _resolve_output_path(info: dict, ydl: YoutubeDL, temp_dir: Path, trace_id: str) -> Path:
@@ -138,7 +285,7 @@ def _resolve_output_path(info: dict, ydl: YoutubeDL, temp_dir: Path, trace_id: s
         pass
 
     # Ищем файлы в temp_dir с trace_id в имени
-    for ext in ["mp4", "webm", "mkv", "m4a", "mp3"]:
+    for ext in _MEDIA_EXTENSIONS:
         candidate = temp_dir / f"{trace_id}.{ext}"
         if candidate.exists():
             candidates.append(candidate)
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import json
+import queue
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .models import AnalyzeRequest, TimestampEntry
+from .pipeline import PipelineError, finish_analysis, prepare_analysis, request_deadline
+from .tracing import trace
+
+# Если событий нет дольше этого, клиенту уходит ping (прокси не рвут соединение)
+_KEEPALIVE_SECONDS = 15.0
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+def analysis_events(request_data: AnalyzeRequest, trace_id: str) -> Iterator[Event]:
+    """
+    Выполняет /analyze в фоновом потоке и отдаёт события по мере готовности.
+
+    Порядок: progress (смена этапа), metadata (сразу после обработки
+    метаданных), segments (таймкоды каждой части по порядку), summary
+    (ответ /analyze без timestamps). При ошибке последним идёт error.
+    Если клиент отключился, обработка всё равно доводится до конца и
+    результат попадает в кэш.
+    """
+    events: "queue.Queue[Optional[Event]]" = queue.Queue()
+    threading.Thread(
+        target=_produce_events, args=(request_data, trace_id, events), name=f"stream-{trace_id[:8]}", daemon=True
+    ).start()
+
+    while True:
+        try:
+            event = events.get(timeout=_KEEPALIVE_SECONDS)
+        except queue.Empty:
+            yield "ping", {}
+            continue
+        if event is None:
+            return
+        yield event
+
+
+def format_ndjson(event: str, data: Dict[str, Any]) -> str:
+    return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    if event == "ping":
+        return ": ping\n\n"
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _produce_events(request_data: AnalyzeRequest, trace_id: str, events: "queue.Queue[Optional[Event]]") -> None:
+    def progress(stage: str, details: Optional[Dict[str, Any]]) -> None:
+        events.put(("progress", {"stage": stage, **(details or {})}))
+
+    def on_segments(position: int, entries: List[TimestampEntry]) -> None:
+        events.put(
+            ("segments", {"chunk": position, "timestamps": [entry.model_dump(mode="json") for entry in entries]})
+        )
+
+    try:
+        with trace(trace_id, "analyze_stream", url=str(request_data.url)):
+            state = prepare_analysis(request_data, trace_id, progress, request_deadline())
+            try:
+                if state.payload is not None:
+                    # Кэш или параллельный запрос: всё готово сразу
+                    payload = state.payload
+                    events.put(("metadata", _metadata_from_payload(payload)))
+                    events.put(("segments", {"chunk": 0, "timestamps": payload.get("timestamps", [])}))
+                else:
+                    events.put(("metadata", _metadata_from_state(state)))
+                    payload = finish_analysis(state, progress, on_segments)
+            finally:
+                state.close()
+        summary = {name: value for name, value in payload.items() if name != "timestamps"}
+        summary["segments"] = len(payload.get("timestamps", []))
+        events.put(("summary", summary))
+    except PipelineError as exc:
+        error = {"error": exc.message, "status": exc.status, "trace_id": trace_id}
+        if exc.retry_after is not None:
+            error["retry_after"] = exc.retry_after
+        events.put(("error", error))
+    except Exception as exc:
+        print(f"[{trace_id}] ❌ Unexpected error in streaming analysis: {exc}")
+        events.put(("error", {"error": f"Неожиданная ошибка: {exc}", "status": 500, "trace_id": trace_id}))
+    finally:
+        events.put(None)
+
+
+def _metadata_from_state(state) -> Dict[str, Any]:
+    metadata = state.normalized_metadata
+    data = {
+        "platform": state.platform.value if state.platform else None,
+        "url": metadata.url or state.url,
+        "title": metadata.title,
+        "author": metadata.author,
+        "description": metadata.description,
+        "duration": metadata.duration,
+        "transcript_source": state.transcript_source,
+        "trace_id": state.trace_id,
+    }
+    return {name: value for name, value in data.items() if value is not None}
+
+
+def _metadata_from_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    names = ("platform", "url", "title", "author", "description", "duration", "transcript_source", "trace_id")
+    return {name: payload[name] for name in names if name in payload}
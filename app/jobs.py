@@ -0,0 +1,400 @@
+from __future__ import annotations
+
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Set
+from urllib.parse import urlsplit
+
+import requests
+
+from .metrics import RETRIES
+from .models import AnalyzeRequest, JobRequest, JobResponse, JobStatus
+from .pipeline import PipelineError, run_analysis
+from .utils import generate_trace_id, open_sqlite
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    request TEXT NOT NULL,
+    callback_url TEXT,
+    stage TEXT,
+    progress TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    trace_id TEXT,
+    callback_status TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+_CALLBACK_ATTEMPTS = 3
+# Сколько фоновая задача ждёт освобождения ёмкости (429), прежде чем завершиться ошибкой
+_ADMISSION_WAIT_LIMIT_SECONDS = 3600
+_CALLBACK_TIMEOUT_SECONDS = 10
+
+
+class CallbackUrlError(RuntimeError):
+    """callback_url ведёт на адрес, на который сервис запросы не отправляет."""
+
+
+def check_callback_url(url: str, allowed_hosts: Iterable[str] = ()) -> None:
+    """
+    Проверяет, что callback_url не ведёт во внутреннюю сеть сервиса.
+
+    Если задан allowed_hosts, хост должен быть в этом списке. Иначе имя
+    разрешается в адреса, и все они должны быть публичными: частные,
+    loopback, link-local (метаданные облака), multicast и
+    зарезервированные адреса отклоняются.
+    """
+    host = (urlsplit(url).hostname or "").lower().rstrip(".")
+    if not host:
+        raise CallbackUrlError("В callback_url нет хоста")
+    allowed = {name.lower().rstrip(".") for name in allowed_hosts}
+    if allowed:
+        if host not in allowed:
+            raise CallbackUrlError(f"Хост {host} не входит в JOB_CALLBACK_ALLOWED_HOSTS")
+        return
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)}
+    except (OSError, UnicodeError) as exc:
+        raise CallbackUrlError(f"Не удалось разрешить хост {host}: {exc}") from exc
+    for address in addresses:
+        # Отбрасываем зону IPv6 (fe80::1%eth0)
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+        if getattr(ip, "ipv4_mapped", None):
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            raise CallbackUrlError(f"Хост {host} разрешается во внутренний адрес {ip}")
+
+
+class JobStore:
+    """
+    Очередь задач /jobs в SQLite, общая для всех воркеров.
+
+    Задачу выполняет тот воркер, который первым её захватил (claim). Пока
+    задача выполняется, владелец обновляет heartbeat_at; если воркер умер,
+    задача после stale_seconds снова становится доступной другим.
+    """
+
+    def __init__(self, path: Path, retention_seconds: float) -> None:
+        self.path = path
+        self.retention_seconds = retention_seconds
+        with closing(open_sqlite(self.path)) as connection:
+            connection.executescript(_SCHEMA)
+
+    def create(self, job_request: JobRequest) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        request_payload = job_request.model_dump(mode="json", exclude={"callback_url"}, exclude_none=True)
+        callback_url = str(job_request.callback_url) if job_request.callback_url else None
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT INTO jobs (id, status, request, callback_url, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, JobStatus.QUEUED.value, json.dumps(request_payload), callback_url, now, now),
+            )
+            connection.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (JobStatus.SUCCEEDED.value, JobStatus.FAILED.value, now - self.retention_seconds),
+            )
+            connection.execute("COMMIT")
+        return job_id
+
+    def get(self, job_id: str) -> Optional[JobResponse]:
+        with closing(open_sqlite(self.path)) as connection:
+            row = connection.execute(
+                "SELECT id, status, stage, progress, attempts, created_at, updated_at, result, error, callback_status "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return JobResponse(
+            job_id=row[0],
+            status=JobStatus(row[1]),
+            stage=row[2],
+            progress=json.loads(row[3]),
+            attempts=row[4],
+            created_at=row[5],
+            updated_at=row[6],
+            result=json.loads(row[7]) if row[7] else None,
+            error=row[8],
+            callback_status=row[9],
+        )
+
+    def claim(self, owner: str, stale_seconds: float, max_attempts: int) -> Optional[Dict[str, Any]]:
+        """Захватывает самую старую ожидающую задачу или задачу умершего воркера."""
+        now = time.time()
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            # Задачи, владелец которых пропал, а попытки кончились, больше не перезапускаем
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (
+                    JobStatus.FAILED.value,
+                    "Worker stopped while processing the job",
+                    now,
+                    JobStatus.RUNNING.value,
+                    now - stale_seconds,
+                    max_attempts,
+                ),
+            )
+            row = connection.execute(
+                "SELECT id, request, callback_url, attempts FROM jobs "
+                "WHERE status = ? OR (status = ? AND heartbeat_at < ?) "
+                "ORDER BY created_at ASC LIMIT 1",
+                (JobStatus.QUEUED.value, JobStatus.RUNNING.value, now - stale_seconds),
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            trace_id = generate_trace_id()
+            connection.execute(
+                "UPDATE jobs SET status = ?, owner = ?, trace_id = ?, attempts = attempts + 1, "
+                "heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                (JobStatus.RUNNING.value, owner, trace_id, now, now, row[0]),
+            )
+            connection.execute("COMMIT")
+        return {
+            "id": row[0],
+            "request": json.loads(row[1]),
+            "callback_url": row[2],
+            "attempt": row[3] + 1,
+            "trace_id": trace_id,
+        }
+
+    def update_progress(self, job_id: str, owner: str, stage: str, details: Optional[Dict[str, Any]]) -> None:
+        now = time.time()
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT progress FROM jobs WHERE id = ? AND owner = ?", (job_id, owner)
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return
+            progress = json.loads(row[0])
+            stages = progress.setdefault("stages", {})
+            stages.setdefault(stage, round(now, 3))
+            progress.update(details or {})
+            connection.execute(
+                "UPDATE jobs SET stage = ?, progress = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                (stage, json.dumps(progress), now, now, job_id),
+            )
+            connection.execute("COMMIT")
+
+    def heartbeat(self, job_ids: Set[str], owner: str) -> None:
+        if not job_ids:
+            return
+        now = time.time()
+        with closing(open_sqlite(self.path)) as connection:
+            connection.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                [(now, job_id, owner, JobStatus.RUNNING.value) for job_id in job_ids],
+            )
+
+    def finish(self, job_id: str, owner: str, result: Optional[dict] = None, error: Optional[str] = None) -> bool:
+        """Записывает результат; False, если задачу уже перехватил другой воркер."""
+        now = time.time()
+        status = JobStatus.FAILED if error is not None else JobStatus.SUCCEEDED
+        with closing(open_sqlite(self.path)) as connection:
+            updated = connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                (status.value, json.dumps(result, ensure_ascii=False) if result else None, error, now, job_id, owner),
+            ).rowcount
+        return updated > 0
+
+    def set_callback_status(self, job_id: str, callback_status: str) -> None:
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute(
+                "UPDATE jobs SET callback_status = ?, updated_at = ? WHERE id = ?",
+                (callback_status, time.time(), job_id),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        with closing(open_sqlite(self.path)) as connection:
+            rows = connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status.value: 0 for status in JobStatus}
+        counts.update({status: int(count) for status, count in rows})
+        return counts
+
+
+class JobRunner:
+    """
+    Фоновые потоки, выполняющие задачи из JobStore в текущем процессе.
+
+    Потоки запускаются лениво и заново после fork: воркеры gunicorn не
+    наследуют потоки мастера. Запросы клиентов потоки не занимают.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        workers: int = 1,
+        poll_interval: float = 2.0,
+        stale_seconds: float = 120.0,
+        max_attempts: int = 3,
+        callback_allowed_hosts: Iterable[str] = (),
+    ) -> None:
+        self.store = store
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self.callback_allowed_hosts = tuple(callback_allowed_hosts)
+        self._pid: Optional[int] = None
+        self._owner = ""
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running: Set[str] = set()
+
+    def ensure_started(self) -> None:
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._owner = f"{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:8]}"
+            self._running = set()
+            for index in range(self.workers):
+                threading.Thread(target=self._worker_loop, name=f"job-worker-{index}", daemon=True).start()
+            threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True).start()
+            print(f"[INFO] Job runner started: {self.workers} worker thread(s), owner {self._owner}")
+
+    def wake(self) -> None:
+        """Будит свободный поток, не дожидаясь следующего опроса очереди."""
+        self._wakeup.set()
+
+    def _worker_loop(self) -> None:
+        while True:
+            try:
+                job = self.store.claim(self._owner, self.stale_seconds, self.max_attempts)
+            except Exception as exc:
+                print(f"[WARN] Job claim failed: {exc}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _heartbeat_loop(self) -> None:
+        while True:
+            time.sleep(max(1.0, self.stale_seconds / 4))
+            try:
+                with self._lock:
+                    running = set(self._running)
+                self.store.heartbeat(running, self._owner)
+            except Exception as exc:
+                print(f"[WARN] Job heartbeat failed: {exc}")
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        job_id, trace_id = job["id"], job["trace_id"]
+        print(f"[{trace_id}] ▶️  Задача {job_id}: попытка {job['attempt']}")
+        with self._lock:
+            self._running.add(job_id)
+
+        def progress(stage: str, details: Optional[Dict[str, Any]]) -> None:
+            self.store.update_progress(job_id, self._owner, stage, details)
+
+        result: Optional[dict] = None
+        error: Optional[str] = None
+        try:
+            request_data = AnalyzeRequest.model_validate(job["request"])
+            result = self._analyze_when_admitted(request_data, trace_id, progress)
+        except PipelineError as exc:
+            error = exc.message
+        except Exception as exc:
+            traceback.print_exc()
+            error = f"Неожиданная ошибка: {exc}"
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+
+        try:
+            owned = self.store.finish(job_id, self._owner, result=result, error=error)
+        except Exception as exc:
+            print(f"[{trace_id}] ⚠️  Не удалось сохранить результат задачи {job_id}: {exc}")
+            return
+        if not owned:
+            print(f"[{trace_id}] ⚠️  Задача {job_id} перехвачена другим воркером, результат не записан")
+            return
+        print(f"[{trace_id}] {'✅' if error is None else '❌'} Задача {job_id} завершена")
+
+        if job["callback_url"]:
+            payload = result if error is None else {"job_id": job_id, "status": JobStatus.FAILED.value, "error": error}
+            self.store.set_callback_status(
+                job_id, _deliver_callback(job["callback_url"], job_id, payload, trace_id, self.callback_allowed_hosts)
+            )
+
+    def _analyze_when_admitted(self, request_data: AnalyzeRequest, trace_id: str, progress) -> dict:
+        """
+        run_analysis, который при перегрузке (429 или 503 с Retry-After) ждёт и пробует снова.
+
+        Клиент /jobs ответа не ждёт, поэтому задача остаётся в работе, а не
+        падает: heartbeat продолжается, пока поток спит.
+        """
+        deadline = time.monotonic() + _ADMISSION_WAIT_LIMIT_SECONDS
+        while True:
+            try:
+                return run_analysis(request_data, trace_id, progress=progress)
+            except PipelineError as exc:
+                if (
+                    exc.status not in (429, 503)
+                    or exc.retry_after is None
+                    or time.monotonic() + exc.retry_after > deadline
+                ):
+                    raise
+                print(f"[{trace_id}] ⏳ Сервис перегружен, повтор через {exc.retry_after:.0f} с")
+                progress("admission_wait", {"retry_after": exc.retry_after})
+                time.sleep(exc.retry_after)
+
+
+def _deliver_callback(
+    url: str, job_id: str, payload: dict, trace_id: str, allowed_hosts: Iterable[str] = ()
+) -> str:
+    """POST ответа на callback_url с повторами; возвращает итог доставки."""
+    last_error = ""
+    for attempt in range(1, _CALLBACK_ATTEMPTS + 1):
+        try:
+            # Проверяем перед каждой попыткой: DNS мог смениться после приёма задачи
+            check_callback_url(url, allowed_hosts)
+        except CallbackUrlError as exc:
+            print(f"[{trace_id}] ⛔ Callback {url} отклонён: {exc}")
+            return f"rejected: {exc}"
+        try:
+            # Без редиректов: иначе ответ 3xx уведёт запрос во внутреннюю сеть
+            response = requests.post(
+                url,
+                json=payload,
+                headers={"X-Job-Id": job_id},
+                timeout=_CALLBACK_TIMEOUT_SECONDS,
+                allow_redirects=False,
+            )
+            if response.status_code < 300:
+                return "delivered"
+            last_error = f"HTTP {response.status_code}"
+            if response.status_code < 500 and response.status_code != 429:
+                break
+        except requests.RequestException as exc:
+            last_error = str(exc)
+        print(f"[{trace_id}] ⚠️  Callback {url} не доставлен (попытка {attempt}): {last_error}")
+        if attempt < _CALLBACK_ATTEMPTS:
+            RETRIES.labels(stage="callback").inc()
+            time.sleep(2**attempt)
+    return f"failed: {last_error}"
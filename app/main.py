@@ -1,34 +1,60 @@
 from __future__ import annotations
 
+import math
 import os
-import traceback
+import re
 from pathlib import Path
-from typing import List
+from typing import Optional
 
-from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, make_response, request, send_from_directory
 
-from .audio_extractor import AudioExtractionError, extract_audio
-from .downloader import DownloadError, download_video
-from .metadata_processor import normalize_metadata
-from .models import AnalyzeRequest, AnalyzeResponse, Platform, TimestampEntry
-from .platform_detector import InvalidUrlError, detect_platform
-from .transcriber import TranscriptionError, TranscriptionResult, transcribe_audio
-from .utils import cleanup_paths, ensure_directory, format_timestamp, generate_trace_id
-
-load_dotenv()
+from .batch import run_batch
+from .event_stream import analysis_events, format_ndjson, format_sse
+from .jobs import CallbackUrlError, JobRunner, JobStore, check_callback_url
+from .metrics import render_metrics
+from .models import AnalyzeRequest, BatchAnalyzeRequest, BatchAnalyzeResponse, JobRequest
+from .pipeline import STATE_DIR, PipelineError, collect_stats, request_deadline, run_analysis
+from .profiling import SamplingProfiler
+from .utils import generate_trace_id
 
 app = Flask(__name__)
 
-TEMP_ROOT = Path(os.getenv("TEMP_DIR", "/tmp/video_api"))
-WHISPER_MODEL = os.getenv("WHISPER_MODEL", "whisper-1")
-
-# Проверка наличия API ключа
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    print("⚠️  WARNING: OPENAI_API_KEY not found in environment variables!")
-else:
-    print(f"✅ OPENAI_API_KEY loaded (length: {len(OPENAI_API_KEY)} chars)")
+# Фоновые задачи /jobs: потоков на воркер и восстановление после падения воркера
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Если задан, callback_url принимается только с этими хостами (через запятую);
+# иначе отклоняются хосты, разрешающиеся во внутренние адреса
+JOB_CALLBACK_ALLOWED_HOSTS = [
+    host.strip() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+
+# Пакетная обработка /analyze/batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_DOWNLOAD_WORKERS = int(os.getenv("BATCH_DOWNLOAD_WORKERS", "2"))
+BATCH_TRANSCRIBE_WORKERS = int(os.getenv("BATCH_TRANSCRIBE_WORKERS", "2"))
+
+# Профиль запроса по заголовку X-Profile: 1; по умолчанию выключен - включается PROFILING_ENABLED=1
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(STATE_DIR / "profiles")))
+
+job_store = JobStore(STATE_DIR / "jobs.sqlite3", retention_seconds=JOB_RETENTION_SECONDS)
+job_runner = JobRunner(
+    job_store,
+    workers=max(1, JOB_WORKERS),
+    stale_seconds=JOB_STALE_SECONDS,
+    max_attempts=max(1, JOB_MAX_ATTEMPTS),
+    callback_allowed_hosts=JOB_CALLBACK_ALLOWED_HOSTS,
+)
+
+
+@app.before_request
+def _start_job_runner():
+    # Потоки запускаются в процессе, который обслуживает запросы: при импорте их
+    # стартовать нельзя - с GUNICORN_PRELOAD=1 импорт идёт в мастере gunicorn.
+    # Под gunicorn воркер запускает их ещё в post_worker_init (gunicorn.conf.py)
+    job_runner.ensure_started()
 
 
 @app.post("/analyze")
@@ -37,105 +63,126 @@ def analyze():
 
     payload = request.get_json(force=True, silent=False)
     request_data = AnalyzeRequest.model_validate(payload)
-    url_str = str(request_data.url)
 
+    profiler = _start_profiler(trace_id)
     try:
-        platform = detect_platform(url_str)
-    except InvalidUrlError as exc:
-        return _json_error(str(exc), trace_id, status=400)
+        response = make_response(jsonify(run_analysis(request_data, trace_id, deadline=request_deadline())))
+    except PipelineError as exc:
+        response = make_response(_json_error(exc.message, trace_id, status=exc.status))
+        if exc.retry_after is not None:
+            response.headers["Retry-After"] = str(math.ceil(exc.retry_after))
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    if profiler is not None:
+        profiler.save(PROFILE_DIR)
+        response.headers["X-Profile"] = f"/profiles/{trace_id}"
+    return response
 
-    work_dir = ensure_directory(TEMP_ROOT / trace_id)
-    cleanup_targets: List[Path] = []
 
-    try:
-        # Этап 1: Скачивание видео
-        try:
-            print(f"[{trace_id}] Этап 1: Скачивание видео через yt-dlp...")
-            video_path, raw_metadata = download_video(url_str, work_dir, trace_id)
-            cleanup_targets.append(video_path)
-            print(f"[{trace_id}] ✅ Видео скачано: {video_path} ({video_path.stat().st_size / 1024 / 1024:.2f} MB)")
-        except DownloadError as exc:
-            return _json_error(f"Ошибка скачивания видео (yt-dlp): {exc}", trace_id, status=500)
-        except Exception as exc:
-            return _json_error(f"Неожиданная ошибка при скачивании видео: {exc}", trace_id, status=500)
-
-        # Этап 2: Извлечение аудио
-        try:
-            print(f"[{trace_id}] Этап 2: Извлечение аудио через ffmpeg...")
-            audio_path = extract_audio(video_path, work_dir, trace_id)
-            cleanup_targets.append(audio_path)
-            print(f"[{trace_id}] ✅ Аудио извлечено: {audio_path} ({audio_path.stat().st_size / 1024 / 1024:.2f} MB)")
-        except AudioExtractionError as exc:
-            return _json_error(f"Ошибка извлечения аудио (ffmpeg): {exc}", trace_id, status=500)
-        except Exception as exc:
-            return _json_error(f"Неожиданная ошибка при извлечении аудио: {exc}", trace_id, status=500)
-
-        # Этап 3: Обработка метаданных
-        try:
-            print(f"[{trace_id}] Этап 3: Обработка метаданных...")
-            normalized_metadata = normalize_metadata(platform, raw_metadata)
-            print(f"[{trace_id}] ✅ Метаданные обработаны")
-        except Exception as exc:
-            return _json_error(f"Ошибка обработки метаданных: {exc}", trace_id, status=500)
+@app.post("/analyze/stream")
+def analyze_stream():
+    trace_id = generate_trace_id()
 
-        # Этап 4: Транскрибация через Whisper API
-        try:
-            print(f"[{trace_id}] Этап 4: Транскрибация через Whisper API...")
-            transcription = transcribe_audio(audio_path, WHISPER_MODEL)
-            print(f"[{trace_id}] ✅ Транскрибация завершена: {len(transcription.segments)} сегментов, язык: {transcription.language}")
-        except TranscriptionError as exc:
-            print(f"[{trace_id}] ❌ TranscriptionError: {exc}")
-            traceback.print_exc()
-            return _json_error(f"Ошибка транскрибации (Whisper API): {exc}", trace_id, status=500)
-        except Exception as exc:
-            print(f"[{trace_id}] ❌ Unexpected error during transcription: {exc}")
-            traceback.print_exc()
-            return _json_error(f"Неожиданная ошибка при транскрибации: {exc}", trace_id, status=500)
-
-        # Этап 5: Формирование ответа
+    payload = request.get_json(force=True, silent=False)
+    request_data = AnalyzeRequest.model_validate(payload)
+
+    # SSE для браузеров (EventSource), иначе NDJSON - по строке JSON на событие
+    use_sse = "text/event-stream" in request.headers.get("Accept", "")
+    formatter = format_sse if use_sse else format_ndjson
+
+    def generate():
+        for event, data in analysis_events(request_data, trace_id):
+            yield formatter(event, data)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream" if use_sse else "application/x-ndjson",
+        # Отключаем буферизацию nginx, иначе события придут одной пачкой в конце
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Trace-Id": trace_id},
+    )
+
+
+@app.post("/analyze/batch")
+def analyze_batch():
+    trace_id = generate_trace_id()
+
+    payload = request.get_json(force=True, silent=False)
+    batch = BatchAnalyzeRequest.model_validate(payload)
+    if len(batch.urls) > BATCH_MAX_ITEMS:
+        return _json_error(f"Слишком много ссылок: {len(batch.urls)} (максимум {BATCH_MAX_ITEMS})", trace_id, status=400)
+
+    items = run_batch(
+        batch,
+        trace_id,
+        prepare_workers=max(1, BATCH_DOWNLOAD_WORKERS),
+        transcribe_workers=max(1, BATCH_TRANSCRIBE_WORKERS),
+        deadline=request_deadline(),
+    )
+    succeeded = sum(item.error is None for item in items)
+    response_model = BatchAnalyzeResponse(
+        items=items, succeeded=succeeded, failed=len(items) - succeeded, trace_id=trace_id
+    )
+    print(f"[{trace_id}] ✅ Пакет обработан: {succeeded} из {len(items)} успешно")
+    return jsonify(response_model.model_dump(mode="json", exclude_none=True))
+
+
+@app.post("/jobs")
+def create_job():
+    trace_id = generate_trace_id()
+
+    payload = request.get_json(force=True, silent=False)
+    job_request = JobRequest.model_validate(payload)
+    if job_request.callback_url is not None:
         try:
-            print(f"[{trace_id}] Этап 5: Формирование ответа...")
-            full_text = transcription.text or " ".join(seg.text.strip() for seg in transcription.segments)
-            timestamps = _build_timestamps(transcription)
-
-            response_model = AnalyzeResponse(
-                platform=platform,
-                url=normalized_metadata.url or url_str,
-                title=normalized_metadata.title,
-                author=normalized_metadata.author,
-                description=normalized_metadata.description,
-                language=transcription.language,
-                duration=normalized_metadata.duration,
-                transcript=full_text.strip(),
-                timestamps=timestamps,
-                trace_id=trace_id,
-            )
-
-            print(f"[{trace_id}] ✅ Ответ сформирован успешно")
-            return jsonify(response_model.model_dump(exclude_none=True))
-        except Exception as exc:
-            print(f"[{trace_id}] ❌ Error forming response: {exc}")
-            traceback.print_exc()
-            return _json_error(f"Ошибка формирования ответа: {exc}", trace_id, status=500)
-    finally:
-        # Выполняем очистку после обработки
-        cleanup_targets.append(work_dir)
-        cleanup_paths(cleanup_targets)
-
-
-def _build_timestamps(transcription: TranscriptionResult) -> List[TimestampEntry]:
-    entries: List[TimestampEntry] = []
-    for segment in transcription.segments:
-        text = segment.text.strip()
-        if not text:
-            continue
-        entries.append(
-            TimestampEntry(
-                time=format_timestamp(segment.start),
-                text=text,
-            )
-        )
-    return entries
+            check_callback_url(str(job_request.callback_url), JOB_CALLBACK_ALLOWED_HOSTS)
+        except CallbackUrlError as exc:
+            return _json_error(str(exc), trace_id, status=400)
+
+    job_id = job_store.create(job_request)
+    job_runner.wake()
+    print(f"[{trace_id}] 📥 Задача {job_id} поставлена в очередь: {job_request.url}")
+    job = job_store.get(job_id)
+    return jsonify(job.model_dump(mode="json", exclude_none=True)), 202
+
+
+@app.get("/jobs/<job_id>")
+def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        return _json_error(f"Задача {job_id} не найдена", generate_trace_id(), status=404)
+    return jsonify(job.model_dump(mode="json", exclude_none=True))
+
+
+@app.get("/stats")
+def stats():
+    payload = collect_stats()
+    payload["jobs"] = job_store.counts()
+    return jsonify(payload)
+
+
+@app.get("/profiles/<trace_id>")
+def get_profile(trace_id: str):
+    if (
+        not PROFILING_ENABLED
+        or not re.fullmatch(r"[0-9a-f]{32}", trace_id)
+        or not (PROFILE_DIR / f"{trace_id}.folded").exists()
+    ):
+        return _json_error(f"Профиль {trace_id} не найден", generate_trace_id(), status=404)
+    return send_from_directory(PROFILE_DIR, f"{trace_id}.folded", mimetype="text/plain")
+
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+def _start_profiler(trace_id: str) -> Optional[SamplingProfiler]:
+    if not PROFILING_ENABLED or request.headers.get("X-Profile") != "1":
+        return None
+    print(f"[{trace_id}] 🔬 Профилирование запроса включено")
+    return SamplingProfiler(trace_id).start()
 
 
 def _json_error(message: str, trace_id: str, status: int):
@@ -149,5 +196,6 @@ def create_app() -> Flask:
 
 
 if __name__ == "__main__":
+    job_runner.ensure_started()
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
 
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Tuple
+
+# В multiprocess-режиме значения пишутся в файлы каталога, общего для
+# воркеров gunicorn; каталог должен существовать до создания метрик
+_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if _MULTIPROC_DIR:
+    Path(_MULTIPROC_DIR).mkdir(parents=True, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from .tracing import span  # noqa: E402
+
+# Скачивание и обработка длинных видео занимают минуты
+_LONG_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800)
+_CHUNK_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+REQUEST_SECONDS = Histogram(
+    "video_api_request_duration_seconds",
+    "Full analysis time per request",
+    ["platform", "outcome"],
+    buckets=_LONG_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "video_api_stage_duration_seconds",
+    "Time spent in a pipeline stage (download, extract, vad, split, transcribe)",
+    ["stage", "platform"],
+    buckets=_LONG_BUCKETS,
+)
+WHISPER_CHUNK_SECONDS = Histogram(
+    "video_api_whisper_chunk_duration_seconds",
+    "Whisper API latency per chunk, including retries and quota waits",
+    ["platform"],
+    buckets=_CHUNK_BUCKETS,
+)
+DOWNLOADED_BYTES = Counter("video_api_downloaded_bytes", "Bytes downloaded by yt-dlp", ["platform"])
+TRANSCRIBED_AUDIO_SECONDS = Counter(
+    "video_api_transcribed_audio_seconds", "Seconds of audio sent to Whisper", ["platform"]
+)
+CHUNKS = Counter("video_api_chunks", "Transcribed chunks by source (whisper, local or checkpoint)", ["platform", "source"])
+RETRIES = Counter("video_api_retries", "Retried attempts per stage", ["stage"])
+ERRORS = Counter("video_api_errors", "Failed pipeline stages", ["stage", "platform"])
+
+
+@contextmanager
+def track_stage(stage: str, platform: Any) -> Iterator[None]:
+    """
+    Замеряет длительность этапа и пишет span трассировки; исключение внутри
+    блока считается ошибкой этапа.
+    """
+    label = platform_label(platform)
+    started = time.perf_counter()
+    try:
+        with span(stage, platform=label):
+            yield
+    except BaseException:
+        ERRORS.labels(stage=stage, platform=label).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage=stage, platform=label).observe(time.perf_counter() - started)
+
+
+def platform_label(platform: Any) -> str:
+    """Значение метки platform: Platform, строка или None."""
+    return str(getattr(platform, "value", platform) or "unknown")
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Метрики в текстовом формате Prometheus: по всем воркерам, если задан PROMETHEUS_MULTIPROC_DIR."""
+    if _MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
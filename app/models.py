@@ -12,8 +12,22 @@ class Platform(str, Enum):
     INSTAGRAM = "instagram"
 
 
+class Priority(str, Enum):
+    NORMAL = "normal"
+    LOW = "low"
+
+
 class AnalyzeRequest(BaseModel):
     url: HttpUrl = Field(..., description="HTTPS ссылка на видео в поддерживаемых платформах")
+    prefer_captions: Optional[bool] = Field(
+        None, description="Использовать готовые субтитры платформы, если они есть (по умолчанию CAPTIONS_DEFAULT)"
+    )
+    caption_languages: Optional[List[str]] = Field(
+        None, description="Допустимые языки субтитров в порядке предпочтения (по умолчанию CAPTIONS_LANGUAGES)"
+    )
+    priority: Priority = Field(
+        Priority.NORMAL, description="low - запрос не срочный, его можно транскрибировать локальным движком"
+    )
 
 
 class TimestampEntry(BaseModel):
@@ -31,5 +45,53 @@ class AnalyzeResponse(BaseModel):
     duration: Optional[float] = Field(None, description="Длительность видео в секундах")
     transcript: str
     timestamps: List[TimestampEntry]
+    transcript_source: Optional[str] = Field(
+        None, description="Источник текста: whisper, captions_manual или captions_auto"
+    )
     trace_id: str
 
+
+class JobRequest(AnalyzeRequest):
+    callback_url: Optional[HttpUrl] = Field(
+        None, description="Адрес, на который POST-запросом придёт итоговый ответ задачи"
+    )
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: JobStatus
+    stage: Optional[str] = Field(None, description="Текущий этап конвейера")
+    progress: dict = Field(default_factory=dict, description="Время начала этапов и прогресс транскрибации")
+    attempts: int = 0
+    created_at: float
+    updated_at: float
+    result: Optional[AnalyzeResponse] = None
+    error: Optional[str] = None
+    callback_status: Optional[str] = None
+
+
+class BatchAnalyzeRequest(BaseModel):
+    urls: List[HttpUrl] = Field(..., min_length=1, description="Ссылки на видео; обрабатываются с перекрытием этапов")
+    prefer_captions: Optional[bool] = Field(None, description="Как в AnalyzeRequest, для всех ссылок")
+    caption_languages: Optional[List[str]] = Field(None, description="Как в AnalyzeRequest, для всех ссылок")
+
+
+class BatchItemResult(BaseModel):
+    url: str
+    status: int = Field(..., description="HTTP-статус, который вернул бы /analyze для этой ссылки")
+    result: Optional[AnalyzeResponse] = None
+    error: Optional[str] = None
+
+
+class BatchAnalyzeResponse(BaseModel):
+    items: List[BatchItemResult]
+    succeeded: int
+    failed: int
+    trace_id: str
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import os
+import random
+import sys
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Optional, TypeVar
+
+from .metrics import RETRIES
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+# openai и httpx импортируются при создании первого клиента: сам пакет
+# openai грузится сотни миллисекунд, а воркеру он нужен только для Whisper.
+
+T = TypeVar("T")
+
+
+@dataclass
+class ClientSettings:
+    # Запрос к Whisper с большим файлом может идти несколько минут
+    read_timeout: float = 600.0
+    connect_timeout: float = 10.0
+    max_connections: int = 16
+    keepalive_expiry: float = 120.0
+    max_attempts: int = 5
+    backoff_base: float = 1.0
+    backoff_max: float = 60.0
+    # Retry-After больше этого значения считаем неразумным и ограничиваем
+    retry_after_cap: float = 120.0
+
+
+_settings = ClientSettings()
+_client: Optional[OpenAI] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+# Ключ - сам цикл: запись исчезает вместе с циклом, id закрытого цикла не переиспользуется
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+_stats: Dict[str, int] = {
+    "calls": 0,
+    "retries": 0,
+    "rate_limited": 0,
+    "server_errors": 0,
+    "connection_errors": 0,
+    "failures": 0,
+}
+_stats_lock = threading.Lock()
+
+
+def configure(**overrides) -> None:
+    """Меняет настройки клиента; действует для следующего созданного клиента."""
+    global _client
+    with _client_lock:
+        for name, value in overrides.items():
+            if value is not None:
+                setattr(_settings, name, value)
+        _client = None
+
+
+def get_openai_client() -> OpenAI:
+    """
+    Возвращает долгоживущий клиент OpenAI для текущего процесса.
+
+    Клиент держит пул keep-alive соединений, поэтому TLS-рукопожатие
+    выполняется один раз на воркер, а не на каждый запрос. После fork
+    (gunicorn --preload) создаётся новый клиент: сокеты родителя не делятся.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            import httpx
+            from openai import OpenAI
+
+            http_client = httpx.Client(
+                timeout=httpx.Timeout(
+                    _settings.read_timeout,
+                    connect=_settings.connect_timeout,
+                    pool=_settings.connect_timeout,
+                ),
+                limits=httpx.Limits(
+                    max_connections=_settings.max_connections,
+                    max_keepalive_connections=_settings.max_connections,
+                    keepalive_expiry=_settings.keepalive_expiry,
+                ),
+            )
+            # Повторы выполняет call_with_retry, встроенные отключаем
+            _client = OpenAI(http_client=http_client, max_retries=0)
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Асинхронный клиент для текущего цикла событий.
+
+    httpx.AsyncClient привязан к циклу, в котором открыл соединения,
+    поэтому клиент создаётся на каждый цикл (обычно один на процесс).
+    """
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        for stale in [known for known in _async_clients if known.is_closed()]:
+            # Клиент может ссылаться на свой цикл, поэтому закрытые циклы убираем явно
+            del _async_clients[stale]
+        client = _async_clients.get(loop)
+        if client is None:
+            import httpx
+            from openai import AsyncOpenAI
+
+            http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    _settings.read_timeout,
+                    connect=_settings.connect_timeout,
+                    pool=_settings.connect_timeout,
+                ),
+                limits=httpx.Limits(
+                    max_connections=_settings.max_connections,
+                    max_keepalive_connections=_settings.max_connections,
+                    keepalive_expiry=_settings.keepalive_expiry,
+                ),
+            )
+            client = AsyncOpenAI(http_client=http_client, max_retries=0)
+            _async_clients[loop] = client
+        return client
+
+
+def call_with_retry(func: Callable[[], T], description: str = "OpenAI request") -> T:
+    """
+    Выполняет func с повтором при 429, 5xx и сетевых ошибках.
+
+    Пауза - экспоненциальная с полным джиттером; если сервер прислал
+    Retry-After, ждём не меньше указанного.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        _increment("calls")
+        try:
+            return func()
+        except Exception as exc:
+            delay = _retry_delay(exc, attempt, description)
+            if delay is None:
+                raise
+        time.sleep(delay)
+
+
+async def call_with_retry_async(func: Callable[[], Awaitable[T]], description: str = "OpenAI request") -> T:
+    """Асинхронный вариант call_with_retry: пауза не блокирует цикл событий."""
+    attempt = 0
+    while True:
+        attempt += 1
+        _increment("calls")
+        try:
+            return await func()
+        except Exception as exc:
+            delay = _retry_delay(exc, attempt, description)
+            if delay is None:
+                raise
+        await asyncio.sleep(delay)
+
+
+def get_retry_stats() -> Dict[str, int]:
+    """Счётчики вызовов и повторов в текущем процессе."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _retry_delay(error: Exception, attempt: int, description: str) -> Optional[float]:
+    """Пауза перед следующей попыткой или None, если ошибку нужно поднять."""
+    kind = _retry_kind(error)
+    if kind is None:
+        openai = _openai_module()
+        if openai is not None and isinstance(error, openai.OpenAIError):
+            _increment("failures")
+        return None
+
+    _increment(kind)
+    if attempt >= _settings.max_attempts:
+        _increment("failures")
+        return None
+
+    delay = _backoff_delay(attempt, _retry_after_seconds(error))
+    _increment("retries")
+    RETRIES.labels(stage="whisper").inc()
+    print(f"[WARN] {description} failed ({type(error).__name__}), retry {attempt}/{_settings.max_attempts - 1} in {delay:.1f}s")
+    return delay
+
+
+def _openai_module():
+    # Ошибка OpenAI возможна, только если пакет уже загружен: импортировать его ради проверки незачем
+    return sys.modules.get("openai")
+
+
+def _retry_kind(error: Exception) -> Optional[str]:
+    openai = _openai_module()
+    if openai is None:
+        return None
+    if isinstance(error, openai.RateLimitError):
+        # Исчерпанная квота не восстановится за время повторов
+        return None if getattr(error, "code", None) == "insufficient_quota" else "rate_limited"
+    if isinstance(error, openai.InternalServerError):
+        return "server_errors"
+    if isinstance(error, openai.APIConnectionError):
+        # Включает APITimeoutError
+        return "connection_errors"
+    if isinstance(error, openai.APIStatusError) and error.status_code in (408, 409):
+        return "server_errors"
+    return None
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[float]) -> float:
+    ceiling = min(_settings.backoff_max, _settings.backoff_base * 2 ** (attempt - 1))
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, _settings.retry_after_cap))
+    return delay
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        # Битый заголовок не должен подменять исходную ошибку API
+        return None
+    if parsed is None:
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+def _increment(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
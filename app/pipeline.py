@@ -0,0 +1,940 @@
+from __future__ import annotations
+
+import importlib
+import math
+import os
+import sqlite3
+import time
+import traceback
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .admission import LANE_LONG, Admission, AdmissionLedger, OverCapacityError
+from .audio_extractor import AudioExtractionError, extract_audio, get_audio_format
+from .captions import CAPTIONS_YDL_OPTS, CaptionsError, fetch_captions
+from .checkpoints import AudioRetention, CheckpointStore, RetainedAudio
+from .downloader import DownloadError, VideoMetadata, download_video, expected_filesize, probe_video, warm_ydl_pool
+from .metadata_processor import NormalizedMetadata, normalize_metadata
+from .metrics import DOWNLOADED_BYTES, REQUEST_SECONDS, platform_label, track_stage
+from .models import AnalyzeRequest, AnalyzeResponse, Platform, Priority, TimestampEntry
+from .openai_client import configure as configure_openai_client, get_retry_stats
+from .platform_detector import InvalidUrlError, detect_video
+from .rate_governor import RateGovernor
+from .result_cache import ResultCache
+from .scratch import ScratchArea, ScratchBudgetError, ScratchDir, ScratchSpace
+from .single_flight import Flight, FlightWaitTimeout, SingleFlight
+from .stage_scheduler import StageBusyError, StageScheduler
+from .streaming import stream_audio
+from .tracing import configure as configure_tracing, span, trace
+from .transcriber import (
+    QuotaWaitError,
+    TranscriptionError,
+    TranscriptionResult,
+    TranscriptionSegment,
+    transcribe_audio,
+)
+from .transcription_backends import (
+    BACKEND_OPENAI,
+    BackendRouter,
+    LocalWhisperBackend,
+    OpenAIBackend,
+    TranscriptionBackend,
+)
+from .utils import cleanup_paths, format_timestamp
+from .vad import OffsetMap, VadError, trim_silence
+from .ydl_pool import configure as configure_ydl_pool, get_pool_stats as get_ydl_pool_stats, warm as warm_pool
+
+load_dotenv()
+
+TEMP_ROOT = Path(os.getenv("TEMP_DIR", "/tmp/video_api"))
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "whisper-1")
+# Каталог для общего состояния воркеров (кэши, базы SQLite)
+STATE_DIR = Path(os.getenv("STATE_DIR", "/tmp/video_api_state"))
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") != "0"
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "512"))
+# Объединять одновременные запросы одного видео (между воркерами)
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") != "0"
+# Меньше timeout воркера gunicorn (600 с): после него ведомый получает 503 с Retry-After
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", "300"))
+# Готовые субтитры платформы вместо Whisper (можно включить в запросе)
+CAPTIONS_DEFAULT = os.getenv("CAPTIONS_DEFAULT", "0") == "1"
+CAPTIONS_LANGUAGES = [lang.strip() for lang in os.getenv("CAPTIONS_LANGUAGES", "ru,en").split(",") if lang.strip()]
+TRANSCRIPT_SOURCE_WHISPER = "whisper"
+# Формат аудио для Whisper: wav, flac, opus или mp3 (сжатые форматы - меньше частей и запросов)
+AUDIO_FORMAT = get_audio_format(
+    os.getenv("AUDIO_CODEC", "wav"),
+    float(os.getenv("AUDIO_BITRATE_KBPS")) if os.getenv("AUDIO_BITRATE_KBPS") else None,
+)
+# Вырезать тишину перед транскрибацией (таймкоды остаются в исходной шкале)
+VAD_ENABLED = os.getenv("VAD_ENABLED", "0") == "1"
+VAD_NOISE_DB = float(os.getenv("VAD_NOISE_DB", "-35"))
+VAD_MIN_SILENCE_SECONDS = float(os.getenv("VAD_MIN_SILENCE_SECONDS", "1.0"))
+VAD_PADDING_SECONDS = float(os.getenv("VAD_PADDING_SECONDS", "0.25"))
+# Делить длинное аудио на равные части (параллельные запросы завершаются одновременно)
+CHUNK_EQUAL_LENGTH = os.getenv("CHUNK_EQUAL_LENGTH", "0") == "1"
+# Сколько частей одного аудио отправлять в Whisper параллельно
+WHISPER_MAX_CONCURRENCY = int(os.getenv("WHISPER_MAX_CONCURRENCY", "4"))
+# Клиент OpenAI: таймауты и повторы при 429/5xx/сетевых ошибках
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "600"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "10"))
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "5"))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "60"))
+# Общие для всех воркеров квоты Whisper (0 - без ограничения)
+WHISPER_REQUESTS_PER_MINUTE = float(os.getenv("WHISPER_REQUESTS_PER_MINUTE", "50"))
+WHISPER_AUDIO_SECONDS_PER_MINUTE = float(os.getenv("WHISPER_AUDIO_SECONDS_PER_MINUTE", "0"))
+WHISPER_QUOTA_MAX_WAIT_SECONDS = float(os.getenv("WHISPER_QUOTA_MAX_WAIT_SECONDS", "120"))
+# Сколько секунд синхронный запрос (/analyze, /analyze/stream, /analyze/batch) может
+# работать, чтобы ответить до timeout воркера gunicorn (600 с); 0 - без ограничения.
+# Ожидание квоты Whisper не выходит за остаток этого времени
+REQUEST_TIME_BUDGET_SECONDS = float(os.getenv("REQUEST_TIME_BUDGET_SECONDS", "540"))
+# Результаты частей и аудио неудавшихся запросов: повтор продолжает с места сбоя
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS_ENABLED", "1") != "0"
+CHECKPOINT_TTL_SECONDS = float(os.getenv("CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+AUDIO_RETENTION_SECONDS = float(os.getenv("AUDIO_RETENTION_SECONDS", "3600"))
+# Передавать поток yt-dlp напрямую в ffmpeg без промежуточного файла
+STREAMING_MODE = os.getenv("STREAMING_MODE", "0") == "1"
+# Скачивать только аудиопоток (смешанный файл - лишь как запасной вариант)
+AUDIO_ONLY_DOWNLOAD = os.getenv("AUDIO_ONLY_DOWNLOAD", "1") != "0"
+# Файл span трассировки (JSONL, OTLP/JSON); пусто - трассировка не пишется
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+# Пул готовых YoutubeDL на воркер и прогрев при старте (см. warm_up)
+YTDL_POOL_MAX_IDLE = int(os.getenv("YTDL_POOL_MAX_IDLE", "4"))
+YTDL_POOL_MAX_USES = int(os.getenv("YTDL_POOL_MAX_USES", "50"))
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") != "0"
+# Пулы этапов (на воркер): потоков и мест в очереди; при полной очереди - ожидание,
+# заметно короче timeout gunicorn, чтобы клиент получил 503, а не обрыв соединения
+STAGE_DOWNLOAD_WORKERS = int(os.getenv("STAGE_DOWNLOAD_WORKERS", "4"))
+STAGE_DOWNLOAD_QUEUE = int(os.getenv("STAGE_DOWNLOAD_QUEUE", "8"))
+STAGE_FFMPEG_WORKERS = int(os.getenv("STAGE_FFMPEG_WORKERS", str(os.cpu_count() or 2)))
+STAGE_FFMPEG_QUEUE = int(os.getenv("STAGE_FFMPEG_QUEUE", "8"))
+STAGE_TRANSCRIBE_WORKERS = int(os.getenv("STAGE_TRANSCRIBE_WORKERS", "4"))
+STAGE_TRANSCRIBE_QUEUE = int(os.getenv("STAGE_TRANSCRIBE_QUEUE", "8"))
+STAGE_QUEUE_WAIT_SECONDS = float(os.getenv("STAGE_QUEUE_WAIT_SECONDS", "60"))
+
+# Рабочие каталоги: небольшие задачи в RAM (tmpfs), остальные на диске в TEMP_DIR
+SCRATCH_RAM_DIR = os.getenv("SCRATCH_RAM_DIR", "")
+SCRATCH_RAM_MAX_MB = float(os.getenv("SCRATCH_RAM_MAX_MB", "512"))
+SCRATCH_RAM_JOB_MAX_MB = float(os.getenv("SCRATCH_RAM_JOB_MAX_MB", "128"))
+SCRATCH_DISK_MAX_MB = float(os.getenv("SCRATCH_DISK_MAX_MB", "10240"))
+# Ожидаемый объём файлов задачи; короткие ролики TikTok/Instagram заметно меньше
+SCRATCH_JOB_ESTIMATE_MB = float(os.getenv("SCRATCH_JOB_ESTIMATE_MB", "512"))
+SCRATCH_SHORT_JOB_ESTIMATE_MB = float(os.getenv("SCRATCH_SHORT_JOB_ESTIMATE_MB", "64"))
+SCRATCH_WAIT_SECONDS = float(os.getenv("SCRATCH_WAIT_SECONDS", "120"))
+SCRATCH_ORPHAN_AGE_SECONDS = float(os.getenv("SCRATCH_ORPHAN_AGE_SECONDS", "300"))
+SCRATCH_JANITOR_INTERVAL_SECONDS = float(os.getenv("SCRATCH_JANITOR_INTERVAL_SECONDS", "60"))
+
+# Предварительный probe (extract_info без скачивания): лимиты и учёт нагрузки до загрузки
+PREFLIGHT_PROBE_ENABLED = os.getenv("PREFLIGHT_PROBE_ENABLED", "1") != "0"
+MAX_VIDEO_DURATION_SECONDS = float(os.getenv("MAX_VIDEO_DURATION_SECONDS", str(4 * 3600)))
+MAX_VIDEO_FILESIZE_MB = float(os.getenv("MAX_VIDEO_FILESIZE_MB", "2048"))
+LONG_JOB_DURATION_SECONDS = float(os.getenv("LONG_JOB_DURATION_SECONDS", "3600"))
+LONG_JOB_SLOTS = int(os.getenv("LONG_JOB_SLOTS", "1"))
+ADMISSION_CAPACITY_AUDIO_MINUTES = float(os.getenv("ADMISSION_CAPACITY_AUDIO_MINUTES", "600"))
+ADMISSION_RETRY_AFTER_SECONDS = float(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "30"))
+
+# Движок транскрибации: openai (Whisper API), local (faster-whisper на CPU) или auto
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", BACKEND_OPENAI).strip().lower()
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small")
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_WHISPER_CPU_THREADS = int(os.getenv("LOCAL_WHISPER_CPU_THREADS", "0"))
+LOCAL_WHISPER_BATCH_SIZE = int(os.getenv("LOCAL_WHISPER_BATCH_SIZE", "8"))
+LOCAL_WHISPER_CONCURRENCY = int(os.getenv("LOCAL_WHISPER_CONCURRENCY", "1"))
+# В режиме auto аудио не длиннее этого (после VAD) транскрибируется локально
+LOCAL_MAX_AUDIO_SECONDS = float(os.getenv("LOCAL_MAX_AUDIO_SECONDS", "300"))
+
+# Проверка наличия API ключа
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+if not OPENAI_API_KEY:
+    print("⚠️  WARNING: OPENAI_API_KEY not found in environment variables!")
+else:
+    print(f"✅ OPENAI_API_KEY loaded (length: {len(OPENAI_API_KEY)} chars)")
+
+configure_openai_client(
+    read_timeout=OPENAI_TIMEOUT_SECONDS,
+    connect_timeout=OPENAI_CONNECT_TIMEOUT_SECONDS,
+    max_connections=max(16, WHISPER_MAX_CONCURRENCY * 2),
+    max_attempts=max(1, OPENAI_MAX_ATTEMPTS),
+    backoff_max=OPENAI_BACKOFF_MAX_SECONDS,
+)
+configure_tracing(Path(TRACE_FILE) if TRACE_FILE else None)
+configure_ydl_pool(max_idle=max(0, YTDL_POOL_MAX_IDLE), max_uses=max(1, YTDL_POOL_MAX_USES))
+
+result_cache = (
+    ResultCache(
+        STATE_DIR / "results.sqlite3",
+        ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+        max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024),
+    )
+    if RESULT_CACHE_ENABLED
+    else None
+)
+rate_governor = (
+    RateGovernor(
+        STATE_DIR / "whisper_quota.sqlite3",
+        requests_per_minute=WHISPER_REQUESTS_PER_MINUTE,
+        audio_seconds_per_minute=WHISPER_AUDIO_SECONDS_PER_MINUTE,
+        max_wait_seconds=WHISPER_QUOTA_MAX_WAIT_SECONDS,
+    )
+    if WHISPER_REQUESTS_PER_MINUTE > 0 or WHISPER_AUDIO_SECONDS_PER_MINUTE > 0
+    else None
+)
+checkpoint_store = (
+    CheckpointStore(STATE_DIR / "checkpoints.sqlite3", ttl_seconds=CHECKPOINT_TTL_SECONDS)
+    if CHECKPOINTS_ENABLED
+    else None
+)
+audio_retention = AudioRetention(STATE_DIR / "retained", AUDIO_RETENTION_SECONDS) if CHECKPOINTS_ENABLED else None
+single_flight = (
+    SingleFlight(STATE_DIR / "inflight", wait_timeout=SINGLE_FLIGHT_WAIT_SECONDS, handoff_ttl=300)
+    if SINGLE_FLIGHT_ENABLED
+    else None
+)
+scratch_space = ScratchSpace(
+    ScratchArea("disk", TEMP_ROOT, max_bytes=int(SCRATCH_DISK_MAX_MB * 1024 * 1024)),
+    ram=(
+        ScratchArea(
+            "ram",
+            Path(SCRATCH_RAM_DIR),
+            max_bytes=int(SCRATCH_RAM_MAX_MB * 1024 * 1024),
+            max_job_bytes=int(SCRATCH_RAM_JOB_MAX_MB * 1024 * 1024),
+        )
+        if SCRATCH_RAM_DIR
+        else None
+    ),
+    wait_seconds=SCRATCH_WAIT_SECONDS,
+    orphan_age_seconds=SCRATCH_ORPHAN_AGE_SECONDS,
+    janitor_interval_seconds=SCRATCH_JANITOR_INTERVAL_SECONDS,
+)
+admission_ledger = AdmissionLedger(
+    STATE_DIR / "admission.sqlite3",
+    capacity_audio_seconds=ADMISSION_CAPACITY_AUDIO_MINUTES * 60,
+    long_job_seconds=LONG_JOB_DURATION_SECONDS,
+    long_job_slots=LONG_JOB_SLOTS,
+    retry_after_seconds=ADMISSION_RETRY_AFTER_SECONDS,
+)
+backend_router = BackendRouter(
+    TRANSCRIPTION_BACKEND,
+    api=OpenAIBackend(WHISPER_MODEL),
+    local=(
+        LocalWhisperBackend(
+            model_size=LOCAL_WHISPER_MODEL,
+            compute_type=LOCAL_WHISPER_COMPUTE_TYPE,
+            cpu_threads=LOCAL_WHISPER_CPU_THREADS,
+            batch_size=LOCAL_WHISPER_BATCH_SIZE,
+            concurrency=LOCAL_WHISPER_CONCURRENCY,
+        )
+        if TRANSCRIPTION_BACKEND != BACKEND_OPENAI and LocalWhisperBackend.available()
+        else None
+    ),
+    local_max_seconds=LOCAL_MAX_AUDIO_SECONDS,
+)
+if TRANSCRIPTION_BACKEND != BACKEND_OPENAI and backend_router.local is None:
+    print(f"⚠️  WARNING: TRANSCRIPTION_BACKEND={TRANSCRIPTION_BACKEND}, but faster-whisper is not installed; using Whisper API")
+stage_scheduler = StageScheduler()
+stage_scheduler.add_stage("download", STAGE_DOWNLOAD_WORKERS, STAGE_DOWNLOAD_QUEUE, STAGE_QUEUE_WAIT_SECONDS)
+stage_scheduler.add_stage("ffmpeg", STAGE_FFMPEG_WORKERS, STAGE_FFMPEG_QUEUE, STAGE_QUEUE_WAIT_SECONDS)
+stage_scheduler.add_stage("transcribe", STAGE_TRANSCRIBE_WORKERS, STAGE_TRANSCRIBE_QUEUE, STAGE_QUEUE_WAIT_SECONDS)
+
+
+# Этапы конвейера в порядке выполнения (для отчёта о прогрессе)
+STAGES = ("captions", "download", "extract", "vad", "metadata", "transcribe", "response")
+
+ProgressCallback = Callable[[str, Optional[Dict[str, Any]]], None]
+SegmentsCallback = Callable[[int, List[TimestampEntry]], None]
+
+
+class PipelineError(RuntimeError):
+    """Ошибка обработки видео с HTTP-статусом для ответа клиенту."""
+
+    def __init__(self, message: str, status: int = 500, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        # Для 429/503: через сколько секунд имеет смысл повторить (заголовок Retry-After)
+        self.retry_after = retry_after
+
+
+@dataclass
+class AnalysisState:
+    """
+    Состояние одного видео между подготовкой и транскрибацией.
+
+    Если payload уже заполнен (кэш или результат параллельного запроса),
+    транскрибировать ничего не нужно. close() освобождает single-flight
+    и удаляет временные файлы.
+    """
+
+    trace_id: str
+    url: str
+    platform: Optional[Platform] = None
+    cache_key: Optional[str] = None
+    source_key: Optional[str] = None
+    payload: Optional[dict] = None
+    flight: Optional[Flight] = None
+    work_dir: Optional[Path] = None
+    scratch: Optional[ScratchDir] = None
+    # Результат предварительного probe; переиспользуется при скачивании и поиске субтитров
+    probe_info: Optional[dict] = None
+    admission: Optional[Admission] = None
+    cleanup_targets: List[Path] = field(default_factory=list)
+    transcription: Optional[TranscriptionResult] = None
+    transcript_source: str = TRANSCRIPT_SOURCE_WHISPER
+    raw_metadata: Optional[VideoMetadata] = None
+    normalized_metadata: Optional[NormalizedMetadata] = None
+    audio_path: Optional[Path] = None
+    offset_map: Optional[OffsetMap] = None
+    prefer_captions: bool = False
+    caption_languages: List[str] = field(default_factory=list)
+    priority: Priority = Priority.NORMAL
+    # Для метрики времени запроса: ok, cached или error
+    outcome: str = "error"
+    started_at: Optional[float] = field(default_factory=time.perf_counter)
+    # Момент time.monotonic(), к которому нужно ответить (см. request_deadline)
+    deadline: Optional[float] = None
+
+    def close(self) -> None:
+        if self.started_at is not None:
+            REQUEST_SECONDS.labels(platform=platform_label(self.platform), outcome=self.outcome).observe(
+                time.perf_counter() - self.started_at
+            )
+            self.started_at = None
+        if self.flight is not None:
+            self.flight.release()
+            self.flight = None
+        if self.work_dir is not None:
+            # Выполняем очистку после обработки
+            self.cleanup_targets.append(self.work_dir)
+            cleanup_paths(self.cleanup_targets)
+            self.work_dir = None
+        if self.scratch is not None:
+            self.scratch.release()
+            self.scratch = None
+        if self.admission is not None:
+            self.admission.release()
+            self.admission = None
+
+
+def request_deadline() -> Optional[float]:
+    """Момент time.monotonic(), к которому синхронный запрос должен ответить."""
+    if REQUEST_TIME_BUDGET_SECONDS <= 0:
+        return None
+    return time.monotonic() + REQUEST_TIME_BUDGET_SECONDS
+
+
+def run_analysis(
+    request_data: AnalyzeRequest,
+    trace_id: str,
+    progress: Optional[ProgressCallback] = None,
+    deadline: Optional[float] = None,
+) -> dict:
+    """
+    Полный конвейер /analyze: скачивание, аудио, транскрибация, ответ.
+
+    Возвращает готовый ответ (AnalyzeResponse в виде dict) и поднимает
+    PipelineError при ошибке. progress(stage, details) вызывается при
+    переходе к каждому этапу из STAGES и после каждой части Whisper.
+    deadline (request_deadline()) ограничивает ожидание квоты Whisper.
+    """
+    with trace(trace_id, "analyze", url=str(request_data.url)):
+        state = prepare_analysis(request_data, trace_id, progress, deadline)
+        try:
+            return finish_analysis(state, progress)
+        finally:
+            state.close()
+
+
+def begin_analysis(request_data: AnalyzeRequest, trace_id: str, deadline: Optional[float] = None) -> AnalysisState:
+    """
+    Разбирает ссылку, проверяет кэш и занимает single-flight.
+
+    Если ответ уже известен, он лежит в state.payload. Иначе создан
+    рабочий каталог и текущий запрос - ведущий для этого видео.
+    """
+    url_str = str(request_data.url)
+    state = AnalysisState(trace_id=trace_id, url=url_str, priority=request_data.priority, deadline=deadline)
+
+    try:
+        detected = detect_video(url_str)
+    except InvalidUrlError as exc:
+        raise PipelineError(str(exc), status=400) from exc
+    state.platform = detected.platform
+    prefer_captions = state.prefer_captions = (
+        CAPTIONS_DEFAULT if request_data.prefer_captions is None else request_data.prefer_captions
+    )
+    caption_languages = state.caption_languages = request_data.caption_languages or CAPTIONS_LANGUAGES
+    source_key = state.source_key = str(detected.key) if detected.key else None
+    cache_key = source_key
+    if cache_key and prefer_captions:
+        # Ответ из субтитров зависит от списка языков и хранится отдельно
+        cache_key = f"{cache_key}:captions:{','.join(lang.lower() for lang in caption_languages)}"
+    state.cache_key = cache_key
+
+    cached_payload = _cache_get(cache_key, trace_id)
+    if cached_payload is not None:
+        print(f"[{trace_id}] ✅ Ответ взят из кэша ({cache_key})")
+        cached_payload["trace_id"] = trace_id
+        state.payload = cached_payload
+        state.outcome = "cached"
+        return state
+
+    try:
+        with span("single_flight"):
+            flight = state.flight = single_flight.begin(cache_key) if single_flight and cache_key else None
+    except FlightWaitTimeout as exc:
+        state.close()
+        print(f"[{trace_id}] ⚠️  Не дождались параллельного запроса того же видео: {exc}")
+        raise PipelineError(
+            f"{exc}, повторите позже",
+            status=503,
+            retry_after=ADMISSION_RETRY_AFTER_SECONDS,
+        ) from exc
+    if flight is not None and not flight.is_leader:
+        print(f"[{trace_id}] ✅ Получен результат параллельного запроса того же видео ({cache_key})")
+        coalesced_payload = dict(flight.result)
+        coalesced_payload["trace_id"] = trace_id
+        state.payload = coalesced_payload
+        state.outcome = "cached"
+        state.close()
+        return state
+
+    try:
+        _preflight(state)
+        with span("scratch"):
+            scratch = state.scratch = scratch_space.acquire(trace_id, _scratch_estimate(state))
+        state.work_dir = scratch.path
+        if not prefer_captions:
+            # С субтитрами Whisper может не понадобиться: учёт - после их поиска
+            _admit(state)
+    except ScratchBudgetError as exc:
+        state.close()
+        raise PipelineError(
+            f"Недостаточно места для временных файлов, повторите позже: {exc}",
+            status=503,
+            retry_after=ADMISSION_RETRY_AFTER_SECONDS,
+        ) from exc
+    except BaseException:
+        state.close()
+        raise
+    if scratch.area != "disk":
+        print(f"[{trace_id}] Рабочий каталог в RAM: {scratch.path}")
+    return state
+
+
+def prepare_analysis(
+    request_data: AnalyzeRequest,
+    trace_id: str,
+    progress: Optional[ProgressCallback] = None,
+    deadline: Optional[float] = None,
+) -> AnalysisState:
+    """
+    Этапы до Whisper: кэш, субтитры, скачивание, аудио, VAD, метаданные.
+
+    При ошибке ресурсы освобождаются сами; при успехе вызывающий обязан
+    вызвать state.close() после finish_analysis.
+    """
+    state = begin_analysis(request_data, trace_id, deadline)
+    if state.payload is not None:
+        return state
+
+    url_str, platform, source_key = state.url, state.platform, state.source_key
+    work_dir, cleanup_targets = state.work_dir, state.cleanup_targets
+    prefer_captions, caption_languages = state.prefer_captions, state.caption_languages
+
+    try:
+        transcription: Optional[TranscriptionResult] = None
+        transcript_source = TRANSCRIPT_SOURCE_WHISPER
+        if prefer_captions:
+            # Быстрый путь: субтитры платформы без скачивания и Whisper
+            try:
+                _report(progress, "captions")
+                print(f"[{trace_id}] Этап 0: Поиск субтитров ({', '.join(caption_languages)})...")
+                with span("captions"):
+                    captions = fetch_captions(url_str, caption_languages, probe_info=state.probe_info)
+            except CaptionsError as exc:
+                print(f"[{trace_id}] ⚠️  Не удалось получить субтитры: {exc}")
+                captions = None
+            if captions is not None:
+                transcription = captions.transcription
+                transcript_source = captions.source
+                raw_metadata = captions.metadata
+                print(f"[{trace_id}] ✅ Найдены субтитры ({captions.source}, {transcription.language}): {len(transcription.segments)} сегментов")
+            else:
+                print(f"[{trace_id}] Субтитров на допустимом языке нет, используем Whisper")
+                _admit(state)
+
+        audio_path = None
+        offset_map: Optional[OffsetMap] = None
+        restored = False
+        if transcription is None:
+            retained = _restore_audio(source_key, work_dir, trace_id)
+            if retained is not None:
+                audio_path, raw_metadata, offset_map = retained.audio_path, retained.metadata, retained.offset_map
+                restored = True
+                print(f"[{trace_id}] ✅ Используем аудио предыдущей неудачной попытки: {audio_path}")
+
+        if transcription is None and audio_path is None and STREAMING_MODE:
+            # Этапы 1-2 одновременно: yt-dlp пишет поток прямо в ffmpeg
+            try:
+                _report(progress, "download")
+                print(f"[{trace_id}] Этапы 1-2: Потоковое скачивание и извлечение аудио (yt-dlp | ffmpeg)...")
+                audio_path, raw_metadata = stage_scheduler.run(
+                    "download",
+                    track_stage("download", platform)(stream_audio),
+                    url_str,
+                    work_dir,
+                    trace_id,
+                    platform=platform,
+                    audio_only=AUDIO_ONLY_DOWNLOAD,
+                    audio_format=AUDIO_FORMAT,
+                    probe_info=state.probe_info,
+                )
+                cleanup_targets.append(audio_path)
+                DOWNLOADED_BYTES.labels(platform=platform_label(platform)).inc(raw_metadata.downloaded_bytes)
+                print(
+                    f"[{trace_id}] ✅ Аудио извлечено из потока: {audio_path} "
+                    f"({raw_metadata.downloaded_bytes} bytes downloaded, {audio_path.stat().st_size / 1024 / 1024:.2f} MB audio)"
+                )
+            except StageBusyError as exc:
+                # Полное скачивание ждало бы ту же очередь download ещё раз
+                raise PipelineError(f"Сервис перегружен, повторите позже: {exc}", status=503) from exc
+            except Exception as exc:
+                print(f"[{trace_id}] ⚠️  Потоковый режим не сработал ({exc}), скачиваю файл целиком...")
+                audio_path = None
+
+        if transcription is None and audio_path is None:
+            # Этап 1: Скачивание видео
+            try:
+                _report(progress, "download")
+                print(f"[{trace_id}] Этап 1: Скачивание видео через yt-dlp...")
+                video_path, raw_metadata = stage_scheduler.run(
+                    "download",
+                    track_stage("download", platform)(download_video),
+                    url_str,
+                    work_dir,
+                    trace_id,
+                    platform=platform,
+                    audio_only=AUDIO_ONLY_DOWNLOAD,
+                    probe_info=state.probe_info,
+                )
+                cleanup_targets.append(video_path)
+                DOWNLOADED_BYTES.labels(platform=platform_label(platform)).inc(raw_metadata.downloaded_bytes)
+                print(
+                    f"[{trace_id}] ✅ Видео скачано: {video_path} "
+                    f"({raw_metadata.downloaded_bytes} bytes, {raw_metadata.downloaded_bytes / 1024 / 1024:.2f} MB, "
+                    f"acodec={raw_metadata.acodec}, vcodec={raw_metadata.vcodec})"
+                )
+            except DownloadError as exc:
+                raise PipelineError(f"Ошибка скачивания видео (yt-dlp): {exc}", status=500) from exc
+            except StageBusyError as exc:
+                raise PipelineError(f"Сервис перегружен, повторите позже: {exc}", status=503) from exc
+            except Exception as exc:
+                raise PipelineError(f"Неожиданная ошибка при скачивании видео: {exc}", status=500) from exc
+
+            # Этап 2: Извлечение аудио
+            try:
+                _report(progress, "extract")
+                print(f"[{trace_id}] Этап 2: Извлечение аудио через ffmpeg...")
+                audio_path = stage_scheduler.run(
+                    "ffmpeg",
+                    track_stage("extract", platform)(extract_audio),
+                    video_path,
+                    work_dir,
+                    trace_id,
+                    acodec=raw_metadata.acodec,
+                    vcodec=raw_metadata.vcodec,
+                    audio_format=AUDIO_FORMAT,
+                    source_bitrate_kbps=raw_metadata.audio_bitrate_kbps,
+                )
+                cleanup_targets.append(audio_path)
+                print(f"[{trace_id}] ✅ Аудио извлечено: {audio_path} ({audio_path.stat().st_size / 1024 / 1024:.2f} MB)")
+            except AudioExtractionError as exc:
+                raise PipelineError(f"Ошибка извлечения аудио (ffmpeg): {exc}", status=500) from exc
+            except StageBusyError as exc:
+                raise PipelineError(f"Сервис перегружен, повторите позже: {exc}", status=503) from exc
+            except Exception as exc:
+                raise PipelineError(f"Неожиданная ошибка при извлечении аудио: {exc}", status=500) from exc
+
+        if transcription is None and VAD_ENABLED and not restored:
+            # Этап 2a: Удаление тишины; при ошибке продолжаем с полным аудио
+            try:
+                _report(progress, "vad")
+                print(f"[{trace_id}] Этап 2a: Удаление неречевых участков (VAD)...")
+                trim_result = stage_scheduler.run(
+                    "ffmpeg",
+                    track_stage("vad", platform)(trim_silence),
+                    audio_path,
+                    work_dir,
+                    audio_format=AUDIO_FORMAT,
+                    noise_db=VAD_NOISE_DB,
+                    min_silence_seconds=VAD_MIN_SILENCE_SECONDS,
+                    padding_seconds=VAD_PADDING_SECONDS,
+                )
+                if trim_result.audio_path != audio_path:
+                    audio_path = trim_result.audio_path
+                    cleanup_targets.append(audio_path)
+                    offset_map = trim_result.offset_map
+                print(
+                    f"[{trace_id}] ✅ Удалено {trim_result.removed_ratio:.1%} аудио "
+                    f"({trim_result.original_duration:.1f} s -> {trim_result.kept_duration:.1f} s)"
+                )
+            except (VadError, StageBusyError) as exc:
+                print(f"[{trace_id}] ⚠️  VAD не сработал ({exc}), транскрибируем всё аудио")
+
+        # Этап 3: Обработка метаданных
+        try:
+            _report(progress, "metadata")
+            print(f"[{trace_id}] Этап 3: Обработка метаданных...")
+            normalized_metadata = normalize_metadata(platform, raw_metadata)
+            print(f"[{trace_id}] ✅ Метаданные обработаны")
+        except Exception as exc:
+            raise PipelineError(f"Ошибка обработки метаданных: {exc}", status=500) from exc
+
+        state.transcription = transcription
+        state.transcript_source = transcript_source
+        state.raw_metadata = raw_metadata
+        state.normalized_metadata = normalized_metadata
+        state.audio_path = audio_path
+        state.offset_map = offset_map
+        return state
+    except BaseException:
+        state.close()
+        raise
+
+
+def finish_analysis(
+    state: AnalysisState,
+    progress: Optional[ProgressCallback] = None,
+    on_segments: Optional[SegmentsCallback] = None,
+) -> dict:
+    """
+    Этапы 4-5: транскрибация (если текста ещё нет) и ответ; кладёт результат в кэш.
+
+    on_segments(номер части, таймкоды) вызывается по порядку частей, как
+    только часть распознана; для субтитров - один раз со всем текстом.
+    """
+    if state.payload is not None:
+        return state.payload
+
+    trace_id = state.trace_id
+    source_key = state.source_key
+    transcription = state.transcription
+    audio_path, raw_metadata, offset_map = state.audio_path, state.raw_metadata, state.offset_map
+
+    def emit_segments(position: int, segments: List[TranscriptionSegment]) -> None:
+        if on_segments is None:
+            return
+        if offset_map is not None:
+            segments = [
+                TranscriptionSegment(
+                    start=offset_map.to_original(segment.start),
+                    end=offset_map.to_original(segment.end),
+                    text=segment.text,
+                )
+                for segment in segments
+            ]
+        try:
+            on_segments(position, _build_timestamps(segments))
+        except Exception as exc:
+            print(f"[{trace_id}] ⚠️  Не удалось передать сегменты части {position + 1}: {exc}")
+
+    if transcription is not None:
+        emit_segments(0, transcription.segments)
+    else:
+        # Этап 4: Транскрибация (Whisper API или локальный движок)
+        try:
+            _report(progress, "transcribe")
+            backend = choose_backend(state)
+            print(f"[{trace_id}] Этап 4: Транскрибация ({backend.name})...")
+            transcription = stage_scheduler.run(
+                "transcribe",
+                track_stage("transcribe", state.platform)(transcribe_audio),
+                audio_path,
+                WHISPER_MODEL,
+                equal_chunks=CHUNK_EQUAL_LENGTH,
+                max_concurrency=WHISPER_MAX_CONCURRENCY,
+                rate_governor=rate_governor.until(state.deadline) if rate_governor is not None else None,
+                checkpoint=checkpoint_store,
+                source_key=source_key,
+                on_chunk_done=lambda done, total: _report(progress, "transcribe", {"chunks_done": done, "chunks_total": total}),
+                on_segments=emit_segments if on_segments is not None else None,
+                platform=platform_label(state.platform),
+                backend=backend,
+            )
+            if offset_map is not None:
+                transcription = offset_map.apply(transcription)
+            print(f"[{trace_id}] ✅ Транскрибация завершена: {len(transcription.segments)} сегментов, язык: {transcription.language}")
+        except QuotaWaitError as exc:
+            print(f"[{trace_id}] ⚠️  {exc}")
+            _retain_audio(source_key, audio_path, raw_metadata, offset_map, trace_id)
+            raise _quota_exhausted(exc) from exc
+        except TranscriptionError as exc:
+            print(f"[{trace_id}] ❌ TranscriptionError: {exc}")
+            traceback.print_exc()
+            _retain_audio(source_key, audio_path, raw_metadata, offset_map, trace_id)
+            raise PipelineError(f"Ошибка транскрибации: {exc}", status=500) from exc
+        except StageBusyError as exc:
+            print(f"[{trace_id}] ⚠️  {exc}")
+            _retain_audio(source_key, audio_path, raw_metadata, offset_map, trace_id)
+            raise PipelineError(f"Сервис перегружен, повторите позже: {exc}", status=503) from exc
+        except Exception as exc:
+            print(f"[{trace_id}] ❌ Unexpected error during transcription: {exc}")
+            traceback.print_exc()
+            _retain_audio(source_key, audio_path, raw_metadata, offset_map, trace_id)
+            raise PipelineError(f"Неожиданная ошибка при транскрибации: {exc}", status=500) from exc
+
+    return complete_analysis(state, transcription, progress)
+
+
+def complete_analysis(
+    state: AnalysisState, transcription: TranscriptionResult, progress: Optional[ProgressCallback] = None
+) -> dict:
+    """Этап 5: собирает AnalyzeResponse, кладёт его в кэш и отдаёт ожидающим запросам."""
+    trace_id = state.trace_id
+    normalized_metadata = state.normalized_metadata
+    try:
+        _report(progress, "response")
+        print(f"[{trace_id}] Этап 5: Формирование ответа...")
+        full_text = transcription.text or " ".join(seg.text.strip() for seg in transcription.segments)
+        timestamps = _build_timestamps(transcription.segments)
+
+        response_model = AnalyzeResponse(
+            platform=state.platform,
+            url=normalized_metadata.url or state.url,
+            title=normalized_metadata.title,
+            author=normalized_metadata.author,
+            description=normalized_metadata.description,
+            language=transcription.language,
+            duration=normalized_metadata.duration,
+            transcript=full_text.strip(),
+            timestamps=timestamps,
+            transcript_source=state.transcript_source,
+            trace_id=trace_id,
+        )
+
+        print(f"[{trace_id}] ✅ Ответ сформирован успешно")
+        response_payload = response_model.model_dump(mode="json", exclude_none=True)
+        _cache_put(state.cache_key, response_payload, trace_id)
+        _discard_checkpoints(state.source_key, trace_id)
+        if state.flight is not None:
+            state.flight.publish(response_payload)
+        state.outcome = "ok"
+        return response_payload
+    except Exception as exc:
+        print(f"[{trace_id}] ❌ Error forming response: {exc}")
+        traceback.print_exc()
+        raise PipelineError(f"Ошибка формирования ответа: {exc}", status=500) from exc
+
+
+def collect_stats() -> dict:
+    return {
+        "result_cache": result_cache.stats() if result_cache else None,
+        # Счётчики OpenAI - по текущему воркеру
+        "openai": get_retry_stats(),
+        # Пул YoutubeDL - по текущему воркеру
+        "ytdl_pool": get_ydl_pool_stats(),
+        "whisper_quota": _quota_stats(),
+        # Очереди этапов - по текущему воркеру
+        "stages": stage_scheduler.stats(),
+        "scratch": scratch_space.stats(),
+        "admission": admission_ledger.stats(),
+        "transcription": backend_router.stats(),
+    }
+
+
+def choose_backend(state: AnalysisState) -> TranscriptionBackend:
+    """Движок для аудио запроса: по длительности после VAD и приоритету."""
+    audio_seconds = None
+    if state.offset_map is not None and state.offset_map.spans:
+        audio_seconds = sum(speech.duration for speech in state.offset_map.spans)
+    elif state.raw_metadata is not None:
+        audio_seconds = state.raw_metadata.duration
+    return backend_router.choose(audio_seconds, state.priority)
+
+
+def warm_up() -> None:
+    """
+    Загружает тяжёлые модули и наполняет пул YoutubeDL до первого запроса.
+
+    При GUNICORN_PRELOAD=1 вызывается в мастере gunicorn до fork: воркеры
+    получают загруженные модули и свободные экземпляры YoutubeDL готовыми.
+    Без preload каждый воркер прогревается в фоне после старта.
+    """
+    if not STARTUP_WARMUP:
+        return
+    started = time.perf_counter()
+    try:
+        for module in ("openai", "httpx"):
+            importlib.import_module(module)
+        created = warm_ydl_pool(AUDIO_ONLY_DOWNLOAD)
+        if CAPTIONS_DEFAULT:
+            created += warm_pool([CAPTIONS_YDL_OPTS])
+    except Exception as exc:
+        print(f"⚠️  Прогрев не удался, модули загрузятся при первом запросе: {exc}")
+        return
+    print(f"✅ Прогрев завершён за {time.perf_counter() - started:.2f} с (PID {os.getpid()}, YoutubeDL создано: {created})")
+
+
+def _preflight(state: AnalysisState) -> None:
+    """Probe без скачивания и проверка лимитов длительности и размера."""
+    if not PREFLIGHT_PROBE_ENABLED:
+        return
+    trace_id = state.trace_id
+    try:
+        with track_stage("probe", state.platform):
+            state.probe_info = probe_video(state.url, state.platform, AUDIO_ONLY_DOWNLOAD)
+    except DownloadError as exc:
+        # Ошибку сообщит само скачивание (у него есть повторы); лимиты проверить нечем
+        print(f"[{trace_id}] ⚠️  Предварительный probe не удался ({exc}), продолжаем без него")
+        return
+
+    info = state.probe_info
+    duration, filesize = info.get("duration"), expected_filesize(info)
+    size_label = f"{filesize / 1024 / 1024:.1f} MB" if filesize is not None else "неизвестен"
+    duration_label = f"{duration:.0f} s" if duration is not None else "неизвестна"
+    print(f"[{trace_id}] ✅ Probe: длительность {duration_label}, ожидаемый размер {size_label}")
+    if info.get("is_live"):
+        raise PipelineError("Прямые трансляции не поддерживаются: дождитесь окончания эфира", status=422)
+    if MAX_VIDEO_DURATION_SECONDS > 0 and duration is not None and duration > MAX_VIDEO_DURATION_SECONDS:
+        raise PipelineError(
+            f"Видео слишком длинное: {duration / 60:.0f} мин (максимум {MAX_VIDEO_DURATION_SECONDS / 60:.0f} мин)",
+            status=413,
+        )
+    if MAX_VIDEO_FILESIZE_MB > 0 and filesize is not None and filesize > MAX_VIDEO_FILESIZE_MB * 1024 * 1024:
+        raise PipelineError(
+            f"Файл видео слишком большой: {filesize / 1024 / 1024:.0f} MB (максимум {MAX_VIDEO_FILESIZE_MB:.0f} MB)",
+            status=413,
+        )
+
+
+def _admit(state: AnalysisState) -> None:
+    """Учитывает минуты аудио запроса; без известной длительности учёт не ведётся."""
+    duration = state.probe_info.get("duration") if state.probe_info else None
+    if duration is None or state.admission is not None:
+        return
+    try:
+        state.admission = admission_ledger.admit(state.trace_id, float(duration))
+    except OverCapacityError as exc:
+        print(f"[{state.trace_id}] ⚠️  Запрос отклонён: {exc}")
+        raise PipelineError(
+            f"Сервис перегружен, повторите через {math.ceil(exc.retry_after)} с: {exc}",
+            status=429,
+            retry_after=exc.retry_after,
+        ) from exc
+    if state.admission.lane == LANE_LONG:
+        print(f"[{state.trace_id}] Длинное видео ({duration / 60:.1f} мин): полоса длинных задач")
+
+
+def _scratch_estimate(state: AnalysisState) -> int:
+    info = state.probe_info or {}
+    duration, filesize = info.get("duration"), expected_filesize(info) if info else None
+    if duration is not None and filesize is not None:
+        # Скачанный файл плюс аудио для Whisper и его копия после VAD
+        audio_bytes = duration * AUDIO_FORMAT.bitrate_kbps * 1000 / 8
+        return int(filesize + 2 * audio_bytes)
+    short_form = state.platform in (Platform.TIKTOK, Platform.INSTAGRAM)
+    estimate_mb = SCRATCH_SHORT_JOB_ESTIMATE_MB if short_form else SCRATCH_JOB_ESTIMATE_MB
+    return int(estimate_mb * 1024 * 1024)
+
+
+def _quota_exhausted(exc: QuotaWaitError) -> PipelineError:
+    # Аудио сохранено: повтор после Retry-After сразу уходит в Whisper
+    return PipelineError(
+        f"Квота Whisper занята, повторите через {math.ceil(exc.retry_after)} с: {exc}",
+        status=503,
+        retry_after=exc.retry_after,
+    )
+
+
+def _report(progress: Optional[ProgressCallback], stage: str, details: Optional[Dict[str, Any]] = None) -> None:
+    if progress is None:
+        return
+    try:
+        progress(stage, details)
+    except Exception as exc:
+        # Сбой отчёта о прогрессе не должен прерывать обработку
+        print(f"[WARN] Progress callback failed: {exc}")
+
+
+def _quota_stats() -> Optional[dict]:
+    if rate_governor is None:
+        return None
+    try:
+        return rate_governor.stats()
+    except sqlite3.Error as exc:
+        return {"error": str(exc)}
+
+
+def _restore_audio(source_key: Optional[str], work_dir: Path, trace_id: str) -> Optional[RetainedAudio]:
+    if audio_retention is None or source_key is None:
+        return None
+    try:
+        return audio_retention.restore(source_key, work_dir)
+    except Exception as exc:
+        print(f"[{trace_id}] ⚠️  Не удалось восстановить сохранённое аудио: {exc}")
+        return None
+
+
+def _retain_audio(
+    source_key: Optional[str],
+    audio_path: Optional[Path],
+    raw_metadata,
+    offset_map: Optional[OffsetMap],
+    trace_id: str,
+) -> None:
+    if audio_retention is None or source_key is None or audio_path is None or not audio_path.exists():
+        return
+    try:
+        retained_path = audio_retention.retain(source_key, audio_path, raw_metadata, offset_map)
+        print(f"[{trace_id}] 💾 Аудио сохранено для повтора на {AUDIO_RETENTION_SECONDS:.0f} s: {retained_path}")
+    except Exception as exc:
+        print(f"[{trace_id}] ⚠️  Не удалось сохранить аудио для повтора: {exc}")
+
+
+def _discard_checkpoints(source_key: Optional[str], trace_id: str) -> None:
+    if checkpoint_store is None or source_key is None:
+        return
+    try:
+        checkpoint_store.discard(source_key)
+    except sqlite3.Error as exc:
+        print(f"[{trace_id}] ⚠️  Не удалось удалить промежуточные результаты: {exc}")
+
+
+def _cache_get(cache_key: Optional[str], trace_id: str) -> Optional[dict]:
+    if result_cache is None or cache_key is None:
+        return None
+    try:
+        return result_cache.get(cache_key)
+    except sqlite3.Error as exc:
+        # Кэш - оптимизация, его сбой не должен ломать запрос
+        print(f"[{trace_id}] ⚠️  Ошибка чтения кэша: {exc}")
+        return None
+
+
+def _cache_put(cache_key: Optional[str], payload: dict, trace_id: str) -> None:
+    if result_cache is None or cache_key is None:
+        return
+    cached = {name: value for name, value in payload.items() if name != "trace_id"}
+    try:
+        result_cache.put(cache_key, cached)
+    except sqlite3.Error as exc:
+        print(f"[{trace_id}] ⚠️  Ошибка записи в кэш: {exc}")
+
+
+def _build_timestamps(segments: List[TranscriptionSegment]) -> List[TimestampEntry]:
+    entries: List[TimestampEntry] = []
+    for segment in segments:
+        text = segment.text.strip()
+        if not text:
+            continue
+        entries.append(
+            TimestampEntry(
+                time=format_timestamp(segment.start),
+                text=text,
+            )
+        )
+    return entries
@@ -1,6 +1,12 @@
 from __future__ import annotations
 
-from urllib.parse import urlparse
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+import requests
 
 from .models import Platform
 
@@ -15,6 +21,37 @@ _PLATFORM_HOSTS = {
     Platform.INSTAGRAM: {"instagram.com", "www.instagram.com"},
 }
 
+# Короткие ссылки, которые нужно раскрыть через редирект, чтобы узнать ID
+_SHORT_LINK_HOSTS = {"vm.tiktok.com", "vt.tiktok.com"}
+_SHORT_LINK_PATH = re.compile(r"^/t/[A-Za-z0-9]+/?$")
+_REDIRECT_TIMEOUT_SECONDS = 10
+_RESOLVED_LINKS_LIMIT = 1024
+_resolved_links: Dict[str, str] = {}
+_resolved_links_lock = threading.Lock()
+
+_YOUTUBE_ID = re.compile(r"^[A-Za-z0-9_-]{11}$")
+_YOUTUBE_PATH_ID = re.compile(r"^/(?:shorts|embed|live|v)/([A-Za-z0-9_-]{11})")
+_TIKTOK_PATH_ID = re.compile(r"/(?:video|v)/(\d+)")
+_INSTAGRAM_PATH_ID = re.compile(r"^/(?:[A-Za-z0-9_.]+/)?(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)")
+
+
+@dataclass(frozen=True)
+class VideoKey:
+    """Канонический ключ видео: одинаков для всех форм ссылки на один ролик."""
+
+    platform: Platform
+    video_id: str
+
+    def __str__(self) -> str:
+        return f"{self.platform.value}:{self.video_id}"
+
+
+@dataclass(frozen=True)
+class DetectedVideo:
+    platform: Platform
+    # None, если ID не удалось извлечь (ссылка нестандартного вида)
+    key: Optional[VideoKey]
+
 
 def detect_platform(url: str) -> Platform:
     """Определяет платформу по URL и валидирует схему/хост."""
@@ -33,3 +70,84 @@ def detect_platform(url: str) -> Platform:
 
     raise InvalidUrlError("Unsupported video host.")
 
+
+def detect_video(url: str, resolve_redirects: bool = True) -> DetectedVideo:
+    """
+    Определяет платформу и канонический ключ (platform, video_id).
+
+    Короткие ссылки (vm.tiktok.com и т.п.) раскрываются через редирект,
+    результат кэшируется в памяти процесса.
+    """
+    platform = detect_platform(url)
+    return DetectedVideo(platform=platform, key=canonical_video_key(url, platform, resolve_redirects))
+
+
+def canonical_video_key(url: str, platform: Platform, resolve_redirects: bool = True) -> Optional[VideoKey]:
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+
+    if resolve_redirects and (host in _SHORT_LINK_HOSTS or _SHORT_LINK_PATH.match(parsed.path)):
+        resolved = _resolve_short_link(url)
+        if resolved is None:
+            return None
+        parsed = urlparse(resolved)
+        host = parsed.netloc.lower()
+
+    video_id = _extract_video_id(platform, host, parsed.path, parsed.query)
+    if video_id is None:
+        return None
+    return VideoKey(platform=platform, video_id=video_id)
+
+
+def _extract_video_id(platform: Platform, host: str, path: str, query: str) -> Optional[str]:
+    if platform is Platform.YOUTUBE:
+        if host == "youtu.be":
+            candidate = path.strip("/").split("/")[0]
+            return candidate if _YOUTUBE_ID.match(candidate) else None
+        if path.rstrip("/") == "/watch":
+            candidate = (parse_qs(query).get("v") or [""])[0]
+            return candidate if _YOUTUBE_ID.match(candidate) else None
+        match = _YOUTUBE_PATH_ID.match(path)
+        return match.group(1) if match else None
+
+    if platform is Platform.TIKTOK:
+        match = _TIKTOK_PATH_ID.search(path)
+        return match.group(1) if match else None
+
+    if platform is Platform.INSTAGRAM:
+        match = _INSTAGRAM_PATH_ID.match(path)
+        return match.group(1) if match else None
+
+    return None
+
+
+def _resolve_short_link(url: str) -> Optional[str]:
+    """Возвращает конечный URL после редиректов или None при ошибке."""
+    with _resolved_links_lock:
+        cached = _resolved_links.get(url)
+    if cached is not None:
+        return cached
+
+    resolved = _follow_redirects(url)
+    if resolved is not None:
+        # Ошибки не кэшируем: следующая попытка может оказаться успешной
+        with _resolved_links_lock:
+            if len(_resolved_links) >= _RESOLVED_LINKS_LIMIT:
+                _resolved_links.pop(next(iter(_resolved_links)))
+            _resolved_links[url] = resolved
+    return resolved
+
+
+def _follow_redirects(url: str) -> Optional[str]:
+    try:
+        # HEAD на TikTok иногда отвечает 405, поэтому GET без чтения тела
+        with requests.get(
+            url,
+            allow_redirects=True,
+            stream=True,
+            timeout=_REDIRECT_TIMEOUT_SECONDS,
+            headers={"User-Agent": "Mozilla/5.0"},
+        ) as response:
+            return response.url
+    except requests.RequestException:
+        return None
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import copy
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .utils import open_sqlite
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+_REQUESTS_BUCKET = "requests"
+_AUDIO_BUCKET = "audio_seconds"
+_COUNTER_NAMES = ("acquired", "throttled", "wait_seconds")
+
+
+class RateGovernorTimeout(RuntimeError):
+    """Ожидание квоты превысило допустимое время; квота освободится через wait секунд."""
+
+    def __init__(self, message: str, wait: float) -> None:
+        super().__init__(message)
+        self.wait = wait
+
+
+class RateGovernor:
+    """
+    Общий для всех воркеров ограничитель запросов к Whisper (token bucket).
+
+    Два ведра в SQLite: запросы в минуту и секунды аудио в минуту. Вызов
+    acquire() сразу резервирует токены, даже если ведро уходит в минус, и
+    спит, пока долг не погасится пополнением. Так вызовы выстраиваются в
+    очередь по времени прихода, а не набегают на 429 одновременно.
+    Лимит 0 отключает соответствующее ведро.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        requests_per_minute: float,
+        audio_seconds_per_minute: float,
+        max_wait_seconds: float = 120.0,
+    ) -> None:
+        self.path = path
+        self.max_wait_seconds = max_wait_seconds
+        # Момент time.monotonic(), дольше которого ждать квоту нельзя (см. until)
+        self.deadline: Optional[float] = None
+        self._limits: Dict[str, float] = {
+            _REQUESTS_BUCKET: requests_per_minute,
+            _AUDIO_BUCKET: audio_seconds_per_minute,
+        }
+        with closing(open_sqlite(self.path)) as connection:
+            connection.executescript(_SCHEMA)
+
+    def until(self, deadline: Optional[float]) -> "RateGovernor":
+        """
+        Тот же ограничитель с общими ведрами, но ожидание не выходит за deadline.
+
+        Запрос синхронного воркера уже потратил часть времени на скачивание
+        и извлечение аудио; ждать квоту дольше остатка бессмысленно - gunicorn
+        убьёт воркер раньше, чем запрос получит ответ.
+        """
+        if deadline is None:
+            return self
+        bounded = copy.copy(self)
+        bounded.deadline = deadline
+        return bounded
+
+    def acquire(self, audio_seconds: float = 0.0) -> float:
+        """Занимает квоту на один запрос с audio_seconds аудио; возвращает время ожидания."""
+        costs = self._costs(audio_seconds)
+        if not costs:
+            return 0.0
+
+        now = time.time()
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            balances = {name: self._refill(connection, name, now) for name, _ in costs}
+            wait = 0.0
+            for name, cost in costs:
+                rate = self._limits[name] / 60.0
+                remaining = balances[name] - cost
+                if remaining < 0:
+                    wait = max(wait, -remaining / rate)
+
+            max_wait = self.max_wait_seconds
+            if self.deadline is not None:
+                max_wait = max(0.0, min(max_wait, self.deadline - time.monotonic()))
+            if wait > max_wait:
+                connection.execute("COMMIT")
+                raise RateGovernorTimeout(
+                    f"Whisper quota wait of {wait:.0f}s exceeds limit of {max_wait:.0f}s", wait
+                )
+
+            for name, cost in costs:
+                connection.execute(
+                    "UPDATE buckets SET tokens = ?, updated_at = ? WHERE name = ?",
+                    (balances[name] - cost, now, name),
+                )
+            _increment(connection, "acquired")
+            if wait > 0:
+                _increment(connection, "throttled")
+                _increment(connection, "wait_seconds", wait)
+            connection.execute("COMMIT")
+
+        if wait > 0:
+            print(f"[INFO] Whisper rate limit: waiting {wait:.1f}s for quota")
+            time.sleep(wait)
+        return wait
+
+    def stats(self) -> Dict[str, float]:
+        with closing(open_sqlite(self.path)) as connection:
+            counters = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+            buckets = dict(connection.execute("SELECT name, tokens FROM buckets").fetchall())
+        result: Dict[str, float] = {name: counters.get(name, 0) for name in _COUNTER_NAMES}
+        result["acquired"] = int(result["acquired"])
+        result["throttled"] = int(result["throttled"])
+        result["wait_seconds"] = round(result["wait_seconds"], 1)
+        for name, limit in self._limits.items():
+            if limit > 0:
+                result[f"{name}_per_minute"] = limit
+                result[f"{name}_available"] = round(buckets.get(name, limit), 1)
+        return result
+
+    def _costs(self, audio_seconds: float) -> List[Tuple[str, float]]:
+        costs: List[Tuple[str, float]] = []
+        for name, cost in ((_REQUESTS_BUCKET, 1.0), (_AUDIO_BUCKET, max(0.0, audio_seconds))):
+            limit = self._limits[name]
+            if limit > 0:
+                # Запрос больше ёмкости ведра иначе ждал бы вечно
+                costs.append((name, min(cost, limit)))
+        return costs
+
+    def _refill(self, connection, name: str, now: float) -> float:
+        capacity = self._limits[name]
+        row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            connection.execute(
+                "INSERT INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)", (name, capacity, now)
+            )
+            return capacity
+        tokens, updated_at = row
+        elapsed = max(0.0, now - updated_at)
+        return min(capacity, tokens + elapsed * capacity / 60.0)
+
+
+def _increment(connection, name: str, amount: float = 1) -> None:
+    connection.execute(
+        "INSERT INTO counters (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        (name, amount),
+    )
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import json
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Optional
+
+from .utils import open_sqlite
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_COUNTER_NAMES = ("hits", "misses", "stores", "evictions")
+
+
+class ResultCache:
+    """
+    Дисковый кэш готовых ответов /analyze по каноническому ключу видео.
+
+    Хранится в SQLite, поэтому один файл безопасно делят все воркеры
+    gunicorn. Записи живут ttl_seconds; если суммарный размер превышает
+    max_bytes, удаляются давно не читавшиеся (LRU).
+    """
+
+    def __init__(self, path: Path, ttl_seconds: float, max_bytes: int) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        with closing(open_sqlite(self.path)) as connection:
+            connection.executescript(_SCHEMA)
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT payload, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                _increment(connection, "misses")
+                connection.execute("COMMIT")
+                return None
+
+            connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            _increment(connection, "hits")
+            connection.execute("COMMIT")
+        return json.loads(row[0])
+
+    def put(self, key: str, payload: dict) -> None:
+        data = json.dumps(payload, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with closing(open_sqlite(self.path)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT OR REPLACE INTO results (key, payload, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now, now),
+            )
+            _increment(connection, "stores")
+            self._evict(connection, now)
+            connection.execute("COMMIT")
+
+    def stats(self) -> Dict[str, int]:
+        with closing(open_sqlite(self.path)) as connection:
+            counters = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+            entries, total_bytes = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        result = {name: int(counters.get(name, 0)) for name in _COUNTER_NAMES}
+        result["entries"] = int(entries)
+        result["bytes"] = int(total_bytes)
+        return result
+
+    def _evict(self, connection, now: float) -> None:
+        expired = connection.execute(
+            "DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        evicted = max(expired, 0)
+
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total > self.max_bytes:
+            rows = connection.execute("SELECT key, size FROM results ORDER BY accessed_at ASC").fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+
+        if evicted:
+            _increment(connection, "evictions", evicted)
+
+
+def _increment(connection, name: str, amount: int = 1) -> None:
+    connection.execute(
+        "INSERT INTO counters (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        (name, amount),
+    )
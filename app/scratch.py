@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import fcntl
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .utils import cleanup_paths
+
+# Файл-аренда внутри каталога запроса: пока он заблокирован, владелец жив
+_LEASE_FILE = ".scratch.lock"
+# Общая блокировка учёта бюджета для всех воркеров
+_BUDGET_LOCK_FILE = ".budget.lock"
+_POLL_INTERVAL_SECONDS = 1.0
+
+
+class ScratchBudgetError(RuntimeError):
+    """Места во временной директории не хватило дольше допустимого ожидания."""
+
+
+@dataclass
+class ScratchArea:
+    """Корень для рабочих каталогов запросов и его лимиты."""
+
+    name: str
+    root: Path
+    max_bytes: int
+    # Больший ожидаемый объём в эту область не направляется (0 - без ограничения)
+    max_job_bytes: int = 0
+
+
+class ScratchDir:
+    """
+    Рабочий каталог одного запроса.
+
+    Пока каталог используется, на файл-аренду внутри него держится flock.
+    Ядро снимает блокировку и при убийстве процесса (таймаут gunicorn),
+    поэтому каталог без блокировки - сирота, его можно удалить.
+    """
+
+    def __init__(self, path: Path, area: str, reserved_bytes: int, lease_fd: int) -> None:
+        self.path = path
+        self.area = area
+        self.reserved_bytes = reserved_bytes
+        self._lease_fd: Optional[int] = lease_fd
+
+    def release(self) -> None:
+        cleanup_paths([self.path])
+        if self._lease_fd is not None:
+            os.close(self._lease_fd)
+            self._lease_fd = None
+
+
+class ScratchSpace:
+    """
+    Временные каталоги запросов с общим бюджетом и уборкой сирот.
+
+    Небольшие задачи получают каталог в RAM (tmpfs), если такая область
+    настроена и в ней есть место, остальные - на диске. Перед стартом
+    задачи её ожидаемый объём резервируется: занятое место области - это
+    сумма max(резерв, фактический размер) живых каталогов и размер сирот.
+    Если на диске места нет, acquire() ждёт до wait_seconds и поднимает
+    ScratchBudgetError.
+
+    Фоновый janitor каждого процесса удаляет сироты старше orphan_age_seconds,
+    а при превышении бюджета - и более свежие, начиная со старых. Учёт и
+    уборка идут под общей flock-блокировкой, поэтому воркеры не мешают
+    друг другу.
+    """
+
+    def __init__(
+        self,
+        disk: ScratchArea,
+        ram: Optional[ScratchArea] = None,
+        wait_seconds: float = 120.0,
+        orphan_age_seconds: float = 300.0,
+        janitor_interval_seconds: float = 60.0,
+    ) -> None:
+        self.disk = disk
+        self.ram = ram
+        self.wait_seconds = wait_seconds
+        self.orphan_age_seconds = orphan_age_seconds
+        self.janitor_interval_seconds = janitor_interval_seconds
+        self.disk.root.mkdir(parents=True, exist_ok=True)
+        if self.ram is not None:
+            try:
+                self.ram.root.mkdir(parents=True, exist_ok=True)
+            except OSError as exc:
+                print(f"[WARN] RAM scratch directory {self.ram.root} is unavailable, using disk only: {exc}")
+                self.ram = None
+        self._lock = threading.Lock()
+        self._janitor_pid: Optional[int] = None
+        self._counters: Dict[str, float] = {
+            "acquired_ram": 0,
+            "acquired_disk": 0,
+            "waited": 0,
+            "rejected": 0,
+            "reclaimed_dirs": 0,
+            "reclaimed_bytes": 0,
+        }
+
+    def acquire(self, trace_id: str, estimated_bytes: int) -> ScratchDir:
+        """Создаёт каталог запроса, зарезервировав estimated_bytes."""
+        self._ensure_janitor()
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+        while True:
+            with self._budget_lock():
+                scratch = self._try_acquire(trace_id, estimated_bytes)
+            if scratch is not None:
+                with self._lock:
+                    self._counters[f"acquired_{scratch.area}"] += 1
+                    if waited:
+                        self._counters["waited"] += 1
+                return scratch
+            if time.monotonic() >= deadline:
+                with self._lock:
+                    self._counters["rejected"] += 1
+                raise ScratchBudgetError(
+                    f"Scratch budget of {self.disk.max_bytes / 1024 / 1024:.0f} MB is exhausted "
+                    f"for more than {self.wait_seconds:.0f}s"
+                )
+            waited = True
+            time.sleep(_POLL_INTERVAL_SECONDS)
+
+    def reclaim(self) -> Tuple[int, int]:
+        """Удаляет сироты по возрасту и по превышению бюджета; возвращает (каталогов, байт)."""
+        removed_dirs = removed_bytes = 0
+        with self._budget_lock():
+            for area in self._areas():
+                dirs, size = self._reclaim_area(area, 0)
+                removed_dirs += dirs
+                removed_bytes += size
+        return removed_dirs, removed_bytes
+
+    def stats(self) -> dict:
+        areas = {}
+        with self._budget_lock():
+            for area in self._areas():
+                entries = _scan(area.root)
+                areas[area.name] = {
+                    "root": str(area.root),
+                    "max_mb": round(area.max_bytes / 1024 / 1024, 1),
+                    "used_mb": round(_usage(entries) / 1024 / 1024, 1),
+                    "jobs": sum(1 for entry in entries if entry.live),
+                    "orphans": sum(1 for entry in entries if not entry.live),
+                }
+        with self._lock:
+            counters = dict(self._counters)
+        counters["reclaimed_mb"] = round(counters.pop("reclaimed_bytes") / 1024 / 1024, 1)
+        return {"areas": areas, **counters}
+
+    def _try_acquire(self, trace_id: str, estimated_bytes: int) -> Optional[ScratchDir]:
+        for area in self._areas(estimated_bytes):
+            used = _usage(_scan(area.root))
+            if area.max_bytes and used + estimated_bytes > area.max_bytes:
+                # Сначала пробуем освободить место за счёт сирот
+                self._reclaim_area(area, estimated_bytes)
+                used = _usage(_scan(area.root))
+            if not area.max_bytes or used + estimated_bytes <= area.max_bytes:
+                return _create(area, trace_id, estimated_bytes)
+        return None
+
+    def _areas(self, estimated_bytes: Optional[int] = None) -> List[ScratchArea]:
+        areas = []
+        if self.ram is not None and (
+            estimated_bytes is None or not self.ram.max_job_bytes or estimated_bytes <= self.ram.max_job_bytes
+        ):
+            areas.append(self.ram)
+        areas.append(self.disk)
+        return areas
+
+    def _reclaim_area(self, area: ScratchArea, needed_bytes: int) -> Tuple[int, int]:
+        entries = _scan(area.root)
+        used = _usage(entries)
+        now = time.time()
+        removed_dirs = removed_bytes = 0
+        for entry in sorted((entry for entry in entries if not entry.live), key=lambda entry: entry.mtime):
+            over_budget = bool(area.max_bytes) and used + needed_bytes > area.max_bytes
+            if now - entry.mtime < self.orphan_age_seconds and not over_budget:
+                continue
+            cleanup_paths([entry.path])
+            used -= entry.size
+            removed_dirs += 1
+            removed_bytes += entry.size
+            print(f"[INFO] Removed orphaned scratch directory {entry.path} ({entry.size / 1024 / 1024:.1f} MB)")
+        if removed_dirs:
+            with self._lock:
+                self._counters["reclaimed_dirs"] += removed_dirs
+                self._counters["reclaimed_bytes"] += removed_bytes
+        return removed_dirs, removed_bytes
+
+    def _budget_lock(self) -> "_FileLock":
+        return _FileLock(self.disk.root / _BUDGET_LOCK_FILE)
+
+    def _ensure_janitor(self) -> None:
+        # Потоки не переживают fork: каждый воркер запускает свой janitor
+        with self._lock:
+            if self._janitor_pid == os.getpid() or self.janitor_interval_seconds <= 0:
+                return
+            self._janitor_pid = os.getpid()
+        threading.Thread(target=self._janitor_loop, name="scratch-janitor", daemon=True).start()
+
+    def _janitor_loop(self) -> None:
+        while True:
+            try:
+                self.reclaim()
+            except Exception as exc:
+                print(f"[WARN] Scratch janitor failed: {exc}")
+            time.sleep(self.janitor_interval_seconds)
+
+
+@dataclass
+class _Entry:
+    path: Path
+    live: bool
+    reserved: int
+    size: int
+    mtime: float
+
+
+class _FileLock:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = None
+
+    def __enter__(self) -> "_FileLock":
+        self._file = self.path.open("a+")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+
+
+def _create(area: ScratchArea, trace_id: str, reserved_bytes: int) -> ScratchDir:
+    path = area.root / trace_id
+    path.mkdir(parents=True, exist_ok=True)
+    lease_fd = os.open(path / _LEASE_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+    fcntl.flock(lease_fd, fcntl.LOCK_EX)
+    os.write(lease_fd, str(reserved_bytes).encode("ascii"))
+    return ScratchDir(path, area.name, reserved_bytes, lease_fd)
+
+
+def _scan(root: Path) -> List[_Entry]:
+    entries = []
+    try:
+        children = list(root.iterdir())
+    except OSError:
+        return entries
+    for path in children:
+        if path.name.startswith(".") or not path.is_dir():
+            continue
+        live, reserved = _lease_state(path / _LEASE_FILE)
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            continue
+        entries.append(_Entry(path, live, reserved, _directory_size(path), mtime))
+    return entries
+
+
+def _usage(entries: List[_Entry]) -> int:
+    return sum(max(entry.reserved, entry.size) if entry.live else entry.size for entry in entries)
+
+
+def _lease_state(lease_path: Path) -> Tuple[bool, int]:
+    """(живой ли владелец, резерв в байтах); каталоги без аренды считаются сиротами."""
+    try:
+        fd = os.open(lease_path, os.O_RDONLY)
+    except OSError:
+        return False, 0
+    try:
+        try:
+            # flock конфликтует и с другим дескриптором того же процесса
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            try:
+                reserved = int(os.read(fd, 32) or b"0")
+            except ValueError:
+                reserved = 0
+            return True, reserved
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return False, 0
+    finally:
+        os.close(fd)
+
+
+def _directory_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                total += os.lstat(os.path.join(root, file_name)).st_size
+            except OSError:
+                continue
+    return total
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+# Интервал опроса блокировки ведомыми запросами
+_POLL_INTERVAL_SECONDS = 0.5
+
+
+class FlightWaitTimeout(RuntimeError):
+    """Ведущий не закончил за wait_timeout; запрос лучше повторить позже."""
+
+
+class Flight:
+    """
+    Участие запроса в обработке одного видео.
+
+    Ведущий (leader) выполняет конвейер и публикует результат через publish().
+    У ведомого result уже заполнен результатом ведущего.
+    """
+
+    def __init__(self, owner: "SingleFlight", key: str, lock_file=None, result: Optional[dict] = None) -> None:
+        self._owner = owner
+        self._key = key
+        self._lock_file = lock_file
+        self.result = result
+
+    @property
+    def is_leader(self) -> bool:
+        return self.result is None
+
+    def publish(self, payload: dict) -> None:
+        """Сохраняет результат ведущего для ожидающих запросов."""
+        if self.is_leader:
+            self._owner._write_handoff(self._key, payload)
+
+    def release(self) -> None:
+        if self._lock_file is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            finally:
+                self._lock_file.close()
+                self._lock_file = None
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные запросы одного видео между воркерами gunicorn.
+
+    Первый запрос берёт эксклюзивную flock-блокировку на файл ключа и
+    выполняет работу. Остальные ждут освобождения блокировки и забирают
+    опубликованный результат. Если ведущий упал, не опубликовав результат,
+    следующий ожидающий сам становится ведущим. Блокировку flock ядро снимает
+    и при убийстве процесса, поэтому зависших ключей не остаётся.
+
+    Ожидание ограничено wait_timeout, который должен быть меньше timeout
+    воркера gunicorn: если ведущий не успел, ведомый получает
+    FlightWaitTimeout, а не начинает ту же работу заново.
+    """
+
+    def __init__(self, lock_dir: Path, wait_timeout: float, handoff_ttl: float) -> None:
+        self.lock_dir = lock_dir
+        self.wait_timeout = wait_timeout
+        self.handoff_ttl = handoff_ttl
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+
+    def begin(self, key: str) -> Flight:
+        self._remove_stale_handoffs()
+        lock_file = (self.lock_dir / f"{_digest(key)}.lock").open("a+")
+
+        if _try_lock(lock_file):
+            return Flight(self, key, lock_file=lock_file)
+
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(_POLL_INTERVAL_SECONDS)
+            if not _try_lock(lock_file):
+                continue
+
+            result = self._read_handoff(key)
+            if result is None:
+                # Ведущий завершился без результата - выполняем работу сами
+                return Flight(self, key, lock_file=lock_file)
+
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+            return Flight(self, key, result=result)
+
+        # Ведущий явно медленный: повторять его работу бессмысленно, а
+        # ожидание дальше упрётся в timeout воркера
+        lock_file.close()
+        raise FlightWaitTimeout(f"Видео уже обрабатывается дольше {self.wait_timeout:.0f} с")
+
+    def _handoff_path(self, key: str) -> Path:
+        return self.lock_dir / f"{_digest(key)}.result.json"
+
+    def _write_handoff(self, key: str, payload: dict) -> None:
+        path = self._handoff_path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def _read_handoff(self, key: str) -> Optional[dict]:
+        path = self._handoff_path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.handoff_ttl:
+                return None
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _remove_stale_handoffs(self) -> None:
+        threshold = time.time() - self.handoff_ttl
+        for path in self.lock_dir.glob("*.result.json"):
+            try:
+                if path.stat().st_mtime < threshold:
+                    path.unlink()
+            except OSError:
+                continue
+
+
+def _try_lock(lock_file) -> bool:
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _digest(key: str) -> str:
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class StageBusyError(RuntimeError):
+    """Очередь этапа заполнена дольше допустимого времени ожидания."""
+
+
+class Stage:
+    """
+    Этап конвейера с ограничением параллельности и ограниченной очередью.
+
+    Одновременно выполняется не больше workers задач, ещё queue_size ждут
+    своей очереди. Задача выполняется в потоке вызывающего: отдельный пул
+    ничего не добавил бы, вызывающий всё равно ждёт результата. Когда
+    очередь заполнена, run() блокирует вызывающего (обратное давление):
+    запрос, уже скачавший видео, ждёт места у ffmpeg, и новые скачивания не
+    начинаются сверх очереди. Если места нет дольше max_wait_seconds -
+    StageBusyError.
+
+    Ограничения действуют между потоками одного процесса: фоновыми задачами
+    /jobs, пакетами, стримингом и запросами воркеров gthread
+    (GUNICORN_THREADS > 1). Sync-воркер обрабатывает один запрос за раз, и
+    его запросы друг с другом в очередях не встречаются.
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int, max_wait_seconds: float = 600.0) -> None:
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.max_wait_seconds = max_wait_seconds
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._workers = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self._blocked = 0
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._wait_seconds = 0.0
+
+    def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Выполняет func, когда у этапа есть место, и возвращает результат (исключения пробрасываются)."""
+        started = time.monotonic()
+        with self._lock:
+            self._blocked += 1
+        acquired = self._slots.acquire(timeout=self.max_wait_seconds)
+        with self._lock:
+            self._blocked -= 1
+            if not acquired:
+                self._rejected += 1
+        if not acquired:
+            raise StageBusyError(
+                f"Stage '{self.name}' queue is full ({self.workers} running, {self.queue_size} queued) "
+                f"for more than {self.max_wait_seconds:.0f}s"
+            )
+
+        try:
+            with self._lock:
+                self._queued += 1
+            # Место в очереди уже занято: ждём свободного исполнителя без ограничения
+            self._workers.acquire()
+            try:
+                return self._execute(started, func, args, kwargs)
+            finally:
+                self._workers.release()
+        finally:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "running": self._running,
+                "queued": self._queued,
+                "blocked": self._blocked,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "wait_seconds": round(self._wait_seconds, 1),
+            }
+
+    def _execute(self, started: float, func: Callable[..., T], args: tuple, kwargs: dict) -> T:
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._wait_seconds += time.monotonic() - started
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+        with self._lock:
+            self._completed += 1
+        return result
+
+
+class StageScheduler:
+    """Набор этапов конвейера текущего процесса: скачивание, ffmpeg, Whisper."""
+
+    def __init__(self) -> None:
+        self._stages: Dict[str, Stage] = {}
+
+    def add_stage(self, name: str, workers: int, queue_size: int, max_wait_seconds: float = 600.0) -> Stage:
+        stage = Stage(name, workers, queue_size, max_wait_seconds)
+        self._stages[name] = stage
+        return stage
+
+    def run(self, name: str, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        stage = self._stages.get(name)
+        if stage is None:
+            return func(*args, **kwargs)
+        return stage.run(func, *args, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stage.stats() for name, stage in self._stages.items()}
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import json
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Optional, Tuple
+
+from .audio_extractor import DEFAULT_AUDIO_FORMAT, AudioFormat, extract_audio_from_pipe
+from .downloader import DownloadError, VideoMetadata, metadata_from_info, open_download_stream, probe_video
+from .models import Platform
+
+
+def stream_audio(
+    url: str,
+    temp_dir: Path,
+    trace_id: str,
+    platform: Optional[Platform] = None,
+    audio_only: bool = True,
+    audio_format: AudioFormat = DEFAULT_AUDIO_FORMAT,
+    probe_info: Optional[dict] = None,
+) -> Tuple[Path, VideoMetadata]:
+    """
+    Скачивает поток и извлекает из него аудио без промежуточного файла видео.
+
+    Сначала yt-dlp выбирает формат (probe_video), затем отдельный процесс yt-dlp
+    пишет поток в stdout, а ffmpeg читает его из stdin. Аудио появляется на
+    диске, пока загрузка ещё идёт. Готовый probe_info заменяет probe_video.
+
+    Ошибки загрузки поднимаются как DownloadError, ошибки ffmpeg - как
+    AudioExtractionError.
+    """
+    temp_dir.mkdir(parents=True, exist_ok=True)
+
+    info = probe_info if probe_info is not None else probe_video(url, platform, audio_only)
+    format_spec = info.get("format_id")
+    if not format_spec:
+        raise DownloadError("yt-dlp did not select a format for streaming")
+    if "+" in format_spec:
+        # Склейку отдельных потоков видео и аудио нельзя отдать в stdout
+        raise DownloadError(f"Format {format_spec} requires merging and cannot be streamed")
+
+    info_path = temp_dir / f"{trace_id}.info.json"
+    info_path.write_text(json.dumps(info), encoding="utf-8")
+
+    metadata = metadata_from_info(info, url)
+
+    try:
+        with tempfile.TemporaryFile() as stderr_file:
+            process = open_download_stream(info_path, format_spec, stderr_file)
+            try:
+                audio_path, bytes_read = extract_audio_from_pipe(
+                    process.stdout,
+                    temp_dir,
+                    trace_id,
+                    acodec=metadata.acodec,
+                    audio_format=audio_format,
+                    source_bitrate_kbps=metadata.audio_bitrate_kbps,
+                )
+            except Exception:
+                process.kill()
+                raise
+            finally:
+                process.stdout.close()
+
+            return_code = process.wait()
+            if return_code != 0:
+                stderr_file.seek(0)
+                details = stderr_file.read().decode("utf-8", errors="replace").strip()
+                raise DownloadError(f"yt-dlp exited with code {return_code}: {details}")
+    except subprocess.SubprocessError as exc:
+        raise DownloadError(f"Streaming download failed: {exc}") from exc
+    finally:
+        info_path.unlink(missing_ok=True)
+
+    if bytes_read == 0:
+        raise DownloadError("yt-dlp produced an empty stream")
+
+    metadata.downloaded_bytes = bytes_read
+    return audio_path, metadata
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    start_ns: int
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Span в JSON-кодировке OTLP (формат resourceSpans[].scopeSpans[].spans[])."""
+        record: Dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            record["parentSpanId"] = self.parent_id
+        return record
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+_export_path: Optional[Path] = None
+_export_lock = threading.Lock()
+
+# Какой трассе принадлежит поток сейчас; нужно профилировщику запроса
+_thread_traces: Dict[int, str] = {}
+_thread_traces_lock = threading.Lock()
+
+
+def configure(export_path: Optional[Path]) -> None:
+    """Включает экспорт span в JSONL-файл (строка - один запрос OTLP/JSON); None - выключает."""
+    global _export_path
+    if export_path is not None:
+        export_path.parent.mkdir(parents=True, exist_ok=True)
+    _export_path = export_path
+
+
+@contextmanager
+def trace(trace_id: str, name: str, **attributes: Any) -> Iterator[Span]:
+    """Корневой span запроса: вложенные span получают тот же trace_id."""
+    root = Span(trace_id=trace_id, span_id=_new_span_id(), parent_id=None, name=name, start_ns=time.time_ns())
+    root.attributes.update(attributes)
+    with _activate(root), _registered_thread(trace_id):
+        yield root
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Дочерний span текущего; вне trace() ничего не записывает."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(
+        trace_id=parent.trace_id, span_id=_new_span_id(), parent_id=parent.span_id, name=name, start_ns=time.time_ns()
+    )
+    child.attributes.update(attributes)
+    with _activate(child):
+        yield child
+
+
+def current_trace_id() -> Optional[str]:
+    current = _current_span.get()
+    return current.trace_id if current is not None else None
+
+
+def bind_context(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Переносит текущий span в поток пула.
+
+    ThreadPoolExecutor не копирует contextvars, поэтому функция, отправляемая
+    в пул, оборачивается на стороне вызывающего.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args: Any, **kwargs: Any) -> T:
+        return context.run(_run_registered, func, args, kwargs)
+
+    return run
+
+
+def threads_for(trace_id: str) -> List[int]:
+    """Идентификаторы потоков, которые сейчас работают на трассу trace_id."""
+    with _thread_traces_lock:
+        return [ident for ident, owner in _thread_traces.items() if owner == trace_id]
+
+
+@contextmanager
+def _activate(current: Span) -> Iterator[Span]:
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        _export(current)
+
+
+def _run_registered(func: Callable[..., T], args: tuple, kwargs: dict) -> T:
+    trace_id = current_trace_id()
+    if trace_id is None:
+        return func(*args, **kwargs)
+    with _registered_thread(trace_id):
+        return func(*args, **kwargs)
+
+
+@contextmanager
+def _registered_thread(trace_id: str) -> Iterator[None]:
+    ident = threading.get_ident()
+    with _thread_traces_lock:
+        previous = _thread_traces.get(ident)
+        _thread_traces[ident] = trace_id
+    try:
+        yield
+    finally:
+        with _thread_traces_lock:
+            if previous is None:
+                _thread_traces.pop(ident, None)
+            else:
+                _thread_traces[ident] = previous
+
+
+def _export(finished: Span) -> None:
+    if _export_path is None:
+        return
+    line = json.dumps(
+        {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {"key": "service.name", "value": {"stringValue": "video-api"}},
+                            {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+                        ]
+                    },
+                    "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": [finished.to_otlp()]}],
+                }
+            ]
+        },
+        ensure_ascii=False,
+    )
+    try:
+        # O_APPEND: строки разных воркеров не перемешиваются
+        with _export_lock, open(_export_path, "a", encoding="utf-8") as export_file:
+            export_file.write(line + "\n")
+    except OSError as exc:
+        print(f"[WARN] Span export failed: {exc}")
+
+
+def _new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
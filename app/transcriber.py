@@ -1,13 +1,26 @@
 from __future__ import annotations
 
-import subprocess
+import asyncio
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple
 
-from openai import OpenAI
+from .audio_splitter import AudioChunk, AudioSplitError, split_audio_into_chunks
+from .audio_extractor import AudioExtractionError, probe_duration
+from .metrics import CHUNKS, TRANSCRIBED_AUDIO_SECONDS, WHISPER_CHUNK_SECONDS, platform_label, track_stage
+from .rate_governor import RateGovernor
+from .tracing import bind_context, span
+from .wav_slicer import WavFormatError, slice_wav
 
-from .audio_splitter import AudioSplitError, split_audio_by_size
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+    from .checkpoints import CheckpointStore
+    from .transcription_backends import TranscriptionBackend
 
 
 @dataclass
@@ -28,109 +41,378 @@ class TranscriptionError(RuntimeError):
     """Ошибка при обращении к Whisper API."""
 
 
+class QuotaWaitError(TranscriptionError):
+    """Квота Whisper не освободится за допустимое время; повторить через retry_after секунд."""
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 # Whisper API лимит: 25 МБ, используем 24 МБ для запаса
 WHISPER_MAX_FILE_SIZE_MB = 24.0
 
-
-def transcribe_audio(audio_path: Path, model: str, client: Optional[OpenAI] = None) -> TranscriptionResult:
+# Сколько частей одного аудио отправлять в Whisper одновременно
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+def transcribe_audio(
+    audio_path: Path,
+    model: str,
+    client: Optional[OpenAI] = None,
+    equal_chunks: bool = False,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    rate_governor: Optional[RateGovernor] = None,
+    checkpoint: Optional["CheckpointStore"] = None,
+    source_key: Optional[str] = None,
+    on_chunk_done: Optional[Callable[[int, int], None]] = None,
+    on_segments: Optional[Callable[[int, List[TranscriptionSegment]], None]] = None,
+    platform: Optional[str] = None,
+    backend: Optional["TranscriptionBackend"] = None,
+) -> TranscriptionResult:
+    """
+    Транскрибирует аудио, при необходимости разбивая его на части.
+
+    Если переданы checkpoint и source_key, результат каждой части
+    сохраняется сразу после получения, а уже сохранённые части повторно
+    в Whisper не отправляются. on_chunk_done(готово, всего) вызывается
+    после каждой завершённой части, on_segments(номер, сегменты) - строго
+    по порядку частей, с таймкодами уже в шкале исходного аудио.
+    platform - метка платформы для метрик. backend - движок транскрибации
+    (по умолчанию Whisper API с моделью model и клиентом client).
+    """
     if not audio_path.exists():
         raise TranscriptionError(f"Audio file not found: {audio_path}")
 
-    client = client or OpenAI()
+    backend = backend or _default_backend(model, client=client)
 
-    # Проверяем размер файла и разделяем при необходимости
-    file_size_mb = audio_path.stat().st_size / (1024 * 1024)
     chunks_dir = audio_path.parent / f"{audio_path.stem}_chunks"
 
     try:
-        if file_size_mb > WHISPER_MAX_FILE_SIZE_MB:
-            print(f"[INFO] Audio file too large ({file_size_mb:.2f} MB), splitting into chunks...")
-            audio_chunks = split_audio_by_size(audio_path, chunks_dir, WHISPER_MAX_FILE_SIZE_MB)
-        else:
-            audio_chunks = [audio_path]
-
-        # Транскрибируем каждую часть
-        all_segments: List[TranscriptionSegment] = []
-        full_text_parts: List[str] = []
-        detected_language: Optional[str] = None
-        cumulative_duration = 0.0
-
-        for chunk_idx, chunk_path in enumerate(audio_chunks):
-            chunk_size_mb = chunk_path.stat().st_size / (1024 * 1024)
-            print(f"[INFO] Transcribing chunk {chunk_idx + 1}/{len(audio_chunks)}: {chunk_path.name} ({chunk_size_mb:.2f} MB)")
-            print(f"[INFO] Sending chunk to Whisper API... This may take 1-3 minutes.")
-
-            chunk_result = _transcribe_single_file(chunk_path, model, client)
-
-            print(f"[INFO] ✅ Chunk {chunk_idx + 1}/{len(audio_chunks)} transcribed: {len(chunk_result.segments)} segments, {len(chunk_result.text)} chars")
-
-            # Сохраняем язык из первого чанка
-            if chunk_idx == 0:
-                detected_language = chunk_result.language
-
-            # Добавляем текст
-            if chunk_result.text:
-                full_text_parts.append(chunk_result.text)
-
-            # Добавляем сегменты с корректировкой временных меток
-            for segment in chunk_result.segments:
-                adjusted_segment = TranscriptionSegment(
-                    start=segment.start + cumulative_duration,
-                    end=segment.end + cumulative_duration,
-                    text=segment.text,
-                )
-                all_segments.append(adjusted_segment)
-
-            # Обновляем накопленную длительность для следующего чанка
-            if chunk_result.segments:
-                cumulative_duration = all_segments[-1].end
-
-        # Объединяем результаты
-        full_text = " ".join(full_text_parts)
-        print(f"[INFO] ✅ All chunks processed. Total: {len(all_segments)} segments, {len(full_text)} chars")
-        return TranscriptionResult(text=full_text.strip(), language=detected_language, segments=all_segments)
+        with track_stage("split", platform):
+            audio_chunks = _prepare_chunks(
+                audio_path, chunks_dir, equal_chunks, probe_single=rate_governor is not None and backend.uses_quota
+            )
+
+        def emit_segments(position: int, chunk_result: TranscriptionResult) -> None:
+            on_segments(position, _shift_segments(chunk_result.segments, audio_chunks[position].start))
+
+        # Транскрибируем части параллельно, объединяем строго по порядку
+        chunk_results = _transcribe_chunks(
+            audio_chunks,
+            backend,
+            max_concurrency,
+            rate_governor if backend.uses_quota else None,
+            checkpoint,
+            source_key,
+            on_chunk_done,
+            emit_segments if on_segments is not None else None,
+            platform,
+        )
+
+        return _merge_chunk_results(audio_chunks, chunk_results)
 
     except AudioSplitError as exc:
         raise TranscriptionError(f"Failed to split audio file: {exc}") from exc
     finally:
         # Очищаем временные файлы чанков
         if chunks_dir.exists():
-            import shutil
             try:
                 shutil.rmtree(chunks_dir)
             except Exception:
                 pass  # Игнорируем ошибки очистки
 
 
-def _transcribe_single_file(audio_path: Path, model: str, client: OpenAI) -> TranscriptionResult:
-    """Транскрибирует один аудиофайл через Whisper API."""
+async def transcribe_audio_async(
+    audio_path: Path,
+    model: str,
+    client: Optional[AsyncOpenAI] = None,
+    equal_chunks: bool = False,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    rate_governor: Optional[RateGovernor] = None,
+    checkpoint: Optional["CheckpointStore"] = None,
+    source_key: Optional[str] = None,
+    platform: Optional[str] = None,
+    backend: Optional["TranscriptionBackend"] = None,
+) -> TranscriptionResult:
+    """
+    Асинхронный вариант transcribe_audio для ASGI-режима.
+
+    Разбиение аудио, хэши частей и SQLite выполняются в потоках, запросы к
+    Whisper идут через AsyncOpenAI без отдельного потока на запрос.
+    Локальный движок работает в потоках.
+    """
+    if not audio_path.exists():
+        raise TranscriptionError(f"Audio file not found: {audio_path}")
+
+    backend = backend or _default_backend(model, async_client=client)
+    if not backend.uses_quota:
+        rate_governor = None
+    chunks_dir = audio_path.parent / f"{audio_path.stem}_chunks"
+
     try:
-        with audio_path.open("rb") as audio_file:
-            print(f"[DEBUG] Sending request to Whisper API...")
-            response = client.audio.transcriptions.create(
-                model=model,
-                file=audio_file,
-                response_format="verbose_json",
+        with track_stage("split", platform):
+            audio_chunks = await asyncio.to_thread(
+                _prepare_chunks, audio_path, chunks_dir, equal_chunks, rate_governor is not None
             )
-            print(f"[DEBUG] Received response from Whisper API")
-    except Exception as exc:
-        print(f"[ERROR] Whisper API error: {type(exc).__name__}: {exc}")
-        raise TranscriptionError(f"Whisper API request failed: {exc}") from exc
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        failures: List[Tuple[int, TranscriptionError]] = []
+
+        async def run(chunk: AudioChunk) -> TranscriptionResult:
+            async with semaphore:
+                if failures:
+                    # Ещё не начатые части после ошибки не отправляем
+                    raise TranscriptionError("skipped after another chunk failed")
+                try:
+                    return await _transcribe_chunk_async(
+                        chunk, len(audio_chunks), backend, rate_governor, checkpoint, source_key, platform
+                    )
+                except TranscriptionError as exc:
+                    failures.append((chunk.index, exc))
+                    raise
+
+        chunk_results = await asyncio.gather(*(run(chunk) for chunk in audio_chunks), return_exceptions=True)
+        if failures:
+            raise _chunks_failed(failures, len(audio_chunks))
+        for chunk_result in chunk_results:
+            if isinstance(chunk_result, BaseException):
+                raise chunk_result
+        return _merge_chunk_results(audio_chunks, chunk_results)
 
-    text = getattr(response, "text", "") or ""
-    language = getattr(response, "language", None)
-    segments_data = getattr(response, "segments", []) or []
+    except AudioSplitError as exc:
+        raise TranscriptionError(f"Failed to split audio file: {exc}") from exc
+    finally:
+        if chunks_dir.exists():
+            shutil.rmtree(chunks_dir, ignore_errors=True)
 
-    segments: List[TranscriptionSegment] = []
-    for segment in segments_data:
-        start = float(getattr(segment, "start", 0.0) or 0.0)
-        end = float(getattr(segment, "end", start) or start)
-        seg_text = getattr(segment, "text", "") or ""
 
-        if not seg_text.strip():
-            continue
+def _default_backend(
+    model: str, client: Optional[OpenAI] = None, async_client: Optional[AsyncOpenAI] = None
+) -> "TranscriptionBackend":
+    from .transcription_backends import OpenAIBackend
 
-        segments.append(TranscriptionSegment(start=start, end=end, text=seg_text.strip()))
+    return OpenAIBackend(model, client=client, async_client=async_client)
 
-    return TranscriptionResult(text=text.strip(), language=language, segments=segments)
 
+def _prepare_chunks(audio_path: Path, chunks_dir: Path, equal_chunks: bool, probe_single: bool) -> List[AudioChunk]:
+    # Проверяем размер файла и разделяем при необходимости
+    file_size_mb = audio_path.stat().st_size / (1024 * 1024)
+    if file_size_mb > WHISPER_MAX_FILE_SIZE_MB:
+        print(f"[INFO] Audio file too large ({file_size_mb:.2f} MB), splitting into chunks...")
+        return _split_audio(audio_path, chunks_dir, equal_chunks)
+
+    chunk = AudioChunk(index=0, path=audio_path, start=0.0)
+    if probe_single:
+        # Длительность нужна ограничителю для учёта секунд аудио
+        try:
+            chunk.duration = probe_duration(audio_path)
+        except AudioExtractionError as exc:
+            print(f"[WARN] Could not probe audio duration for rate limiting: {exc}")
+    return [chunk]
+
+
+def _merge_chunk_results(
+    audio_chunks: List[AudioChunk], chunk_results: List[TranscriptionResult]
+) -> TranscriptionResult:
+    all_segments: List[TranscriptionSegment] = []
+    full_text_parts: List[str] = []
+    # Язык определяем по первому чанку
+    detected_language = chunk_results[0].language
+
+    for chunk, chunk_result in zip(audio_chunks, chunk_results):
+        # Добавляем текст
+        if chunk_result.text:
+            full_text_parts.append(chunk_result.text)
+
+        # Добавляем сегменты со сдвигом на начало части в исходном аудио
+        all_segments.extend(_shift_segments(chunk_result.segments, chunk.start))
+
+    # Объединяем результаты
+    full_text = " ".join(full_text_parts)
+    print(f"[INFO] ✅ All chunks processed. Total: {len(all_segments)} segments, {len(full_text)} chars")
+    return TranscriptionResult(text=full_text.strip(), language=detected_language, segments=all_segments)
+
+
+def _transcribe_chunks(
+    chunks: List[AudioChunk],
+    backend: "TranscriptionBackend",
+    max_concurrency: int,
+    rate_governor: Optional[RateGovernor] = None,
+    checkpoint: Optional["CheckpointStore"] = None,
+    source_key: Optional[str] = None,
+    on_chunk_done: Optional[Callable[[int, int], None]] = None,
+    on_ordered_result: Optional[Callable[[int, TranscriptionResult], None]] = None,
+    platform: Optional[str] = None,
+) -> List[TranscriptionResult]:
+    """
+    Отправляет части в движок через пул потоков ограниченного размера.
+
+    Каждая часть повторяется отдельно (call_with_retry); если она так и не удалась, ещё не
+    начатые части отменяются, а ошибка перечисляет номера неудачных частей.
+    Результаты возвращаются в порядке частей; on_ordered_result получает
+    каждую часть, как только готовы она и все предыдущие.
+    """
+    if len(chunks) == 1:
+        result = _transcribe_chunk(chunks[0], 1, backend, rate_governor, checkpoint, source_key, platform)
+        if on_chunk_done is not None:
+            on_chunk_done(1, 1)
+        if on_ordered_result is not None:
+            on_ordered_result(0, result)
+        return [result]
+
+    workers = max(1, min(max_concurrency, len(chunks)))
+    print(f"[INFO] Transcribing {len(chunks)} chunks with up to {workers} parallel requests...")
+
+    results: List[Optional[TranscriptionResult]] = [None] * len(chunks)
+    failures: List[Tuple[int, TranscriptionError]] = []
+    next_ordered = 0
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whisper") as executor:
+        futures = {
+            executor.submit(
+                bind_context(_transcribe_chunk), chunk, len(chunks), backend, rate_governor, checkpoint, source_key, platform
+            ): position
+            for position, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            position = futures[future]
+            if future.cancelled():
+                # Отменена после ошибки другой части: причина уже в failures
+                continue
+            try:
+                results[position] = future.result()
+                if on_chunk_done is not None:
+                    on_chunk_done(sum(result is not None for result in results), len(chunks))
+                while not failures and next_ordered < len(chunks) and results[next_ordered] is not None:
+                    if on_ordered_result is not None:
+                        on_ordered_result(next_ordered, results[next_ordered])
+                    next_ordered += 1
+            except TranscriptionError as exc:
+                failures.append((position, exc))
+                for pending in futures:
+                    pending.cancel()
+
+    if failures:
+        raise _chunks_failed(failures, len(chunks))
+    return results
+
+
+def _chunks_failed(failures: List[Tuple[int, TranscriptionError]], total: int) -> TranscriptionError:
+    """Общая ошибка по неудачным частям; если все упёрлись в квоту - QuotaWaitError."""
+    message = f"{len(failures)} of {total} chunks failed: " + "; ".join(
+        f"chunk {position + 1}: {exc}" for position, exc in sorted(failures, key=lambda failure: failure[0])
+    )
+    if all(isinstance(exc, QuotaWaitError) for _, exc in failures):
+        return QuotaWaitError(message, retry_after=max(exc.retry_after for _, exc in failures))
+    return TranscriptionError(message)
+
+
+def _transcribe_chunk(
+    chunk: AudioChunk,
+    total: int,
+    backend: "TranscriptionBackend",
+    rate_governor: Optional[RateGovernor] = None,
+    checkpoint: Optional["CheckpointStore"] = None,
+    source_key: Optional[str] = None,
+    platform: Optional[str] = None,
+) -> TranscriptionResult:
+    chunk_hash = None
+    if checkpoint is not None and source_key:
+        from .checkpoints import chunk_digest
+
+        chunk_hash = chunk_digest(chunk, backend.model_id)
+        try:
+            saved = checkpoint.get(source_key, chunk_hash)
+        except sqlite3.Error as exc:
+            print(f"[WARN] Checkpoint lookup failed: {exc}")
+            saved = None
+        if saved is not None:
+            print(f"[INFO] ✅ Chunk {chunk.index + 1}/{total} restored from checkpoint")
+            CHUNKS.labels(platform=platform_label(platform), source="checkpoint").inc()
+            return saved
+
+    chunk_size_mb = chunk.size_bytes / (1024 * 1024)
+    print(f"[INFO] Transcribing chunk {chunk.index + 1}/{total}: {chunk.name} ({chunk_size_mb:.2f} MB)")
+    started = time.perf_counter()
+    with span(
+        "whisper_chunk", chunk=chunk.index, bytes=chunk.size_bytes, audio_seconds=chunk.duration or 0.0, backend=backend.name
+    ):
+        chunk_result = backend.transcribe(chunk, rate_governor)
+    _record_chunk(chunk, chunk_result, time.perf_counter() - started, platform, backend.metrics_source)
+    print(f"[INFO] ✅ Chunk {chunk.index + 1}/{total} transcribed: {len(chunk_result.segments)} segments, {len(chunk_result.text)} chars")
+
+    if chunk_hash is not None:
+        try:
+            checkpoint.put(source_key, chunk_hash, chunk_result)
+        except sqlite3.Error as exc:
+            print(f"[WARN] Checkpoint save failed: {exc}")
+    return chunk_result
+
+
+async def _transcribe_chunk_async(
+    chunk: AudioChunk,
+    total: int,
+    backend: "TranscriptionBackend",
+    rate_governor: Optional[RateGovernor] = None,
+    checkpoint: Optional["CheckpointStore"] = None,
+    source_key: Optional[str] = None,
+    platform: Optional[str] = None,
+) -> TranscriptionResult:
+    chunk_hash = None
+    if checkpoint is not None and source_key:
+        from .checkpoints import chunk_digest
+
+        chunk_hash = await asyncio.to_thread(chunk_digest, chunk, backend.model_id)
+        try:
+            saved = await asyncio.to_thread(checkpoint.get, source_key, chunk_hash)
+        except sqlite3.Error as exc:
+            print(f"[WARN] Checkpoint lookup failed: {exc}")
+            saved = None
+        if saved is not None:
+            print(f"[INFO] ✅ Chunk {chunk.index + 1}/{total} restored from checkpoint")
+            CHUNKS.labels(platform=platform_label(platform), source="checkpoint").inc()
+            return saved
+
+    print(f"[INFO] Transcribing chunk {chunk.index + 1}/{total}: {chunk.name} ({chunk.size_bytes / (1024 * 1024):.2f} MB)")
+
+    started = time.perf_counter()
+    with span(
+        "whisper_chunk", chunk=chunk.index, bytes=chunk.size_bytes, audio_seconds=chunk.duration or 0.0, backend=backend.name
+    ):
+        chunk_result = await backend.transcribe_async(chunk, rate_governor)
+    _record_chunk(chunk, chunk_result, time.perf_counter() - started, platform, backend.metrics_source)
+    print(f"[INFO] ✅ Chunk {chunk.index + 1}/{total} transcribed: {len(chunk_result.segments)} segments, {len(chunk_result.text)} chars")
+    if chunk_hash is not None:
+        try:
+            await asyncio.to_thread(checkpoint.put, source_key, chunk_hash, chunk_result)
+        except sqlite3.Error as exc:
+            print(f"[WARN] Checkpoint save failed: {exc}")
+    return chunk_result
+
+
+def _record_chunk(
+    chunk: AudioChunk, result: TranscriptionResult, seconds: float, platform: Optional[str], source: str = "whisper"
+) -> None:
+    label = platform_label(platform)
+    WHISPER_CHUNK_SECONDS.labels(platform=label).observe(seconds)
+    CHUNKS.labels(platform=label, source=source).inc()
+    # Длительность одиночной части без probe берём по последнему сегменту
+    audio_seconds = chunk.duration or (result.segments[-1].end if result.segments else 0.0)
+    TRANSCRIBED_AUDIO_SECONDS.labels(platform=label).inc(max(0.0, audio_seconds))
+
+
+def _shift_segments(segments: List[TranscriptionSegment], offset: float) -> List[TranscriptionSegment]:
+    return [
+        TranscriptionSegment(start=segment.start + offset, end=segment.end + offset, text=segment.text)
+        for segment in segments
+    ]
+
+
+def _split_audio(audio_path: Path, chunks_dir: Path, equal_chunks: bool) -> List[AudioChunk]:
+    """PCM WAV режется в памяти с точными смещениями, остальные форматы - через ffmpeg."""
+    if audio_path.suffix.lower() == ".wav":
+        try:
+            return slice_wav(audio_path, WHISPER_MAX_FILE_SIZE_MB, equal_length=equal_chunks)
+        except WavFormatError as exc:
+            print(f"[WARN] In-memory WAV slicing unavailable ({exc}), falling back to ffmpeg")
+    return split_audio_into_chunks(audio_path, chunks_dir, WHISPER_MAX_FILE_SIZE_MB, equal_length=equal_chunks)
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import io
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from .audio_splitter import AudioChunk
+from .openai_client import call_with_retry, call_with_retry_async, get_async_openai_client, get_openai_client
+from .rate_governor import RateGovernor, RateGovernorTimeout
+from .tracing import span
+from .transcriber import QuotaWaitError, TranscriptionError, TranscriptionResult, TranscriptionSegment
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+BACKEND_OPENAI = "openai"
+BACKEND_LOCAL = "local"
+BACKEND_AUTO = "auto"
+
+PRIORITY_LOW = "low"
+
+
+class TranscriptionBackend(ABC):
+    """
+    Движок, который транскрибирует одну часть аудио.
+
+    Разбиение на части, контрольные точки и метрики остаются в transcriber;
+    движок отвечает только за запрос. model_id попадает в хэш контрольной
+    точки: результат одного движка не подставляется вместо другого.
+    """
+
+    name = ""
+    # Метка source в video_api_chunks_total
+    metrics_source = ""
+    # Нужна ли квота Whisper API (RateGovernor)
+    uses_quota = False
+
+    @property
+    @abstractmethod
+    def model_id(self) -> str:
+        """Идентификатор модели для хэша контрольной точки."""
+
+    @abstractmethod
+    def transcribe(self, chunk: AudioChunk, rate_governor: Optional[RateGovernor] = None) -> TranscriptionResult:
+        """Транскрибирует часть; при ошибке поднимает TranscriptionError."""
+
+    async def transcribe_async(
+        self, chunk: AudioChunk, rate_governor: Optional[RateGovernor] = None
+    ) -> TranscriptionResult:
+        return await asyncio.to_thread(self.transcribe, chunk, rate_governor)
+
+
+class OpenAIBackend(TranscriptionBackend):
+    """Whisper API: каждая часть - отдельный запрос с повторами и квотой."""
+
+    name = BACKEND_OPENAI
+    metrics_source = "whisper"
+    uses_quota = True
+
+    def __init__(self, model: str, client: Optional[OpenAI] = None, async_client: Optional[AsyncOpenAI] = None) -> None:
+        self.model = model
+        self._client = client
+        self._async_client = async_client
+
+    @property
+    def model_id(self) -> str:
+        # Без префикса: контрольные точки, сохранённые до появления движков, остаются валидными
+        return self.model
+
+    def transcribe(self, chunk: AudioChunk, rate_governor: Optional[RateGovernor] = None) -> TranscriptionResult:
+        # Общий клиент воркера: соединения с API переиспользуются между запросами
+        client = self._client or get_openai_client()
+
+        def request():
+            if rate_governor is not None:
+                # Квота занимается на каждую попытку: повтор - тоже запрос к API
+                with span("whisper_quota_wait"):
+                    rate_governor.acquire(chunk.duration or 0.0)
+            # Файл открывается заново на каждую попытку: поток читается с начала
+            with chunk.open() as audio_file:
+                return client.audio.transcriptions.create(
+                    model=self.model,
+                    file=(chunk.name, audio_file),
+                    response_format="verbose_json",
+                )
+
+        try:
+            response = call_with_retry(request, f"Whisper request for {chunk.name}")
+        except RateGovernorTimeout as exc:
+            raise QuotaWaitError(str(exc), retry_after=exc.wait) from exc
+        except Exception as exc:
+            print(f"[ERROR] Whisper API error: {type(exc).__name__}: {exc}")
+            raise TranscriptionError(f"Whisper API request failed: {exc}") from exc
+
+        return _parse_transcription(response)
+
+    async def transcribe_async(
+        self, chunk: AudioChunk, rate_governor: Optional[RateGovernor] = None
+    ) -> TranscriptionResult:
+        client = self._async_client or get_async_openai_client()
+
+        async def request():
+            if rate_governor is not None:
+                with span("whisper_quota_wait"):
+                    await asyncio.to_thread(rate_governor.acquire, chunk.duration or 0.0)
+            with chunk.open() as audio_file:
+                return await client.audio.transcriptions.create(
+                    model=self.model,
+                    file=(chunk.name, audio_file),
+                    response_format="verbose_json",
+                )
+
+        try:
+            response = await call_with_retry_async(request, f"Whisper request for {chunk.name}")
+        except RateGovernorTimeout as exc:
+            raise QuotaWaitError(str(exc), retry_after=exc.wait) from exc
+        except Exception as exc:
+            print(f"[ERROR] Whisper API error: {type(exc).__name__}: {exc}")
+            raise TranscriptionError(f"Whisper API request failed: {exc}") from exc
+
+        return _parse_transcription(response)
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    Whisper на CPU воркера через faster-whisper (CTranslate2, квантование int8).
+
+    Модель загружается один раз на процесс при первой части и живёт до
+    конца воркера. Части декодируются пакетами (BatchedInferencePipeline,
+    batch_size окон по 30 с за проход), одновременно - не больше
+    concurrency частей, чтобы запросы не делили ядра впустую.
+    faster-whisper - необязательная зависимость: без неё движок недоступен.
+    """
+
+    name = BACKEND_LOCAL
+    metrics_source = "local"
+
+    def __init__(
+        self,
+        model_size: str = "small",
+        compute_type: str = "int8",
+        cpu_threads: int = 0,
+        batch_size: int = 8,
+        beam_size: int = 1,
+        concurrency: int = 1,
+    ) -> None:
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.batch_size = max(1, batch_size)
+        self.beam_size = max(1, beam_size)
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+
+    @property
+    def model_id(self) -> str:
+        return f"local:{self.model_size}:{self.compute_type}"
+
+    @staticmethod
+    def available() -> bool:
+        return importlib.util.find_spec("faster_whisper") is not None
+
+    def transcribe(self, chunk: AudioChunk, rate_governor: Optional[RateGovernor] = None) -> TranscriptionResult:
+        try:
+            with chunk.open() as audio_file:
+                # Части WAV читаются из mmap-среза без seek, декодеру нужен обычный буфер
+                audio = io.BytesIO(audio_file.read())
+            with self._slots:
+                pipeline, batched = _load_local_model(
+                    self.model_size, self.compute_type, self.cpu_threads, self.batch_size > 1
+                )
+                options: Dict[str, Any] = {"beam_size": self.beam_size}
+                if batched:
+                    options["batch_size"] = self.batch_size
+                segments, info = pipeline.transcribe(audio, **options)
+                # Сегменты - генератор: декодирование идёт при чтении
+                segments = list(segments)
+        except TranscriptionError:
+            raise
+        except Exception as exc:
+            print(f"[ERROR] Local Whisper error: {type(exc).__name__}: {exc}")
+            raise TranscriptionError(f"Local Whisper transcription failed: {exc}") from exc
+
+        parsed = [
+            TranscriptionSegment(start=float(segment.start), end=float(segment.end), text=segment.text.strip())
+            for segment in segments
+            if segment.text.strip()
+        ]
+        return TranscriptionResult(
+            text=" ".join(segment.text for segment in parsed),
+            language=getattr(info, "language", None),
+            segments=parsed,
+        )
+
+
+class BackendRouter:
+    """
+    Выбирает движок для аудио запроса.
+
+    mode=openai или local - всегда соответствующий движок. В режиме auto
+    короткое аудио (до local_max_seconds) и запросы с priority=low идут в
+    локальный движок, остальное - в Whisper API. Если faster-whisper не
+    установлен, всё идёт в API.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        api: TranscriptionBackend,
+        local: Optional[TranscriptionBackend],
+        local_max_seconds: float = 300.0,
+    ) -> None:
+        self.mode = mode
+        self.api = api
+        self.local = local
+        self.local_max_seconds = local_max_seconds
+
+    def choose(self, audio_seconds: Optional[float], priority: Optional[str] = None) -> TranscriptionBackend:
+        if self.local is None or self.mode == BACKEND_OPENAI:
+            return self.api
+        if self.mode == BACKEND_LOCAL or priority == PRIORITY_LOW:
+            return self.local
+        if audio_seconds is not None and audio_seconds <= self.local_max_seconds:
+            return self.local
+        return self.api
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode if self.local is not None else BACKEND_OPENAI,
+            "local_available": self.local is not None,
+            "local_max_seconds": self.local_max_seconds,
+            "local_models_loaded": [f"{size}:{compute}" for size, compute, _, _ in _local_models],
+        }
+
+
+# Загруженные модели процесса: (размер, тип вычислений, потоки, пакетный режим) -> (pipeline, пакетный ли)
+_local_models: Dict[Tuple[str, str, int, bool], Tuple[Any, bool]] = {}
+_local_models_pid: Optional[int] = None
+_local_models_lock = threading.Lock()
+
+
+def _load_local_model(model_size: str, compute_type: str, cpu_threads: int, batched: bool) -> Tuple[Any, bool]:
+    global _local_models_pid
+    key = (model_size, compute_type, cpu_threads, batched)
+    with _local_models_lock:
+        if _local_models_pid != os.getpid():
+            # Потоки CTranslate2 не переживают fork: после него модель загружается заново
+            _local_models.clear()
+            _local_models_pid = os.getpid()
+        loaded = _local_models.get(key)
+        if loaded is not None:
+            return loaded
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as exc:
+            raise TranscriptionError("Local Whisper requires the faster-whisper package") from exc
+        print(f"[INFO] Loading local Whisper model '{model_size}' ({compute_type}, CPU)...")
+        model = WhisperModel(model_size, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+        loaded: Tuple[Any, bool] = (model, False)
+        if batched:
+            try:
+                from faster_whisper import BatchedInferencePipeline
+
+                loaded = (BatchedInferencePipeline(model=model), True)
+            except ImportError:
+                # faster-whisper < 1.1: пакетного декодирования нет, работаем последовательно
+                print("[WARN] faster-whisper has no BatchedInferencePipeline, using sequential decoding")
+        _local_models[key] = loaded
+        return loaded
+
+
+def _parse_transcription(response) -> TranscriptionResult:
+    text = getattr(response, "text", "") or ""
+    language = getattr(response, "language", None)
+    segments_data = getattr(response, "segments", []) or []
+
+    segments: List[TranscriptionSegment] = []
+    for segment in segments_data:
+        start = float(getattr(segment, "start", 0.0) or 0.0)
+        end = float(getattr(segment, "end", start) or start)
+        seg_text = getattr(segment, "text", "") or ""
+
+        if not seg_text.strip():
+            continue
+
+        segments.append(TranscriptionSegment(start=start, end=end, text=seg_text.strip()))
+
+    return TranscriptionResult(text=text.strip(), language=language, segments=segments)
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import math
 import os
+import sqlite3
 import uuid
 from pathlib import Path
 from typing import Iterable
@@ -31,11 +32,27 @@ def cleanup_paths(paths: Iterable[Path]) -> None:
             if path.is_file() or path.is_symlink():
                 path.unlink(missing_ok=True)
             elif path.is_dir():
-                for root, _, files in os.walk(path, topdown=False):
+                for root, dirs, files in os.walk(path, topdown=False):
                     for file_name in files:
                         Path(root, file_name).unlink(missing_ok=True)
+                    for dir_name in dirs:
+                        Path(root, dir_name).rmdir()
                 path.rmdir()
         except Exception:
             # Нам важна попытка очистки, но ошибки не должны останавливать конвейер
             continue
 
+
+def open_sqlite(path: Path) -> sqlite3.Connection:
+    """
+    Открывает SQLite-базу, общую для всех воркеров gunicorn.
+
+    WAL позволяет читать параллельно с записью, busy_timeout - ждать
+    блокировку другого процесса вместо немедленной ошибки.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA busy_timeout=30000")
+    return connection
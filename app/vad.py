@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import bisect
+import subprocess
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Tuple
+
+from .audio_extractor import (
+    DEFAULT_AUDIO_FORMAT,
+    AudioExtractionError,
+    AudioFormat,
+    detect_silences,
+    probe_duration,
+)
+from .transcriber import TranscriptionResult, TranscriptionSegment
+
+# Если тишины меньше этой доли, перекодирование не окупается
+_MIN_REMOVED_RATIO = 0.05
+
+
+class VadError(RuntimeError):
+    """Ошибка при поиске или вырезании тишины."""
+
+
+@dataclass
+class SpeechSpan:
+    original_start: float
+    trimmed_start: float
+    duration: float
+
+
+@dataclass
+class OffsetMap:
+    """Соответствие времени в обрезанном аудио времени в исходном."""
+
+    spans: List[SpeechSpan] = field(default_factory=list)
+
+    def to_original(self, seconds: float) -> float:
+        if not self.spans:
+            return seconds
+        starts = [span.trimmed_start for span in self.spans]
+        index = max(0, bisect.bisect_right(starts, seconds) - 1)
+        span = self.spans[index]
+        return span.original_start + min(seconds - span.trimmed_start, span.duration)
+
+    def apply(self, transcription: TranscriptionResult) -> TranscriptionResult:
+        """Переносит таймкоды сегментов на исходную шкалу времени."""
+        segments = [
+            TranscriptionSegment(
+                start=self.to_original(segment.start),
+                end=self.to_original(segment.end),
+                text=segment.text,
+            )
+            for segment in transcription.segments
+        ]
+        return TranscriptionResult(text=transcription.text, language=transcription.language, segments=segments)
+
+
+@dataclass
+class TrimResult:
+    audio_path: Path
+    offset_map: OffsetMap
+    original_duration: float
+    kept_duration: float
+
+    @property
+    def removed_ratio(self) -> float:
+        if self.original_duration <= 0:
+            return 0.0
+        return max(0.0, 1.0 - self.kept_duration / self.original_duration)
+
+
+def speech_regions(
+    silences: List[Tuple[float, float]], duration: float, padding_seconds: float
+) -> List[Tuple[float, float]]:
+    """Дополнение тишины до отрезков речи; у каждого отрезка остаётся padding по краям."""
+    regions: List[Tuple[float, float]] = []
+    cursor = 0.0
+    for silence_start, silence_end in silences:
+        cut_start = silence_start + padding_seconds if silence_start > 0 else 0.0
+        cut_end = silence_end - padding_seconds if silence_end < duration else duration
+        if cut_end <= cut_start:
+            continue
+        if cut_start > cursor:
+            regions.append((cursor, min(cut_start, duration)))
+        cursor = max(cursor, cut_end)
+    if cursor < duration:
+        regions.append((cursor, duration))
+    return regions
+
+
+def trim_silence(
+    audio_path: Path,
+    output_dir: Path,
+    audio_format: AudioFormat = DEFAULT_AUDIO_FORMAT,
+    noise_db: float = -35.0,
+    min_silence_seconds: float = 1.0,
+    padding_seconds: float = 0.25,
+) -> TrimResult:
+    """
+    Вырезает неречевые участки и склеивает речь в один файл.
+
+    Возвращает путь к новому файлу и карту смещений, по которой таймкоды
+    Whisper переводятся обратно на шкалу исходного аудио. Если тишины почти
+    нет, возвращается исходный файл без перекодирования.
+    """
+    try:
+        duration = probe_duration(audio_path)
+        silences = detect_silences(audio_path, noise_db, min_silence_seconds)
+    except AudioExtractionError as exc:
+        raise VadError(str(exc)) from exc
+    regions = speech_regions(silences, duration, padding_seconds)
+
+    spans: List[SpeechSpan] = []
+    trimmed_cursor = 0.0
+    for start, end in regions:
+        spans.append(SpeechSpan(original_start=start, trimmed_start=trimmed_cursor, duration=end - start))
+        trimmed_cursor += end - start
+
+    untouched = TrimResult(audio_path, OffsetMap(), duration, duration)
+    if not spans:
+        # Речь не найдена: отдаём как есть, пусть решает Whisper
+        return untouched
+    result = TrimResult(audio_path, OffsetMap(spans), duration, trimmed_cursor)
+    if result.removed_ratio < _MIN_REMOVED_RATIO:
+        return untouched
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / f"{audio_path.stem}.speech.{audio_format.extension}"
+    script_path = output_dir / f"{audio_path.stem}.speech.filter"
+    selection = "+".join(f"between(t,{start:.6f},{end:.6f})" for start, end in regions)
+    # Выражение может быть очень длинным, поэтому передаём его файлом
+    script_path.write_text(f"aselect='{selection}',asetpts=N/SR/TB", encoding="utf-8")
+
+    command = [
+        "ffmpeg",
+        "-y",
+        "-i",
+        str(audio_path),
+        "-filter_script:a",
+        str(script_path),
+        "-ac",
+        "1",
+        "-ar",
+        "16000",
+        *audio_format.codec_args,
+        "-loglevel",
+        "error",
+        str(output_path),
+    ]
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as exc:
+        raise VadError(f"Failed to cut silence: {exc.stderr}") from exc
+    finally:
+        script_path.unlink(missing_ok=True)
+
+    result.audio_path = output_path
+    return result
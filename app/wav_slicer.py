@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import io
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from .audio_extractor import AudioExtractionError, detect_silences
+from .audio_splitter import (
+    SILENCE_MIN_SECONDS,
+    SILENCE_NOISE_DB,
+    SIZE_SAFETY_FACTOR,
+    AudioChunk,
+    AudioSplitError,
+    plan_chunk_boundaries,
+)
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+_HEADER_SIZE = 44
+
+
+class WavFormatError(AudioSplitError):
+    """Файл не является PCM WAV, который можно резать по байтам."""
+
+
+@dataclass(frozen=True)
+class WavInfo:
+    channels: int
+    sample_rate: int
+    bits_per_sample: int
+    data_offset: int
+    data_size: int
+
+    @property
+    def block_align(self) -> int:
+        return self.channels * self.bits_per_sample // 8
+
+    @property
+    def frame_count(self) -> int:
+        return self.data_size // self.block_align
+
+    @property
+    def duration(self) -> float:
+        return self.frame_count / self.sample_rate
+
+
+def read_wav_info(path: Path) -> WavInfo:
+    """Разбирает заголовок RIFF/WAVE и находит блоки fmt и data."""
+    with path.open("rb") as wav_file:
+        riff = wav_file.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            raise WavFormatError(f"Not a RIFF/WAVE file: {path}")
+
+        fmt: Optional[tuple] = None
+        file_size = os.fstat(wav_file.fileno()).st_size
+        while True:
+            header = wav_file.read(8)
+            if len(header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack("<HHIIHH", wav_file.read(16))
+                wav_file.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise WavFormatError(f"WAV data chunk precedes fmt chunk: {path}")
+                format_tag, channels, sample_rate, _, _, bits_per_sample = fmt
+                if format_tag not in (_WAVE_FORMAT_PCM, _WAVE_FORMAT_EXTENSIBLE) or bits_per_sample % 8:
+                    raise WavFormatError(f"Unsupported WAV encoding (format {format_tag:#x}, {bits_per_sample} bit)")
+                data_offset = wav_file.tell()
+                # ffmpeg при записи в pipe оставляет размер 0xFFFFFFFF - берём фактический
+                data_size = min(chunk_size, file_size - data_offset)
+                return WavInfo(channels, sample_rate, bits_per_sample, data_offset, data_size)
+            else:
+                wav_file.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+    raise WavFormatError(f"WAV file has no data chunk: {path}")
+
+
+class WavSliceChunk(AudioChunk):
+    """
+    Часть WAV, которая читается напрямую из исходного файла через mmap.
+
+    Копия на диск не создаётся: open() отдаёт сгенерированный 44-байтовый
+    заголовок, за которым следует срез исходных PCM-данных.
+    """
+
+    def __init__(self, index: int, path: Path, info: WavInfo, start_frame: int, frame_count: int) -> None:
+        super().__init__(
+            index=index,
+            path=path,
+            start=start_frame / info.sample_rate,
+            duration=frame_count / info.sample_rate,
+        )
+        self.info = info
+        self.start_frame = start_frame
+        self.frame_count = frame_count
+
+    @property
+    def name(self) -> str:
+        return f"{self.path.stem}_chunk_{self.index:03d}.wav"
+
+    @property
+    def size_bytes(self) -> int:
+        return _HEADER_SIZE + self.frame_count * self.info.block_align
+
+    def open(self) -> "_WavSliceReader":
+        offset = self.info.data_offset + self.start_frame * self.info.block_align
+        return _WavSliceReader(self.path, self.info, offset, self.frame_count * self.info.block_align)
+
+
+class _WavSliceReader(io.RawIOBase):
+    """Файлоподобный объект: заголовок WAV + memoryview на срез mmap."""
+
+    def __init__(self, path: Path, info: WavInfo, data_offset: int, data_size: int) -> None:
+        super().__init__()
+        self._file = path.open("rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._header = _build_header(info, data_size)
+        self._data = memoryview(self._mmap)[data_offset : data_offset + data_size]
+        self._size = len(self._header) + data_size
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self._position = max(0, position)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        target = memoryview(buffer).cast("B")
+        written = 0
+        header_size = len(self._header)
+
+        if self._position < header_size:
+            part = self._header[self._position : self._position + len(target)]
+            target[: len(part)] = part
+            written = len(part)
+            self._position += written
+
+        if written < len(target) and self._position < self._size:
+            start = self._position - header_size
+            end = min(len(self._data), start + len(target) - written)
+            target[written : written + end - start] = self._data[start:end]
+            written += end - start
+            self._position += end - start
+
+        return written
+
+    def close(self) -> None:
+        if not self.closed:
+            self._data.release()
+            self._mmap.close()
+            self._file.close()
+        super().close()
+
+
+def slice_wav(
+    audio_path: Path,
+    max_size_mb: float = 24.0,
+    equal_length: bool = False,
+    align_to_silence: bool = True,
+) -> List[AudioChunk]:
+    """
+    Делит PCM WAV на части без ffmpeg и временных файлов.
+
+    Границы выбираются так же, как в split_audio_into_chunks, но
+    округляются до целого сэмпла, поэтому смещения частей точные.
+    """
+    info = read_wav_info(audio_path)
+
+    if _HEADER_SIZE + info.data_size <= max_size_mb * 1024 * 1024:
+        return [WavSliceChunk(0, audio_path, info, 0, info.frame_count)]
+
+    max_bytes = max_size_mb * 1024 * 1024 * SIZE_SAFETY_FACTOR - _HEADER_SIZE
+    max_chunk_seconds = max_bytes / (info.block_align * info.sample_rate)
+
+    silences = []
+    if align_to_silence:
+        try:
+            silences = detect_silences(audio_path, SILENCE_NOISE_DB, SILENCE_MIN_SECONDS)
+        except AudioExtractionError as exc:
+            print(f"[WARN] Silence detection failed, cutting at fixed points: {exc}")
+
+    boundaries = plan_chunk_boundaries(info.duration, max_chunk_seconds, silences, equal_length)
+    frames = [0, *(round(boundary * info.sample_rate) for boundary in boundaries), info.frame_count]
+
+    chunks: List[AudioChunk] = [
+        WavSliceChunk(index, audio_path, info, frames[index], frames[index + 1] - frames[index])
+        for index in range(len(frames) - 1)
+    ]
+    print(f"[INFO] WAV sliced in memory into {len(chunks)} chunks (no temp files)")
+    return chunks
+
+
+def _build_header(info: WavInfo, data_size: int) -> bytes:
+    byte_rate = info.sample_rate * info.block_align
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        _WAVE_FORMAT_PCM,
+        info.channels,
+        info.sample_rate,
+        byte_rate,
+        info.block_align,
+        info.bits_per_sample,
+        b"data",
+        data_size,
+    )
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from yt_dlp import YoutubeDL
+
+# Пул готовых экземпляров YoutubeDL текущего процесса. Конструктор
+# YoutubeDL и первая инициализация экстракторов занимают десятки
+# миллисекунд, а скачивание делало это на каждую попытку. yt_dlp
+# импортируется только при создании первого экземпляра.
+
+
+@dataclass
+class PoolSettings:
+    # Сколько свободных экземпляров одной конфигурации держать в процессе
+    max_idle: int = 4
+    # После стольких сессий экземпляр пересоздаётся: кэши экстракторов растут
+    max_uses: int = 50
+
+
+@dataclass
+class _Entry:
+    ydl: "YoutubeDL"
+    pid: int
+    uses: int = 0
+
+
+_settings = PoolSettings()
+_idle: Dict[str, List[_Entry]] = {}
+_lock = threading.Lock()
+
+_stats: Dict[str, int] = {
+    "created": 0,
+    "reused": 0,
+    "discarded": 0,
+    "warmed": 0,
+}
+
+
+def configure(**overrides) -> None:
+    """Меняет настройки пула текущего процесса."""
+    with _lock:
+        for name, value in overrides.items():
+            if value is not None:
+                setattr(_settings, name, value)
+
+
+@contextmanager
+def session(params: dict, outtmpl: Optional[str] = None) -> Iterator["YoutubeDL"]:
+    """
+    Выдаёт YoutubeDL с параметрами params из пула текущего процесса.
+
+    Экземпляр занят только вызывающим потоком до конца блока. outtmpl
+    задаётся на время сессии: шаблон имени файла у каждого запроса свой,
+    поэтому в ключ конфигурации он не входит. После исключения экземпляр
+    в пул не возвращается.
+    """
+    key = _key(params)
+    entry = _take(key)
+    if entry is None:
+        entry = _Entry(_create(params), os.getpid())
+    templates = entry.ydl.params["outtmpl"]
+    previous = templates.get("default")
+    if outtmpl is not None:
+        templates["default"] = outtmpl
+    try:
+        yield entry.ydl
+    except BaseException:
+        _close(entry)
+        raise
+    finally:
+        # Следующая сессия (например, probe) не должна писать по пути этого запроса
+        if previous is None:
+            templates.pop("default", None)
+        else:
+            templates["default"] = previous
+    entry.uses += 1
+    _put(key, entry)
+
+
+def warm(configs: Iterable[dict], extractors: Iterable[str] = (), per_config: int = 1) -> int:
+    """
+    Создаёт экземпляры заранее, чтобы первый запрос их не ждал.
+
+    extractors - ключи экстракторов (например, "Youtube"), которые
+    загружаются сразу. Экземпляры, созданные в мастере gunicorn до fork и
+    ещё не использованные, воркеры забирают себе. Возвращает число
+    созданных экземпляров.
+    """
+    extractors = tuple(extractors)
+    created = 0
+    for params in configs:
+        key = _key(params)
+        with _lock:
+            missing = per_config - sum(1 for entry in _idle.get(key, []) if _usable(entry))
+        for _ in range(max(0, missing)):
+            entry = _Entry(_create(params), os.getpid())
+            for name in extractors:
+                try:
+                    entry.ydl.get_info_extractor(name)
+                except Exception as exc:
+                    print(f"[WARN] Could not preload yt-dlp extractor {name}: {exc}")
+            with _lock:
+                _idle.setdefault(key, []).append(entry)
+                _stats["warmed"] += 1
+            created += 1
+    return created
+
+
+def get_pool_stats() -> Dict[str, int]:
+    """Счётчики пула и число свободных экземпляров в текущем процессе."""
+    with _lock:
+        stats = dict(_stats)
+        stats["idle"] = sum(1 for entries in _idle.values() for entry in entries if _usable(entry))
+    return stats
+
+
+def _key(params: dict) -> str:
+    return json.dumps({name: value for name, value in params.items() if name != "outtmpl"}, sort_keys=True, default=str)
+
+
+def _usable(entry: _Entry) -> bool:
+    # После fork годятся только экземпляры, которыми родитель не пользовался:
+    # у них ещё нет открытых соединений и cookie, общих с другим процессом
+    return entry.pid == os.getpid() or entry.uses == 0
+
+
+def _take(key: str) -> Optional[_Entry]:
+    with _lock:
+        entries = _idle.get(key, [])
+        while entries:
+            entry = entries.pop()
+            if _usable(entry):
+                entry.pid = os.getpid()
+                _stats["reused"] += 1
+                return entry
+    return None
+
+
+def _put(key: str, entry: _Entry) -> None:
+    with _lock:
+        entries = _idle.setdefault(key, [])
+        if entry.uses < _settings.max_uses and len(entries) < _settings.max_idle:
+            entries.append(entry)
+            return
+    _close(entry)
+
+
+def _create(params: dict) -> "YoutubeDL":
+    from yt_dlp import YoutubeDL
+
+    # YoutubeDL дополняет переданный словарь, поэтому у каждого экземпляра своя копия
+    ydl = YoutubeDL(dict(params))
+    with _lock:
+        _stats["created"] += 1
+    return ydl
+
+
+def _close(entry: _Entry) -> None:
+    with _lock:
+        _stats["discarded"] += 1
+    try:
+        entry.ydl.close()
+    except Exception as exc:
+        print(f"[WARN] Failed to close YoutubeDL instance: {exc}")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Запускает сервис с подменённым экстрактором yt-dlp.
+
+Ссылки вида https://www.youtube.com/watch?v=bn<длительность:5><номер:4>
+переписываются на файл <длительность>.<ext> медиасервера BENCH_MEDIA_URL,
+дальше yt-dlp работает как обычно (generic-экстрактор, HTTP-загрузка).
+Канонический ключ у каждой ссылки свой, поэтому кэш и single-flight не
+схлопывают запросы бенчмарка.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sys
+from urllib.parse import parse_qs, urlparse
+
+_BENCH_ID = re.compile(r"^bn(\d{5})\d{4}$")
+
+
+def bench_url(duration: int, number: int) -> str:
+    return f"https://www.youtube.com/watch?v=bn{duration:05d}{number:04d}"
+
+
+def install_fake_extractor(media_base_url: str, extension: str) -> None:
+    from yt_dlp import YoutubeDL
+
+    original = YoutubeDL.extract_info
+
+    def extract_info(self, url, *args, **kwargs):
+        video_id = (parse_qs(urlparse(url).query).get("v") or [""])[0]
+        match = _BENCH_ID.match(video_id)
+        if not match:
+            return original(self, url, *args, **kwargs)
+        duration = int(match.group(1))
+        info = original(self, f"{media_base_url}/{duration}.{extension}", *args, **kwargs)
+        # Generic-экстрактор длительность не знает, а YouTube отдаёт её всегда
+        if isinstance(info, dict) and info.get("duration") is None:
+            info["duration"] = float(duration)
+        return info
+
+    YoutubeDL.extract_info = extract_info
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=1, help="Потоков на воркер gunicorn (gthread, если > 1)")
+    args = parser.parse_args()
+
+    # Подмена ставится в мастере до fork, воркеры gunicorn её наследуют
+    install_fake_extractor(os.environ["BENCH_MEDIA_URL"], os.getenv("BENCH_MEDIA_EXT", "m4a"))
+
+    if args.app == "asgi":
+        import uvicorn
+
+        uvicorn.run("app.asgi:app", host="127.0.0.1", port=args.port, log_level="warning")
+        return
+
+    from gunicorn.app.wsgiapp import run
+
+    sys.argv = [
+        "gunicorn",
+        "--config", "gunicorn.conf.py",
+        "--workers", str(args.workers),
+        "--threads", str(args.threads),
+        "--timeout", "600",
+        "--bind", f"127.0.0.1:{args.port}",
+        "--log-level", "warning",
+        "app.main:app",
+    ]
+    run()
+
+
+if __name__ == "__main__":
+    main()
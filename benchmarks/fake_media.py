@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Синтетические ролики для бенчмарков и локальный сервер, отдающий их yt-dlp.
+
+Ролики генерируются ffmpeg из источников lavfi (testsrc2 + sine) и
+кэшируются в каталоге. Сервер поддерживает ограничение скорости, чтобы
+моделировать медленную сеть.
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterable, List
+
+
+def media_name(duration: int, kind: str) -> str:
+    return f"{duration}.{'m4a' if kind == 'audio' else 'mp4'}"
+
+
+def generate_media(directory: Path, durations: Iterable[int], kind: str = "audio") -> List[Path]:
+    """
+    Создаёт по файлу на длительность (секунды).
+
+    kind="audio" - AAC 64 kbps, как аудиопоток, который сервис скачивает по
+    умолчанию; kind="video" - mp4 240p с дорожкой звука.
+    """
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg is required to generate benchmark media")
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for duration in durations:
+        path = directory / media_name(duration, kind)
+        if not path.exists():
+            print(f"[INFO] Generating {duration}s {kind} sample: {path}")
+            tmp_path = path.with_name(f"tmp-{path.name}")
+            command = ["ffmpeg", "-y", "-v", "error"]
+            if kind == "video":
+                command += ["-f", "lavfi", "-i", f"testsrc2=size=426x240:rate=15:duration={duration}"]
+            command += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}"]
+            if kind == "video":
+                command += ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p"]
+            command += ["-c:a", "aac", "-b:a", "64k", "-movflags", "+faststart", "-shortest", str(tmp_path)]
+            subprocess.run(command, check=True)
+            tmp_path.rename(path)
+        paths.append(path)
+    return paths
+
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directory: Path, port: int = 0, bandwidth_mbps: float = 0.0) -> None:
+        handler = functools.partial(_MediaHandler, directory=str(directory))
+        super().__init__(("127.0.0.1", port), handler)
+        self.bandwidth_mbps = bandwidth_mbps
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "MediaServer":
+        threading.Thread(target=self.serve_forever, name="fake-media", daemon=True).start()
+        return self
+
+    def handle_error(self, request, client_address) -> None:
+        # yt-dlp закрывает соединение после чтения заголовков - это не ошибка
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _MediaHandler(SimpleHTTPRequestHandler):
+    server: MediaServer
+
+    def copyfile(self, source, outputfile) -> None:
+        rate = self.server.bandwidth_mbps * 1024 * 1024 / 8
+        if rate <= 0:
+            super().copyfile(source, outputfile)
+            return
+        # Отдаём блоками по 64 КБ с паузами, держа среднюю скорость
+        block_size = 64 * 1024
+        started = time.monotonic()
+        sent = 0
+        while True:
+            block = source.read(block_size)
+            if not block:
+                return
+            outputfile.write(block)
+            sent += len(block)
+            ahead = sent / rate - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dir", type=Path, default=Path("benchmarks/.media"))
+    parser.add_argument("--durations", default="60,600", help="Длительности через запятую, секунды")
+    parser.add_argument("--kind", choices=("audio", "video"), default="audio")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--bandwidth-mbps", type=float, default=0.0, help="Ограничение скорости, Мбит/с (0 - без)")
+    args = parser.parse_args()
+
+    generate_media(args.dir, [int(value) for value in args.durations.split(",")], args.kind)
+    server = MediaServer(args.dir, args.port, args.bandwidth_mbps)
+    print(f"Media server: {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
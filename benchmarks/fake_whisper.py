@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Whisper API для бенчмарков.
+
+Принимает POST /v1/audio/transcriptions (multipart, как клиент openai) и
+отвечает verbose_json с сегментами каждые 10 секунд аудио. Задержка и
+доля ошибок настраиваются. Сервис направляется сюда через
+OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+# Длительность по размеру для не-WAV частей: ~32 kbps
+_FALLBACK_BYTES_PER_SECOND = 4000
+_SEGMENT_SECONDS = 10.0
+
+
+class FakeWhisperServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.5,
+        latency_per_minute: float = 0.5,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+    ) -> None:
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.latency_per_minute = latency_per_minute
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stats: Dict[str, float] = {"requests": 0, "errors": 0, "rate_limited": 0, "bytes": 0, "audio_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "FakeWhisperServer":
+        threading.Thread(target=self.serve_forever, name="fake-whisper", daemon=True).start()
+        return self
+
+    def count(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.stats[name] += amount
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeWhisperServer
+
+    def do_POST(self) -> None:  # noqa: N802 - имя задано http.server
+        if not self.path.rstrip("/").endswith("/audio/transcriptions"):
+            self._reply(404, {"error": {"message": "not found"}})
+            return
+        body = self._read_body()
+        server = self.server
+        server.count("requests")
+        server.count("bytes", len(body))
+
+        roll = random.random()
+        if roll < server.rate_limit_rate:
+            server.count("rate_limited")
+            self._reply(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"retry-after": "1"})
+            return
+        if roll < server.rate_limit_rate + server.error_rate:
+            server.count("errors")
+            self._reply(500, {"error": {"message": "Fake server error"}})
+            return
+
+        duration = _wav_duration(body) or len(body) / _FALLBACK_BYTES_PER_SECOND
+        server.count("audio_seconds", duration)
+        time.sleep(server.latency + server.latency_per_minute * duration / 60.0)
+        self._reply(200, _transcription(duration))
+
+    def do_GET(self) -> None:  # noqa: N802
+        with self.server._lock:
+            self._reply(200, dict(self.server.stats))
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        parts = []
+        while True:
+            size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return b"".join(parts)
+            parts.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _reply(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _transcription(duration: float) -> dict:
+    segments = []
+    start = 0.0
+    while start < duration:
+        end = min(duration, start + _SEGMENT_SECONDS)
+        segments.append({"id": len(segments), "start": start, "end": end, "text": f" Сегмент {len(segments) + 1}."})
+        start = end
+    return {
+        "task": "transcribe",
+        "language": "russian",
+        "duration": duration,
+        "text": "".join(segment["text"] for segment in segments).strip(),
+        "segments": segments,
+    }
+
+
+def _wav_duration(body: bytes) -> Optional[float]:
+    """Длительность WAV из заголовка внутри multipart-тела."""
+    riff = body.find(b"RIFF")
+    if riff < 0 or body[riff + 8 : riff + 12] != b"WAVE":
+        return None
+    fmt = body.find(b"fmt ", riff)
+    data = body.find(b"data", riff)
+    if fmt < 0 or data < 0:
+        return None
+    byte_rate = struct.unpack_from("<I", body, fmt + 16)[0]
+    data_size = struct.unpack_from("<I", body, data + 4)[0]
+    if not byte_rate:
+        return None
+    # Размер 0xFFFFFFFF пишет ffmpeg в потоковом режиме: считаем по факту
+    if data_size == 0xFFFFFFFF:
+        data_size = len(body) - data - 8
+    return data_size / byte_rate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.5, help="Базовая задержка ответа, с")
+    parser.add_argument("--latency-per-minute", type=float, default=0.5, help="Добавка за минуту аудио, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов 429")
+    args = parser.parse_args()
+
+    server = FakeWhisperServer(args.port, args.latency, args.latency_per_minute, args.error_rate, args.rate_limit_rate)
+    print(f"Fake Whisper API: OPENAI_BASE_URL={server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарк /analyze: без YouTube и OpenAI.
+
+Генерирует синтетические ролики, поднимает медиасервер и фейковый
+Whisper, запускает сервис (benchmarks/bench_server.py) и гоняет /analyze
+на нескольких уровнях параллельности. Для каждого уровня печатает
+задержки, пропускную способность, среднее время этапов (по /metrics),
+пиковый RSS дерева процессов сервиса и пиковый объём временных файлов.
+
+Пример:
+    python -m benchmarks.run_benchmark --durations 60,600 --concurrency 1,4,8
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from .bench_server import bench_url
+from .fake_media import MediaServer, generate_media, media_name
+from .fake_whisper import FakeWhisperServer
+
+ROOT = Path(__file__).resolve().parent.parent
+_METRIC_LINE = re.compile(r'^(video_api_\w+?)_(sum|count)\{([^}]*)\} ([0-9.eE+-]+)$')
+_STAGES = ("probe", "download", "extract", "vad", "split", "transcribe")
+_SAMPLE_INTERVAL_SECONDS = 0.2
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline /analyze benchmark")
+    parser.add_argument("--durations", default="60,600", help="Длительности роликов, секунды")
+    parser.add_argument("--concurrency", default="1,4,8", help="Уровни параллельности")
+    parser.add_argument("--requests", type=int, default=0, help="Запросов на уровень (по умолчанию 2 x параллельность)")
+    parser.add_argument("--media-kind", choices=("audio", "video"), default="audio")
+    parser.add_argument("--media-dir", type=Path, default=ROOT / "benchmarks" / ".media")
+    parser.add_argument("--bandwidth-mbps", type=float, default=0.0)
+    parser.add_argument("--whisper-latency", type=float, default=0.5)
+    parser.add_argument("--whisper-latency-per-minute", type=float, default=0.5)
+    parser.add_argument("--whisper-error-rate", type=float, default=0.0)
+    parser.add_argument("--whisper-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--app", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="Переменная окружения сервиса")
+    parser.add_argument("--output", type=Path, help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    durations = [int(value) for value in args.durations.split(",")]
+    levels = [int(value) for value in args.concurrency.split(",")]
+    generate_media(args.media_dir, durations, args.media_kind)
+
+    media = MediaServer(args.media_dir, bandwidth_mbps=args.bandwidth_mbps).start()
+    whisper = FakeWhisperServer(
+        latency=args.whisper_latency,
+        latency_per_minute=args.whisper_latency_per_minute,
+        error_rate=args.whisper_error_rate,
+        rate_limit_rate=args.whisper_rate_limit_rate,
+    ).start()
+
+    work_root = Path(tempfile.mkdtemp(prefix="video-api-bench-"))
+    temp_dir = work_root / "tmp"
+    env = dict(os.environ)
+    env.update(
+        {
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": whisper.base_url,
+            "BENCH_MEDIA_URL": media.base_url,
+            "BENCH_MEDIA_EXT": media_name(0, args.media_kind).split(".")[-1],
+            "TEMP_DIR": str(temp_dir),
+            "STATE_DIR": str(work_root / "state"),
+            "PROMETHEUS_MULTIPROC_DIR": str(work_root / "state" / "prometheus"),
+            # Квота настоящего Whisper здесь не нужна
+            "WHISPER_REQUESTS_PER_MINUTE": "0",
+        }
+    )
+    env.update(dict(item.split("=", 1) for item in args.env))
+
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.bench_server",
+            "--app", args.app,
+            "--port", str(args.port),
+            "--workers", str(args.workers),
+            "--threads", str(args.threads),
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    try:
+        _wait_ready(base_url, server)
+        number = 0
+        for level in levels:
+            total = args.requests or 2 * level
+            urls = []
+            for index in range(total):
+                urls.append((durations[index % len(durations)], bench_url(durations[index % len(durations)], number)))
+                number += 1
+            result = _run_level(base_url, server.pid, temp_dir, level, urls)
+            results.append(result)
+            _print_result(result)
+        results_payload = {"levels": results, "fake_whisper": whisper.stats, "args": _jsonable(vars(args))}
+        if args.output:
+            args.output.write_text(json.dumps(results_payload, ensure_ascii=False, indent=2), encoding="utf-8")
+            print(f"Results saved to {args.output}")
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        media.shutdown()
+        whisper.shutdown()
+        shutil.rmtree(work_root, ignore_errors=True)
+
+
+def _run_level(base_url: str, server_pid: int, temp_dir: Path, level: int, urls: List[Tuple[int, str]]) -> dict:
+    before = _scrape_metrics(base_url)
+    sampler = _ResourceSampler(server_pid, temp_dir).start()
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+
+    def call(item: Tuple[int, str]) -> None:
+        started = time.perf_counter()
+        try:
+            status = requests.post(f"{base_url}/analyze", json={"url": item[1]}, timeout=1800).status_code
+        except requests.RequestException:
+            status = 0
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=level) as pool:
+        list(pool.map(call, urls))
+    wall = time.perf_counter() - started
+    sampler.stop()
+    after = _scrape_metrics(base_url)
+
+    stage_means = {}
+    for name in (*_STAGES, "whisper_chunk"):
+        total_sum = after.get((name, "sum"), 0.0) - before.get((name, "sum"), 0.0)
+        total_count = after.get((name, "count"), 0.0) - before.get((name, "count"), 0.0)
+        if total_count:
+            stage_means[name] = round(total_sum / total_count, 3)
+
+    ordered = sorted(latencies)
+    audio_seconds = sum(duration for duration, _ in urls)
+    return {
+        "concurrency": level,
+        "requests": len(urls),
+        "statuses": statuses,
+        "wall_seconds": round(wall, 2),
+        "requests_per_second": round(len(urls) / wall, 3),
+        "audio_minutes_per_minute": round(audio_seconds / wall, 2),
+        "latency_p50": round(statistics.median(ordered), 2),
+        "latency_p95": round(ordered[max(0, int(len(ordered) * 0.95) - 1)], 2),
+        "latency_max": round(ordered[-1], 2),
+        "stage_mean_seconds": stage_means,
+        "peak_rss_mb": round(sampler.peak_rss / 1024 / 1024, 1),
+        "peak_temp_mb": round(sampler.peak_disk / 1024 / 1024, 1),
+    }
+
+
+def _print_result(result: dict) -> None:
+    statuses = ", ".join(f"{status}: {count}" for status, count in sorted(result["statuses"].items()))
+    stages = ", ".join(f"{name} {value:.2f}s" for name, value in result["stage_mean_seconds"].items())
+    print(
+        f"\n== concurrency {result['concurrency']}: {result['requests']} requests ({statuses}) "
+        f"in {result['wall_seconds']}s\n"
+        f"   throughput: {result['requests_per_second']} req/s, {result['audio_minutes_per_minute']} audio min/min\n"
+        f"   latency: p50 {result['latency_p50']}s, p95 {result['latency_p95']}s, max {result['latency_max']}s\n"
+        f"   stages (mean): {stages}\n"
+        f"   peak RSS: {result['peak_rss_mb']} MB, peak temp disk: {result['peak_temp_mb']} MB"
+    )
+
+
+def _scrape_metrics(base_url: str) -> Dict[Tuple[str, str], float]:
+    """Суммы и количества гистограмм этапов и частей Whisper по всем меткам."""
+    totals: Dict[Tuple[str, str], float] = {}
+    text = requests.get(f"{base_url}/metrics", timeout=30).text
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if not match:
+            continue
+        metric, kind, labels, value = match.groups()
+        if metric == "video_api_stage_duration_seconds":
+            stage = re.search(r'stage="([^"]+)"', labels)
+            name = stage.group(1) if stage else None
+        elif metric == "video_api_whisper_chunk_duration_seconds":
+            name = "whisper_chunk"
+        else:
+            continue
+        if name:
+            totals[(name, kind)] = totals.get((name, kind), 0.0) + float(value)
+    return totals
+
+
+class _ResourceSampler:
+    """Пиковый RSS дерева процессов сервиса (включая ffmpeg) и размер TEMP_DIR; только Linux."""
+
+    def __init__(self, root_pid: int, temp_dir: Path) -> None:
+        self.root_pid = root_pid
+        self.temp_dir = temp_dir
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "_ResourceSampler":
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(_SAMPLE_INTERVAL_SECONDS):
+            self.peak_rss = max(self.peak_rss, sum(_rss_bytes(pid) for pid in _process_tree(self.root_pid)))
+            self.peak_disk = max(self.peak_disk, _directory_size(self.temp_dir))
+
+
+def _process_tree(root_pid: int) -> List[int]:
+    children: Dict[int, List[int]] = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            ppid = int((entry / "stat").read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry.name))
+    tree, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        tree.append(pid)
+        pending.extend(children.get(pid, []))
+    return tree
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _directory_size(path: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+    return total
+
+
+def _wait_ready(base_url: str, server: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Benchmark server exited with code {server.returncode}")
+        try:
+            if requests.get(f"{base_url}/stats", timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Benchmark server did not start in time")
+
+
+def _jsonable(values: dict) -> dict:
+    return {name: str(value) if isinstance(value, Path) else value for name, value in values.items()}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк старта воркеров: импорт приложения, YoutubeDL и холодный запрос.
+
+Три замера:
+- import: время `import app.main` в свежем интерпретаторе (медиана) и
+  какие тяжёлые пакеты при этом загружены;
+- ydl: probe ролика медиасервера с новым YoutubeDL на каждый вызов и с
+  пулом готовых экземпляров;
+- boot: запуск gunicorn (benchmarks/bench_server.py) без preload и с
+  GUNICORN_PRELOAD=1 - время до первого ответа /stats, задержка первого
+  /analyze каждого воркера и следующего за ним.
+
+Пример:
+    python -m benchmarks.startup_bench --runs 5 --workers 2
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import requests
+
+from .bench_server import bench_url
+from .fake_media import MediaServer, generate_media, media_name
+from .fake_whisper import FakeWhisperServer
+
+ROOT = Path(__file__).resolve().parent.parent
+_HEAVY_MODULES = ("openai", "httpx", "yt_dlp", "faster_whisper")
+_IMPORT_SNIPPET = (
+    "import json, sys, time\n"
+    "started = time.perf_counter()\n"
+    "import app.main\n"
+    "elapsed = time.perf_counter() - started\n"
+    "print(json.dumps({'seconds': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))\n"
+)
+_DURATION = 30
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Worker startup benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Повторов замера импорта")
+    parser.add_argument("--ydl-calls", type=int, default=10, help="Вызовов probe в замере YoutubeDL")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8775)
+    parser.add_argument("--media-dir", type=Path, default=ROOT / "benchmarks" / ".media")
+    parser.add_argument("--skip", action="append", default=[], choices=("import", "ydl", "boot"))
+    parser.add_argument("--output", type=Path, help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    generate_media(args.media_dir, [_DURATION], "audio")
+    media = MediaServer(args.media_dir).start()
+    whisper = FakeWhisperServer(latency=0.05, latency_per_minute=0.0).start()
+    work_root = Path(tempfile.mkdtemp(prefix="video-api-startup-"))
+    env = dict(os.environ)
+    env.update(
+        {
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": whisper.base_url,
+            "BENCH_MEDIA_URL": media.base_url,
+            "BENCH_MEDIA_EXT": media_name(0, "audio").split(".")[-1],
+            "TEMP_DIR": str(work_root / "tmp"),
+            "STATE_DIR": str(work_root / "state"),
+            "PROMETHEUS_MULTIPROC_DIR": str(work_root / "state" / "prometheus"),
+            "WHISPER_REQUESTS_PER_MINUTE": "0",
+            "PREFLIGHT_PROBE_ENABLED": "0",
+        }
+    )
+
+    results: Dict[str, object] = {}
+    try:
+        if "import" not in args.skip:
+            results["import"] = _measure_import(env, args.runs)
+            _print_import(results["import"])
+        if "ydl" not in args.skip:
+            results["ydl"] = _measure_ydl(env, f"{media.base_url}/{media_name(_DURATION, 'audio')}", args.ydl_calls)
+            _print_ydl(results["ydl"])
+        if "boot" not in args.skip:
+            boot = {}
+            for preload in (False, True):
+                label = "preload" if preload else "no_preload"
+                boot[label] = _measure_boot(env, work_root, args.workers, args.port, preload)
+                _print_boot(label, boot[label])
+            results["boot"] = boot
+        if args.output:
+            args.output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+            print(f"Results saved to {args.output}")
+    finally:
+        media.shutdown()
+        whisper.shutdown()
+        shutil.rmtree(work_root, ignore_errors=True)
+
+
+def _measure_import(env: Dict[str, str], runs: int) -> dict:
+    timings: List[float] = []
+    loaded: List[str] = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-c", _IMPORT_SNIPPET % (_HEAVY_MODULES,)],
+            cwd=ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        payload = json.loads(completed.stdout.strip().splitlines()[-1])
+        timings.append(payload["seconds"])
+        loaded = payload["loaded"]
+    return {
+        "median_seconds": round(statistics.median(timings), 3),
+        "min_seconds": round(min(timings), 3),
+        "heavy_modules_loaded": loaded,
+    }
+
+
+def _measure_ydl(env: Dict[str, str], media_url: str, calls: int) -> dict:
+    # Отдельный процесс: настройки приложения читаются из окружения при импорте
+    snippet = (
+        "import json, time\n"
+        "from app import ydl_pool\n"
+        "from app.downloader import probe_video\n"
+        "result = {}\n"
+        "for label, max_idle in (('fresh', 0), ('pooled', 4)):\n"
+        "    ydl_pool.configure(max_idle=max_idle)\n"
+        "    probe_video(%(url)r)\n"
+        "    timings = []\n"
+        "    for _ in range(%(calls)d):\n"
+        "        started = time.perf_counter()\n"
+        "        probe_video(%(url)r)\n"
+        "        timings.append(time.perf_counter() - started)\n"
+        "    timings.sort()\n"
+        "    result[label] = {'median_seconds': round(timings[len(timings) // 2], 4), 'max_seconds': round(timings[-1], 4)}\n"
+        "result['pool'] = ydl_pool.get_pool_stats()\n"
+        "print(json.dumps(result))\n"
+    ) % {"url": media_url, "calls": max(1, calls)}
+    completed = subprocess.run(
+        [sys.executable, "-c", snippet], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _measure_boot(env: Dict[str, str], work_root: Path, workers: int, port: int, preload: bool) -> dict:
+    server_env = dict(env, GUNICORN_PRELOAD="1" if preload else "0")
+    # Каждый запуск - со свежим состоянием, чтобы кэш ответов не отвечал за сервис
+    state_dir = work_root / f"state-{'preload' if preload else 'plain'}"
+    server_env.update({"STATE_DIR": str(state_dir), "PROMETHEUS_MULTIPROC_DIR": str(state_dir / "prometheus")})
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_server", "--port", str(port), "--workers", str(workers)],
+        cwd=ROOT,
+        env=server_env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        ready_seconds = _wait_ready(base_url, server)
+        # Первый запрос каждого воркера холодный; gunicorn раздаёт соединения
+        # воркерам как придётся, поэтому отправляем по два запроса на воркер
+        latencies = []
+        for number in range(2 * workers):
+            request_started = time.perf_counter()
+            status = requests.post(
+                f"{base_url}/analyze", json={"url": bench_url(_DURATION, number)}, timeout=600
+            ).status_code
+            latencies.append((status, time.perf_counter() - request_started))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return {
+        "ready_seconds": round(ready_seconds, 3),
+        "first_request_seconds": round(latencies[0][1], 3),
+        "later_request_median_seconds": round(statistics.median(seconds for _, seconds in latencies[workers:]), 3),
+        "statuses": sorted({status for status, _ in latencies}),
+        "wall_seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def _wait_ready(base_url: str, server: subprocess.Popen, timeout: float = 60.0) -> float:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if server.poll() is not None:
+            raise RuntimeError(f"Benchmark server exited with code {server.returncode}")
+        try:
+            if requests.get(f"{base_url}/stats", timeout=2).ok:
+                return time.perf_counter() - started
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError("Benchmark server did not start in time")
+
+
+def _print_import(result: dict) -> None:
+    loaded = ", ".join(result["heavy_modules_loaded"]) or "none"
+    print(
+        f"\n== import app.main: median {result['median_seconds']}s, min {result['min_seconds']}s "
+        f"(heavy modules loaded: {loaded})"
+    )
+
+
+def _print_ydl(result: dict) -> None:
+    print(
+        f"\n== probe_video: fresh YoutubeDL median {result['fresh']['median_seconds']}s, "
+        f"pooled median {result['pooled']['median_seconds']}s\n"
+        f"   pool: {result['pool']}"
+    )
+
+
+def _print_boot(label: str, result: dict) -> None:
+    print(
+        f"\n== gunicorn {label}: ready in {result['ready_seconds']}s, "
+        f"first /analyze {result['first_request_seconds']}s, "
+        f"later /analyze median {result['later_request_median_seconds']}s (statuses {result['statuses']})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Хуки gunicorn для метрик Prometheus в multiprocess-режиме и прогрева воркеров.
+# Параметры запуска (воркеры, таймауты) задаются в start_production.sh.
+import os
+import shutil
+import sys
+import threading
+from pathlib import Path
+
+# Каталог задаётся до загрузки приложения, чтобы воркеры унаследовали переменную
+_state_dir = Path(os.getenv("STATE_DIR", "/tmp/video_api_state"))
+metrics_dir = Path(os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", str(_state_dir / "prometheus")))
+
+# GUNICORN_PRELOAD=1: приложение загружается и прогревается в мастере один раз,
+# воркеры получают его через fork (copy-on-write) и сразу принимают запросы.
+# Изменённый код при этом подхватывается только полным перезапуском.
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+# GUNICORN_THREADS > 1: воркеры gthread обрабатывают несколько запросов
+# одновременно, и очереди этапов (STAGE_*) распределяют между ними
+# скачивание, ffmpeg и Whisper. Sync-воркер (1 поток) обрабатывает один
+# запрос за раз, и очереди этапов ограничивают только фоновые потоки
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+
+
+def on_starting(server):
+    # Файлы прошлого запуска исказили бы счётчики
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+
+
+def when_ready(server):
+    # Мастер только загружает модули и наполняет пулы: потоки (задачи /jobs,
+    # уборка scratch) в нём не запускаются, fork их всё равно не унаследует
+    if preload_app:
+        from app.pipeline import warm_up
+
+        warm_up()
+
+
+def post_worker_init(worker):
+    # Без preload воркер прогревается в фоне и не задерживает приём запросов;
+    # после preload это лишь проверка, что пул уже заполнен
+    from app.pipeline import warm_up
+
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+    # Задачи /jobs, оставшиеся в очереди, подхватываются без ожидания первого запроса
+    main = sys.modules.get("app.main")
+    if main is not None:
+        main.job_runner.ensure_started()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
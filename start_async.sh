@@ -0,0 +1,14 @@
+#!/bin/bash
+# Asynchronous (ASGI) server: one process serves many concurrent analyses
+
+# Load environment variables
+if [ -f .env ]; then
+    export $(cat .env | grep -v '#' | xargs)
+fi
+
+uvicorn \
+    --host 0.0.0.0 \
+    --port "${PORT:-8000}" \
+    --timeout-keep-alive 5 \
+    --log-level info \
+    "app.asgi:app"
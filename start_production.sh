@@ -8,6 +8,7 @@ fi
 
 # Start gunicorn with configuration for long-running requests
 gunicorn \
+    --config gunicorn.conf.py \
     --workers 2 \
     --timeout 600 \
     --graceful-timeout 600 \
@@ -0,0 +1,76 @@
+import subprocess
+import sys
+import time
+from contextlib import closing
+
+import pytest
+
+from app.admission import LANE_LONG, LANE_STANDARD, AdmissionLedger, OverCapacityError
+from app.utils import open_sqlite
+
+
+def _ledger(tmp_path, capacity_minutes=10, long_job_seconds=3600, long_job_slots=1):
+    return AdmissionLedger(
+        tmp_path / "admission.sqlite3",
+        capacity_audio_seconds=capacity_minutes * 60,
+        long_job_seconds=long_job_seconds,
+        long_job_slots=long_job_slots,
+        retry_after_seconds=30,
+    )
+
+
+def test_rejects_when_capacity_is_used(tmp_path):
+    ledger = _ledger(tmp_path)
+    first = ledger.admit("a", 360)
+
+    with pytest.raises(OverCapacityError) as error:
+        ledger.admit("b", 300)
+
+    assert error.value.retry_after == 30
+    first.release()
+    ledger.admit("b", 300)
+    stats = ledger.stats()
+    assert (stats["admitted"], stats["shed"], stats["inflight_jobs"]) == (2, 1, 1)
+
+
+def test_single_request_larger_than_capacity_is_admitted(tmp_path):
+    admission = _ledger(tmp_path).admit("huge", 3000)
+
+    assert admission.lane == LANE_STANDARD
+
+
+def test_zero_capacity_disables_limit(tmp_path):
+    ledger = _ledger(tmp_path, capacity_minutes=0)
+
+    for number in range(5):
+        ledger.admit(f"job-{number}", 3000)
+
+
+def test_long_jobs_use_separate_slots(tmp_path):
+    ledger = _ledger(tmp_path, capacity_minutes=1)
+    long_job = ledger.admit("long", 7200)
+    assert long_job.lane == LANE_LONG
+
+    # Длинная задача не занимает общую ёмкость
+    ledger.admit("short", 50)
+    with pytest.raises(OverCapacityError) as error:
+        ledger.admit("long-2", 4000)
+
+    assert error.value.retry_after == 120
+    long_job.release()
+    ledger.admit("long-2", 4000)
+
+
+def test_entries_of_dead_workers_are_purged(tmp_path):
+    ledger = _ledger(tmp_path)
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    with closing(open_sqlite(ledger.path)) as connection:
+        connection.execute(
+            "INSERT INTO inflight (trace_id, lane, audio_seconds, pid, started_at) VALUES (?, ?, ?, ?, ?)",
+            ("dead", LANE_STANDARD, 600, process.pid, time.time()),
+        )
+
+    ledger.admit("alive", 600)
+
+    assert ledger.stats()["inflight_jobs"] == 1
@@ -0,0 +1,53 @@
+import pytest
+
+from app.audio_splitter import plan_chunk_boundaries
+
+
+def _lengths(duration, boundaries):
+    points = [0.0, *boundaries, duration]
+    return [end - start for start, end in zip(points, points[1:])]
+
+
+def test_short_audio_is_not_cut():
+    assert plan_chunk_boundaries(100.0, 100.0, []) == []
+    assert plan_chunk_boundaries(50.0, 100.0, [(10.0, 12.0)]) == []
+
+
+def test_cuts_at_limit_without_pauses():
+    assert plan_chunk_boundaries(250.0, 100.0, []) == [100.0, 200.0]
+
+
+def test_boundary_moves_to_nearest_pause_before_limit():
+    # Пауза 88-90: середина 89 ближе к расчётной точке 100, чем пауза на 75
+    boundaries = plan_chunk_boundaries(250.0, 100.0, [(74.0, 76.0), (88.0, 90.0)])
+
+    assert boundaries[0] == pytest.approx(89.0)
+    assert all(length <= 100.0 for length in _lengths(250.0, boundaries))
+
+
+def test_pause_after_limit_is_never_used():
+    boundaries = plan_chunk_boundaries(150.0, 100.0, [(104.0, 106.0)])
+
+    assert boundaries == [100.0]
+
+
+def test_pause_outside_search_window_is_ignored():
+    boundaries = plan_chunk_boundaries(150.0, 100.0, [(20.0, 22.0)])
+
+    assert boundaries == [100.0]
+
+
+def test_equal_length_chunks():
+    boundaries = plan_chunk_boundaries(300.0, 120.0, [], equal_length=True)
+
+    assert boundaries == pytest.approx([100.0, 200.0])
+
+
+@pytest.mark.parametrize("equal_length", [False, True])
+def test_no_chunk_exceeds_limit(equal_length):
+    silences = [(start, start + 0.5) for start in range(7, 1000, 13)]
+
+    boundaries = plan_chunk_boundaries(1000.0, 90.0, silences, equal_length)
+
+    assert boundaries == sorted(boundaries)
+    assert all(0 < length <= 90.0 for length in _lengths(1000.0, boundaries))
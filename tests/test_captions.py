@@ -0,0 +1,102 @@
+import pytest
+
+from app.captions import (
+    TRANSCRIPT_SOURCE_AUTO,
+    TRANSCRIPT_SOURCE_MANUAL,
+    CaptionsError,
+    _choose_track,
+    parse_srv3,
+    parse_vtt,
+)
+
+VTT = """WEBVTT
+Kind: captions
+Language: en
+
+00:00:01.000 --> 00:00:03.500 align:start position:0%
+<c>Hello</c> &amp; welcome
+
+00:00:03.500 --> 00:00:06.000
+Hello &amp; welcome
+to the show
+
+01:02:03.250 --> 01:02:04.000
+bye
+"""
+
+
+def _segments(segments):
+    return [(segment.start, segment.end, segment.text) for segment in segments]
+
+
+def test_parse_vtt_strips_tags_and_repeated_lines():
+    assert _segments(parse_vtt(VTT)) == [
+        (1.0, 3.5, "Hello & welcome"),
+        (3.5, 6.0, "to the show"),
+        (3723.25, 3724.0, "bye"),
+    ]
+
+
+def test_parse_vtt_accepts_short_timestamps():
+    raw = "WEBVTT\n\n00:01.500 --> 00:02.000\nhi\n"
+
+    assert _segments(parse_vtt(raw)) == [(1.5, 2.0, "hi")]
+
+
+def test_parse_srv3():
+    raw = (
+        '<?xml version="1.0" encoding="utf-8" ?><timedtext format="3"><body>'
+        '<p t="1000" d="2500"><s>Hello</s><s> world</s></p>'
+        '<p t="4000" d="1000">   </p>'
+        '<p t="5000" d="500">again</p>'
+        "</body></timedtext>"
+    )
+
+    assert _segments(parse_srv3(raw)) == [(1.0, 3.5, "Hello world"), (5.0, 5.5, "again")]
+
+
+def test_parse_srv3_rejects_invalid_xml():
+    with pytest.raises(CaptionsError):
+        parse_srv3("<timedtext><p>")
+
+
+def _formats(name):
+    return [{"ext": "json3", "url": f"{name}.json3"}, {"ext": "vtt", "url": f"{name}.vtt"}]
+
+
+def test_manual_subtitles_are_preferred():
+    info = {
+        "language": "en",
+        "subtitles": {"en-US": _formats("manual")},
+        "automatic_captions": {"en-orig": _formats("auto")},
+    }
+
+    language, caption_format, source = _choose_track(info, ["en"])
+
+    assert (language, caption_format["url"], source) == ("en", "manual.vtt", TRANSCRIPT_SOURCE_MANUAL)
+
+
+def test_auto_captions_use_original_track():
+    info = {"language": "en", "automatic_captions": {"en-orig": _formats("orig"), "en": _formats("en")}}
+
+    language, caption_format, source = _choose_track(info, ["en"])
+
+    assert (caption_format["url"], source) == ("orig.vtt", TRANSCRIPT_SOURCE_AUTO)
+
+
+def test_auto_captions_in_video_language_without_orig_track():
+    info = {"language": "ru", "automatic_captions": {"ru": _formats("ru")}}
+
+    assert _choose_track(info, ["ru", "en"])[1]["url"] == "ru.vtt"
+
+
+def test_machine_translated_auto_captions_are_skipped():
+    info = {"language": "en", "automatic_captions": {"ru": _formats("ru"), "en-orig": _formats("en")}}
+
+    assert _choose_track(info, ["ru"]) is None
+
+
+def test_no_track_without_usable_format():
+    info = {"language": "en", "subtitles": {"en": [{"ext": "json3", "url": "x"}]}}
+
+    assert _choose_track(info, ["en"]) is None
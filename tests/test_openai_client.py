@@ -0,0 +1,51 @@
+import time
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import pytest
+
+from app import openai_client
+from app.openai_client import _backoff_delay, _retry_after_seconds
+
+
+def _error(headers):
+    return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+
+def test_retry_after_seconds():
+    assert _retry_after_seconds(_error({"retry-after": "5"})) == 5.0
+
+
+def test_retry_after_milliseconds_take_precedence():
+    assert _retry_after_seconds(_error({"retry-after-ms": "1500", "retry-after": "9"})) == 1.5
+
+
+def test_retry_after_http_date():
+    header = formatdate(time.time() + 30, usegmt=True)
+
+    assert _retry_after_seconds(_error({"retry-after": header})) == pytest.approx(30, abs=2)
+
+
+def test_retry_after_date_in_past_is_zero():
+    header = formatdate(time.time() - 30, usegmt=True)
+
+    assert _retry_after_seconds(_error({"retry-after": header})) == 0.0
+
+
+@pytest.mark.parametrize("headers", [{}, {"retry-after": "soon"}, {"retry-after": "Mon, 99 Foo 2024"}])
+def test_missing_or_malformed_retry_after(headers):
+    assert _retry_after_seconds(_error(headers)) is None
+
+
+def test_error_without_response():
+    assert _retry_after_seconds(ValueError("boom")) is None
+
+
+def test_backoff_respects_retry_after_and_cap(monkeypatch):
+    monkeypatch.setattr(openai_client.random, "uniform", lambda low, high: high)
+    settings = openai_client._settings
+
+    assert _backoff_delay(1, None) == settings.backoff_base
+    assert _backoff_delay(30, None) == settings.backoff_max
+    assert _backoff_delay(1, 10.0) == 10.0
+    assert _backoff_delay(1, 10_000.0) == settings.retry_after_cap
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from app import rate_governor as rate_governor_module
+from app.rate_governor import RateGovernor, RateGovernorTimeout
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(rate_governor_module.time, "sleep", calls.append)
+    return calls
+
+
+def _governor(tmp_path, requests_per_minute=0.0, audio_seconds_per_minute=0.0, max_wait_seconds=120.0):
+    return RateGovernor(tmp_path / "quota.sqlite3", requests_per_minute, audio_seconds_per_minute, max_wait_seconds)
+
+
+def test_disabled_limits_never_wait(tmp_path, sleeps):
+    governor = _governor(tmp_path)
+
+    assert [governor.acquire(600.0) for _ in range(5)] == [0.0] * 5
+    assert sleeps == []
+
+
+def test_requests_queue_up_once_bucket_is_empty(tmp_path, sleeps):
+    governor = _governor(tmp_path, requests_per_minute=2)
+
+    waits = [governor.acquire() for _ in range(3)]
+
+    # Два токена есть сразу, третий пополнится через 30 с (2 в минуту)
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(30.0, abs=0.5)
+    assert sleeps == [waits[2]]
+    stats = governor.stats()
+    assert (stats["acquired"], stats["throttled"]) == (3, 1)
+
+
+def test_audio_cost_is_capped_by_bucket_capacity(tmp_path, sleeps):
+    governor = _governor(tmp_path, audio_seconds_per_minute=60)
+
+    assert governor.acquire(600.0) == 0.0
+    assert governor.acquire(30.0) == pytest.approx(30.0, abs=0.5)
+
+
+def test_wait_over_limit_raises_with_expected_wait(tmp_path, sleeps):
+    governor = _governor(tmp_path, requests_per_minute=1, max_wait_seconds=10)
+    governor.acquire()
+
+    with pytest.raises(RateGovernorTimeout) as error:
+        governor.acquire()
+
+    assert error.value.wait == pytest.approx(60.0, abs=0.5)
+    assert sleeps == []
+    # Отказ не занимает квоту
+    assert governor.stats()["acquired"] == 1
+
+
+def test_until_bounds_wait_by_deadline(tmp_path, sleeps):
+    governor = _governor(tmp_path, requests_per_minute=2)
+    governor.acquire()
+    governor.acquire()
+
+    with pytest.raises(RateGovernorTimeout):
+        governor.until(time.monotonic() + 5).acquire()
+
+    assert governor.until(None) is governor
+    assert governor.deadline is None
+    assert governor.until(time.monotonic() + 60).acquire() == pytest.approx(30.0, abs=0.5)
+
+
+def test_buckets_are_shared_between_instances(tmp_path, sleeps):
+    first = _governor(tmp_path, requests_per_minute=1)
+    second = _governor(tmp_path, requests_per_minute=1)
+
+    assert first.acquire() == 0.0
+    assert second.acquire() == pytest.approx(60.0, abs=0.5)
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from app.scratch import ScratchArea, ScratchBudgetError, ScratchSpace
+
+MB = 1024 * 1024
+
+
+def _space(tmp_path, disk_mb=10, ram_mb=None, ram_job_mb=0, orphan_age_seconds=300.0):
+    ram = None
+    if ram_mb is not None:
+        ram = ScratchArea("ram", tmp_path / "ram", ram_mb * MB, ram_job_mb * MB)
+    return ScratchSpace(
+        ScratchArea("disk", tmp_path / "disk", disk_mb * MB),
+        ram=ram,
+        wait_seconds=0,
+        orphan_age_seconds=orphan_age_seconds,
+        janitor_interval_seconds=0,
+    )
+
+
+def test_small_jobs_go_to_ram_and_large_to_disk(tmp_path):
+    space = _space(tmp_path, ram_mb=4, ram_job_mb=2)
+
+    small = space.acquire("small", 1 * MB)
+    large = space.acquire("large", 3 * MB)
+
+    assert (small.area, large.area) == ("ram", "disk")
+    assert small.path.parent == tmp_path / "ram"
+    small.release()
+    large.release()
+    assert not small.path.exists() and not large.path.exists()
+
+
+def test_ram_overflow_falls_back_to_disk(tmp_path):
+    space = _space(tmp_path, ram_mb=2)
+
+    first = space.acquire("first", int(1.5 * MB))
+    second = space.acquire("second", 1 * MB)
+
+    assert (first.area, second.area) == ("ram", "disk")
+
+
+def test_budget_exhausted(tmp_path):
+    space = _space(tmp_path, disk_mb=2)
+    held = space.acquire("held", int(1.5 * MB))
+
+    with pytest.raises(ScratchBudgetError):
+        space.acquire("next", 1 * MB)
+
+    held.release()
+    space.acquire("next", 1 * MB).release()
+    assert space.stats()["rejected"] == 1
+
+
+def test_actual_size_counts_when_above_reservation(tmp_path):
+    space = _space(tmp_path, disk_mb=2)
+    held = space.acquire("held", 1)
+    (held.path / "audio.bin").write_bytes(b"\0" * int(1.5 * MB))
+
+    with pytest.raises(ScratchBudgetError):
+        space.acquire("next", 1 * MB)
+
+
+def _orphan(space, trace_id, size=0):
+    scratch = space.acquire(trace_id, size)
+    if size:
+        (scratch.path / "audio.bin").write_bytes(b"\0" * size)
+    # Процесс-владелец "умер": блокировка аренды снята, каталог остался
+    os.close(scratch._lease_fd)
+    scratch._lease_fd = None
+    return scratch.path
+
+
+def test_reclaim_removes_old_orphans_only(tmp_path):
+    space = _space(tmp_path, orphan_age_seconds=60)
+    orphan = _orphan(space, "orphan")
+    old = os.stat(orphan).st_mtime - 120
+    os.utime(orphan, (old, old))
+    fresh_orphan = _orphan(space, "fresh")
+    live = space.acquire("live", 0)
+
+    assert space.reclaim()[0] == 1
+    assert not orphan.exists()
+    assert fresh_orphan.exists() and live.path.exists()
+    live.release()
+
+
+def test_fresh_orphans_are_reclaimed_when_budget_is_short(tmp_path):
+    space = _space(tmp_path, disk_mb=2)
+    orphan = _orphan(space, "orphan", int(1.5 * MB))
+
+    scratch = space.acquire("next", 1 * MB)
+
+    assert not orphan.exists()
+    assert space.stats()["reclaimed_dirs"] == 1
+    scratch.release()
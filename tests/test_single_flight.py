@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from app import single_flight as single_flight_module
+from app.single_flight import FlightWaitTimeout, SingleFlight
+
+
+@pytest.fixture
+def follower_blocked(monkeypatch):
+    """Событие: ведомый хотя бы раз упёрся в блокировку ведущего."""
+    blocked = threading.Event()
+    try_lock = single_flight_module._try_lock
+
+    def _try_lock(lock_file):
+        locked = try_lock(lock_file)
+        if not locked:
+            blocked.set()
+        return locked
+
+    monkeypatch.setattr(single_flight_module, "_try_lock", _try_lock)
+    monkeypatch.setattr(single_flight_module, "_POLL_INTERVAL_SECONDS", 0.05)
+    return blocked
+
+
+def _single_flight(tmp_path, wait_timeout=5.0):
+    return SingleFlight(tmp_path / "inflight", wait_timeout=wait_timeout, handoff_ttl=300)
+
+
+def _follow(single_flight, key, results):
+    thread = threading.Thread(target=lambda: results.append(single_flight.begin(key)))
+    thread.start()
+    return thread
+
+
+def test_follower_receives_leader_result(tmp_path, follower_blocked):
+    leader = _single_flight(tmp_path).begin("video")
+    assert leader.is_leader
+
+    results = []
+    thread = _follow(_single_flight(tmp_path), "video", results)
+    assert follower_blocked.wait(timeout=5)
+    leader.publish({"transcript": "hello"})
+    leader.release()
+    thread.join(timeout=10)
+
+    assert not results[0].is_leader
+    assert results[0].result == {"transcript": "hello"}
+
+
+def test_follower_takes_over_when_leader_fails(tmp_path, follower_blocked):
+    leader = _single_flight(tmp_path).begin("video")
+
+    results = []
+    thread = _follow(_single_flight(tmp_path), "video", results)
+    assert follower_blocked.wait(timeout=5)
+    leader.release()
+    thread.join(timeout=10)
+
+    assert results[0].is_leader
+    results[0].release()
+
+
+def test_follower_gives_up_after_wait_timeout(tmp_path):
+    leader = _single_flight(tmp_path).begin("video")
+    try:
+        with pytest.raises(FlightWaitTimeout):
+            _single_flight(tmp_path, wait_timeout=0.6).begin("video")
+    finally:
+        leader.release()
+
+
+def test_different_keys_do_not_wait(tmp_path):
+    single_flight = _single_flight(tmp_path, wait_timeout=0.1)
+    first = single_flight.begin("first")
+    second = single_flight.begin("second")
+
+    assert first.is_leader and second.is_leader
+    first.release()
+    second.release()
@@ -0,0 +1,58 @@
+import pytest
+
+from app.transcriber import TranscriptionResult, TranscriptionSegment
+from app.vad import OffsetMap, SpeechSpan, speech_regions
+
+
+def _offset_map():
+    # Речь 0-10 и 30-40 исходного аудио; тишина 10-30 вырезана
+    return OffsetMap([SpeechSpan(0.0, 0.0, 10.0), SpeechSpan(30.0, 10.0, 10.0)])
+
+
+def test_empty_map_keeps_time():
+    assert OffsetMap().to_original(12.5) == 12.5
+
+
+@pytest.mark.parametrize(
+    "trimmed, original",
+    [
+        (0.0, 0.0),
+        (5.0, 5.0),
+        (10.0, 30.0),
+        (15.5, 35.5),
+        (20.0, 40.0),
+        # Время за концом последнего отрезка не уходит дальше него
+        (25.0, 40.0),
+    ],
+)
+def test_to_original(trimmed, original):
+    assert _offset_map().to_original(trimmed) == pytest.approx(original)
+
+
+def test_apply_shifts_segments_and_keeps_text():
+    transcription = TranscriptionResult(
+        text="hello world",
+        language="en",
+        segments=[TranscriptionSegment(2.0, 4.0, "hello"), TranscriptionSegment(11.0, 13.0, "world")],
+    )
+
+    shifted = _offset_map().apply(transcription)
+
+    assert [(segment.start, segment.end, segment.text) for segment in shifted.segments] == [
+        (2.0, 4.0, "hello"),
+        (31.0, 33.0, "world"),
+    ]
+    assert (shifted.text, shifted.language) == ("hello world", "en")
+
+
+def test_speech_regions_keep_padding_around_silence():
+    regions = speech_regions([(10.0, 20.0), (30.0, 40.0)], duration=50.0, padding_seconds=1.0)
+
+    assert regions == [(0.0, 11.0), (19.0, 31.0), (39.0, 50.0)]
+
+
+def test_speech_regions_handle_edge_and_short_silences():
+    # У краёв файла padding остаётся только со стороны речи, короткая тишина не вырезается
+    regions = speech_regions([(0.0, 5.0), (20.0, 21.0), (45.0, 50.0)], duration=50.0, padding_seconds=1.0)
+
+    assert regions == [(4.0, 46.0)]
@@ -0,0 +1,176 @@
+import struct
+
+import pytest
+
+from app.wav_slicer import WavFormatError, WavSliceChunk, read_wav_info, slice_wav
+
+SAMPLE_RATE = 16000
+CHANNELS = 1
+BITS = 16
+BLOCK_ALIGN = CHANNELS * BITS // 8
+
+
+def _pcm(frames: int) -> bytes:
+    # Номер кадра в каждом сэмпле: любой сдвиг среза сразу виден
+    return b"".join(struct.pack("<H", frame % 65536) for frame in range(frames))
+
+
+def _fmt_chunk(format_tag: int = 1, bits: int = BITS) -> bytes:
+    block_align = CHANNELS * bits // 8
+    body = struct.pack("<HHIIHH", format_tag, CHANNELS, SAMPLE_RATE, SAMPLE_RATE * block_align, block_align, bits)
+    return b"fmt " + struct.pack("<I", len(body)) + body
+
+
+def _write_wav(path, data: bytes, extra_chunks: bytes = b"", data_size=None, fmt: bytes = None) -> None:
+    fmt = _fmt_chunk() if fmt is None else fmt
+    size = len(data) if data_size is None else data_size
+    body = b"WAVE" + fmt + extra_chunks + b"data" + struct.pack("<I", size) + data
+    path.write_bytes(b"RIFF" + struct.pack("<I", len(body)) + body)
+
+
+def _expected_header(data_size: int) -> bytes:
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        CHANNELS,
+        SAMPLE_RATE,
+        SAMPLE_RATE * BLOCK_ALIGN,
+        BLOCK_ALIGN,
+        BITS,
+        b"data",
+        data_size,
+    )
+
+
+def test_read_wav_info_skips_unknown_and_odd_sized_chunks(tmp_path):
+    data = _pcm(1000)
+    # Нечётный блок дополняется байтом до чётной длины
+    extra = b"LIST" + struct.pack("<I", 5) + b"abcde" + b"\x00"
+    path = tmp_path / "audio.wav"
+    _write_wav(path, data, extra_chunks=extra)
+
+    info = read_wav_info(path)
+
+    assert (info.channels, info.sample_rate, info.bits_per_sample) == (CHANNELS, SAMPLE_RATE, BITS)
+    assert info.data_size == len(data)
+    assert info.frame_count == 1000
+    assert path.read_bytes()[info.data_offset : info.data_offset + 4] == data[:4]
+
+
+def test_read_wav_info_uses_real_size_for_streamed_wav(tmp_path):
+    data = _pcm(500)
+    path = tmp_path / "pipe.wav"
+    _write_wav(path, data, data_size=0xFFFFFFFF)
+
+    assert read_wav_info(path).data_size == len(data)
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        b"not a wav file at all",
+        b"RIFF\x00\x00\x00\x00WAVE",
+    ],
+)
+def test_read_wav_info_rejects_invalid_files(tmp_path, content):
+    path = tmp_path / "bad.wav"
+    path.write_bytes(content)
+
+    with pytest.raises(WavFormatError):
+        read_wav_info(path)
+
+
+def test_read_wav_info_rejects_non_pcm(tmp_path):
+    path = tmp_path / "float.wav"
+    _write_wav(path, _pcm(10), fmt=_fmt_chunk(format_tag=3, bits=32))
+
+    with pytest.raises(WavFormatError):
+        read_wav_info(path)
+
+
+def test_read_wav_info_rejects_data_before_fmt(tmp_path):
+    data = _pcm(10)
+    body = b"WAVE" + b"data" + struct.pack("<I", len(data)) + data + _fmt_chunk()
+    path = tmp_path / "order.wav"
+    path.write_bytes(b"RIFF" + struct.pack("<I", len(body)) + body)
+
+    with pytest.raises(WavFormatError):
+        read_wav_info(path)
+
+
+def test_small_wav_is_a_single_chunk(tmp_path):
+    data = _pcm(SAMPLE_RATE)
+    path = tmp_path / "short.wav"
+    _write_wav(path, data)
+
+    chunks = slice_wav(path, max_size_mb=1.0, align_to_silence=False)
+
+    assert len(chunks) == 1
+    assert chunks[0].start == 0.0
+    assert chunks[0].duration == pytest.approx(1.0)
+    with chunks[0].open() as reader:
+        assert reader.read() == _expected_header(len(data)) + data
+
+
+def test_slices_have_exact_headers_and_sample_offsets(tmp_path):
+    frames = SAMPLE_RATE * 10
+    data = _pcm(frames)
+    path = tmp_path / "long.wav"
+    _write_wav(path, data, extra_chunks=b"LIST" + struct.pack("<I", 4) + b"info")
+    max_size_mb = 0.1
+
+    chunks = slice_wav(path, max_size_mb=max_size_mb, align_to_silence=False)
+
+    assert len(chunks) > 1
+    assert all(isinstance(chunk, WavSliceChunk) for chunk in chunks)
+    restored = b""
+    expected_frame = 0
+    for index, chunk in enumerate(chunks):
+        assert chunk.index == index
+        assert chunk.start_frame == expected_frame
+        assert chunk.start == expected_frame / SAMPLE_RATE
+        assert chunk.duration == chunk.frame_count / SAMPLE_RATE
+        assert chunk.size_bytes <= max_size_mb * 1024 * 1024
+        assert chunk.name == f"long_chunk_{index:03d}.wav"
+
+        with chunk.open() as reader:
+            payload = reader.read()
+        data_size = chunk.frame_count * BLOCK_ALIGN
+        assert len(payload) == chunk.size_bytes
+        assert payload[:44] == _expected_header(data_size)
+        # Первый сэмпл части - номер её первого кадра в исходнике
+        assert struct.unpack("<H", payload[44:46])[0] == chunk.start_frame % 65536
+        restored += payload[44:]
+        expected_frame += chunk.frame_count
+
+    assert expected_frame == frames
+    assert restored == data
+
+
+def test_slice_reader_supports_partial_reads_and_seek(tmp_path):
+    data = _pcm(SAMPLE_RATE * 4)
+    path = tmp_path / "seek.wav"
+    _write_wav(path, data)
+    chunk = slice_wav(path, max_size_mb=0.05, align_to_silence=False)[1]
+    offset = chunk.start_frame * BLOCK_ALIGN
+    expected = _expected_header(chunk.frame_count * BLOCK_ALIGN) + data[offset : offset + chunk.frame_count * BLOCK_ALIGN]
+
+    with chunk.open() as reader:
+        pieces = []
+        while True:
+            piece = reader.read(7)
+            if not piece:
+                break
+            pieces.append(piece)
+        assert b"".join(pieces) == expected
+
+        assert reader.seek(40) == 40
+        assert reader.read(10) == expected[40:50]
+        assert reader.seek(-4, 2) == len(expected) - 4
+        assert reader.read() == expected[-4:]
+        assert reader.tell() == len(expected)